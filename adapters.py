@@ -0,0 +1,247 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import POST_CACHE_POSTS, POLL_CONCURRENCY, VK_CONCURRENCY, TWITTER_CONCURRENCY, RSS_CONCURRENCY
+
+class Post:
+    """A post normalized across source types.
+
+    `id` orders posts within a source, `attachments` holds {'type', 'url'} dicts of
+    photos and videos.
+    """
+    __slots__ = ('id', 'text', 'link', 'date', 'attachments')
+
+    def __init__(self, id: Any, text: str, link: str, date: Optional[datetime] = None,
+                 attachments: List[Dict[str, str]] = ()):
+        self.id = id
+        self.text = text
+        self.link = link
+        self.date = date
+        self.attachments = attachments
+
+    def __repr__(self):
+        return f"Post({self.id!r}, {self.link!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'text': self.text,
+            'link': self.link,
+            'date': self.date.isoformat() if self.date is not None else None,
+            'attachments': list(self.attachments)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Post':
+        date = datetime.fromisoformat(data['date']) if data.get('date') else None
+        return cls(data['id'], data['text'], data['link'], date, data.get('attachments', []))
+
+def format_body(post: Post) -> str:
+    """The post's text followed by its link, if it has one."""
+    return f"{post.text}\n\n🔗 {post.link}" if post.link else post.text
+
+class SourceAdapter(ABC):
+    """A kind of source: how sources are looked up, polled and presented to chats.
+
+    Methods are coroutines. Adapters around blocking clients call them through `run`
+    (Poller.run), which keeps them off the event loop within the concurrency limits.
+    Texts are shown to users and formatted with the source's `name` and `id`.
+    """
+    source_type = ''
+    endpoint = ''  # Rate limiter endpoint that gates polling
+    concurrency = POLL_CONCURRENCY  # Simultaneous `run` calls for this source type
+    batch_size = 1  # Sources per fetch_new_batch call of a BatchFetcher; 1 means every source is fetched on its own
+    resolves_ids = True  # Whether sources have a platform ID that resolve() keeps fresh
+    add_command = ''
+    id_hint = ''
+    list_title = ''
+    list_item = "- {name} ({id})"
+    new_post_header = ''
+    latest_header = ''
+    added_text = ''
+    exists_text = ''
+    not_found_text = ''
+    usage_text = ''
+    unavailable_text = ''
+    reenabled_text = ''
+
+    def __init__(self, run: Callable[..., Awaitable[Any]]):
+        self.run = run
+
+    async def verify(self) -> str:
+        """Check the credentials and return what they resolved to; raises if they don't work."""
+        return self.source_type
+
+    @abstractmethod
+    async def resolve(self, source_id: str) -> Optional[Tuple[str, Any]]:
+        """Look a new source up: its display name and resolved ID, or None if it doesn't exist."""
+
+    @abstractmethod
+    async def fetch_new(self, source) -> List[Post]:
+        """Posts newer than the source's cursor, newest first; raises FetchError or RateLimitExceeded."""
+
+    @abstractmethod
+    async def fetch_latest(self, source, count: int = POST_CACHE_POSTS) -> List[Post]:
+        """The latest posts of a source regardless of its cursor, newest first."""
+
+    def cursor(self, source, posts: List[Post]) -> Any:
+        """The cursor to store after the given new posts were delivered, or None to keep it."""
+        return max(post.id for post in posts)
+
+    def pop_state(self, source) -> Optional[str]:
+        """Source state to save once the posts just fetched are handled, or None if it didn't change."""
+        return None
+
+    def format_post(self, source, post: Post) -> str:
+        return f"{self.new_post_header.format(name=source.name)}\n\n{format_body(post)}"
+
+class BatchFetcher(ABC):
+    """Mixin for adapters that can poll many sources with one request; used when batch_size is above 1."""
+
+    @abstractmethod
+    async def fetch_new_batch(self, sources: List[Any]) -> Dict[str, Optional[List[Post]]]:
+        """New posts of up to batch_size sources at once; failed sources map to None."""
+
+class AdapterRegistry:
+    """Source adapters by source type, in registration order."""
+
+    def __init__(self):
+        self._adapters: Dict[str, SourceAdapter] = {}
+
+    def register(self, adapter: SourceAdapter) -> SourceAdapter:
+        self._adapters[adapter.source_type] = adapter
+        return adapter
+
+    def get(self, source_type: str) -> Optional[SourceAdapter]:
+        return self._adapters.get(source_type)
+
+    def types(self) -> List[str]:
+        return list(self._adapters)
+
+    def __iter__(self) -> Iterator[SourceAdapter]:
+        return iter(list(self._adapters.values()))
+
+    def __contains__(self, source_type: str) -> bool:
+        return source_type in self._adapters
+
+class VKAdapter(SourceAdapter, BatchFetcher):
+    """VK groups, polled in batches through execute."""
+    source_type = 'vk'
+    endpoint = 'vk'
+    concurrency = VK_CONCURRENCY
+    add_command = 'add_vk_source'
+    id_hint = '<group_id>'
+    list_title = "VK группы:"
+    list_item = "- {name} (ID: {id})"
+    new_post_header = "📢 Новый пост из группы VK '{name}':"
+    latest_header = "📢 Последние посты из группы VK '{name}':"
+    added_text = "✅ Группа VK '{name}' успешно добавлена!"
+    exists_text = "❌ Эта группа уже добавлена."
+    not_found_text = "❌ Не удалось найти группу VK. Проверьте ID группы."
+    usage_text = "❌ Укажите ID группы VK. Пример: /add_vk_source 123456"
+    unavailable_text = "⚠️ VK сейчас недоступен. Попробуйте позже."
+    reenabled_text = "🔄 Группа снова будет проверяться."
+
+    def __init__(self, parser, run: Callable[..., Awaitable[Any]], batch_size: int = 1):
+        super().__init__(run)
+        self.parser = parser
+        self.batch_size = batch_size
+
+    async def verify(self) -> str:
+        return await self.run('vk', self.parser.verify)
+
+    async def resolve(self, source_id: str) -> Optional[Tuple[str, Any]]:
+        group_info = await self.run('vk', self.parser.get_group_info, source_id)
+        return (group_info['name'], group_info['id']) if group_info else None
+
+    async def fetch_new(self, source) -> List[Post]:
+        return await self.run('vk', self.parser.get_new_posts, source.id, source.last_post_id, source.resolved_id)
+
+    async def fetch_new_batch(self, sources: List[Any]) -> Dict[str, Optional[List[Post]]]:
+        return await self.run('vk', self.parser.get_new_posts_batch, sources)
+
+    async def fetch_latest(self, source, count: int = POST_CACHE_POSTS) -> List[Post]:
+        return await self.run('vk', self.parser.get_posts, source.id, count, source.resolved_id)
+
+class TwitterAdapter(SourceAdapter):
+    """Twitter accounts, polled one by one with server-side since_id."""
+    source_type = 'twitter'
+    endpoint = 'twitter:users_tweets'
+    concurrency = TWITTER_CONCURRENCY
+    add_command = 'add_twitter_source'
+    id_hint = '<username>'
+    list_title = "Twitter аккаунты:"
+    list_item = "- {name} (@{id})"
+    new_post_header = "🐦 Новый твит от {name}:"
+    latest_header = "🐦 Последние твиты от {name}:"
+    added_text = "✅ Аккаунт Twitter '{name}' успешно добавлен!"
+    exists_text = "❌ Этот аккаунт уже добавлен."
+    not_found_text = "❌ Не удалось найти пользователя Twitter. Проверьте имя пользователя."
+    usage_text = "❌ Укажите имя пользователя Twitter. Пример: /add_twitter_source elonmusk"
+    unavailable_text = "⚠️ Twitter сейчас недоступен. Попробуйте позже."
+    reenabled_text = "🔄 Аккаунт снова будет проверяться."
+
+    def __init__(self, parser, run: Callable[..., Awaitable[Any]]):
+        super().__init__(run)
+        self.parser = parser
+
+    async def verify(self) -> str:
+        return await self.run('twitter', self.parser.verify)
+
+    async def resolve(self, source_id: str) -> Optional[Tuple[str, Any]]:
+        user_info = await self.run('twitter', self.parser.get_user_info, source_id)
+        return (user_info.name, user_info.id) if user_info else None
+
+    async def fetch_new(self, source) -> List[Post]:
+        return await self.run('twitter', self.parser.fetch_tweets, source.id, source.last_post_id,
+                              source.resolved_id)
+
+    async def fetch_latest(self, source, count: int = POST_CACHE_POSTS) -> List[Post]:
+        return await self.run('twitter', self.parser.fetch_tweets, source.id, None, source.resolved_id, count)
+
+class RSSAdapter(SourceAdapter):
+    """RSS and Atom feeds by URL, fetched with conditional GET; seen items are tracked by GUID."""
+    source_type = 'rss'
+    endpoint = 'rss'
+    concurrency = RSS_CONCURRENCY
+    resolves_ids = False
+    add_command = 'add_rss_source'
+    id_hint = '<url>'
+    list_title = "RSS ленты:"
+    list_item = "- {name} ({id})"
+    new_post_header = "📰 Новое в ленте '{name}':"
+    latest_header = "📰 Последние записи ленты '{name}':"
+    added_text = "✅ Лента '{name}' успешно добавлена!"
+    exists_text = "❌ Эта лента уже добавлена."
+    not_found_text = "❌ Не удалось прочитать ленту. Проверьте, что ссылка ведёт на RSS или Atom."
+    usage_text = "❌ Укажите ссылку на RSS или Atom ленту. Пример: /add_rss_source https://example.com/feed.xml"
+    unavailable_text = "⚠️ RSS ленты сейчас недоступны. Попробуйте позже."
+    reenabled_text = "🔄 Лента снова будет проверяться."
+
+    def __init__(self, parser, run: Callable[..., Awaitable[Any]]):
+        super().__init__(run)
+        self.parser = parser
+        self._states: Dict[str, str] = {}  # Feed states fetched but not saved yet
+
+    async def resolve(self, source_id: str) -> Optional[Tuple[str, Any]]:
+        title = await self.run('rss', self.parser.get_feed_title, source_id)
+        return (title, None) if title else None
+
+    async def fetch_new(self, source) -> List[Post]:
+        posts, state = await self.run('rss', self.parser.get_new_posts, source.id, source.state)
+        if state != source.state:
+            self._states[source.id] = state
+        return posts
+
+    async def fetch_latest(self, source, count: int = POST_CACHE_POSTS) -> List[Post]:
+        return await self.run('rss', self.parser.get_posts, source.id, count)
+
+    def cursor(self, source, posts: List[Post]) -> Any:
+        # Items are tracked by GUID in the feed state instead
+        return None
+
+    def pop_state(self, source) -> Optional[str]:
+        return self._states.pop(source.id, None)
+
+registry = AdapterRegistry()
@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import math
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
+
+from config import (
+    ARCHIVE_FILE,
+    ARCHIVE_FLUSH_INTERVAL,
+    ARCHIVE_BATCH,
+    ARCHIVE_RETENTION_DAYS,
+    ARCHIVE_MAINTENANCE_INTERVAL,
+    SEARCH_CANDIDATES,
+    logger
+)
+from metrics import STORAGE_WRITE_SECONDS, SEARCH_SECONDS
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+PREFIX_MIN_LENGTH = 4  # Shorter words match exactly: prefixes of short common words expand to huge doclists
+MIN_STEM = 3
+# Common Russian inflection endings, dropped from query words so they match other forms of the word
+ENDINGS = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ой', 'ей',
+    'ий', 'ый', 'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ую', 'юю', 'а', 'я', 'о', 'е', 'ы', 'и',
+    'у', 'ю', 'ь', 'й'
+), key=len, reverse=True)
+SNIPPET_WORDS = 16
+BM25_K1 = 1.2
+BM25_B = 0.75
+DELETE_CHUNK = 10000  # Posts deleted per transaction when pruning
+MERGE_PAGES = 500  # FTS index pages merged per step when compacting
+MERGE_STEPS = 100  # Most merge steps per maintenance run
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS posts (
+        id INTEGER PRIMARY KEY,
+        source_type TEXT NOT NULL,
+        source_id TEXT NOT NULL,
+        post_id TEXT NOT NULL,
+        text TEXT NOT NULL,
+        link TEXT,
+        date REAL NOT NULL,
+        source_key TEXT NOT NULL,
+        UNIQUE (source_type, source_id, post_id)
+    );
+    CREATE INDEX IF NOT EXISTS posts_date ON posts (date);
+    CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+        text, source_key, content='posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER IF NOT EXISTS posts_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, text, source_key)
+        VALUES ('delete', old.id, replace(replace(old.text, 'ё', 'е'), 'Ё', 'Е'), old.source_key);
+    END;
+"""
+
+# The tokenizer doesn't fold ё into е, so the index does it; the length stays the same for snippets.
+# Indexing a whole batch with one statement is about 1.5x faster than a trigger per post.
+INDEX_BATCH = """
+    INSERT INTO posts_fts (rowid, text, source_key)
+    SELECT id, replace(replace(text, 'ё', 'е'), 'Ё', 'Е'), source_key FROM posts WHERE id > ?
+"""
+
+class SearchHit:
+    """A post found in the archive, with the part of its text that matched."""
+    __slots__ = ('source_type', 'source_id', 'link', 'date', 'snippet')
+
+    def __init__(self, source_type: str, source_id: str, link: Optional[str], date: float, snippet: str):
+        self.source_type = source_type
+        self.source_id = source_id
+        self.link = link
+        self.date = date
+        self.snippet = snippet
+
+def _source_token(source_type: str, source_id: str) -> str:
+    """A single index token per source, so searches are narrowed to a chat's sources inside the index."""
+    return 's' + hashlib.blake2b(f"{source_type}:{source_id}".encode('utf-8'), digest_size=8).hexdigest()
+
+def _fold(text: str) -> str:
+    return text.lower().replace('ё', 'е')
+
+def _stem(word: str) -> str:
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+def query_terms(text: str) -> List[Tuple[str, bool]]:
+    """Words of a query as (term, is_prefix): longer words lose their ending and match as prefixes."""
+    terms = []
+    for word in WORD_RE.findall(_fold(text)):
+        term = (_stem(word), True) if len(word) >= PREFIX_MIN_LENGTH else (word, False)
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+def _matches(word: str, term: Tuple[str, bool]) -> bool:
+    return word.startswith(term[0]) if term[1] else word == term[0]
+
+def fts_query(terms: List[Tuple[str, bool]], sources: List[Tuple[str, str]]) -> Optional[str]:
+    """An FTS5 query for posts of the sources containing all terms.
+
+    Every term is quoted, so operators and punctuation in the input can't break the query.
+    """
+    if not terms or not sources:
+        return None
+    phrases = ' '.join(f'"{term}"*' if prefix else f'"{term}"' for term, prefix in terms)
+    tokens = ' OR '.join(f'"{_source_token(*source)}"' for source in sources)
+    return f"text : ({phrases}) AND source_key : ({tokens})"
+
+def rank(terms: List[Tuple[str, bool]], texts: List[str]) -> List[int]:
+    """Indexes of texts ordered by BM25, with term statistics taken from the texts themselves.
+
+    FTS5's own bm25() counts every post containing each term, which takes most of a second
+    for common words in a large archive; ranking only the candidates keeps the cost bounded.
+    Ties keep their order.
+    """
+    docs = [WORD_RE.findall(_fold(text)) for text in texts]
+    frequencies = [[sum(1 for word in words if _matches(word, term)) for term in terms] for words in docs]
+    count = len(docs)
+    average_length = sum(len(words) for words in docs) / count if count else 1
+    idf = []
+    for i in range(len(terms)):
+        with_term = sum(1 for row in frequencies if row[i])
+        idf.append(math.log(1 + (count - with_term + 0.5) / (with_term + 0.5)))
+
+    scores = []
+    for words, row in zip(docs, frequencies):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(words) / (average_length or 1))
+        scores.append(sum(weight * tf * (BM25_K1 + 1) / (tf + norm) for weight, tf in zip(idf, row)))
+    return sorted(range(count), key=lambda i: -scores[i])
+
+def snippet(text: str, terms: List[Tuple[str, bool]], length: int = SNIPPET_WORDS) -> str:
+    """A few words of text around the first match."""
+    spans = [(match.start(), match.end(), _fold(match.group())) for match in WORD_RE.finditer(text)]
+    if not spans:
+        return ''
+    first = next((i for i, (_, _, word) in enumerate(spans) if any(_matches(word, term) for term in terms)), 0)
+    start = max(0, min(first - length // 4, len(spans) - length))
+    end = min(len(spans), start + length)
+    piece = ' '.join(text[spans[start][0]:spans[end - 1][1]].split())
+    return ('…' if start > 0 else '') + piece + ('…' if end < len(spans) else '')
+
+class Archive:
+    """Every fetched post, kept in a separate SQLite database with an FTS5 index.
+
+    Posts are buffered in memory and written in one transaction per ARCHIVE_BATCH posts
+    or ARCHIVE_FLUSH_INTERVAL seconds, on a thread of its own, so archiving never holds
+    up polling. Posts older than ARCHIVE_RETENTION_DAYS are pruned in chunks and the
+    index is merged step by step, so maintenance never locks the archive for long.
+    """
+
+    def __init__(self, path: str = ARCHIVE_FILE):
+        self.path = path
+        self._buffer: List[Tuple[str, str, str, str, Optional[str], float, str]] = []
+        self._full = None
+        # One thread writes, another searches; WAL lets searches run during writes
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='archive-writer')
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='archive-reader')
+        self._write_conn = self._connect()
+        self._read_conn = self._connect()
+        self.archived = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        # Only takes effect while the database is empty, so pruned pages can be handed back later
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with conn:
+            conn.executescript(SCHEMA)
+        return conn
+
+    def add(self, source_type: str, source_id: str, posts: List[Any]):
+        """Buffer fetched posts for the next batched write."""
+        now = time.time()
+        for post in posts:
+            date = post.date.timestamp() if post.date is not None else now
+            self._buffer.append((source_type, str(source_id), str(post.id), post.text or '', post.link, date,
+                                 _source_token(source_type, str(source_id))))
+        if len(self._buffer) >= ARCHIVE_BATCH and self._full is not None:
+            self._full.set()
+
+    def pending(self) -> int:
+        """Number of posts waiting to be written."""
+        return len(self._buffer)
+
+    def _write(self, rows: List[Tuple]) -> int:
+        with STORAGE_WRITE_SECONDS.time('archive_posts'):
+            with self._write_conn:
+                last_id = self._write_conn.execute('SELECT coalesce(max(id), 0) FROM posts').fetchone()[0]
+                # Posts already archived, e.g. published twice around a shard takeover, are skipped
+                cursor = self._write_conn.executemany(
+                    'INSERT OR IGNORE INTO posts VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)', rows
+                )
+                self._write_conn.execute(INDEX_BATCH, (last_id,))
+                return cursor.rowcount
+
+    async def flush(self):
+        """Write the buffered posts in one transaction, off the event loop."""
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        try:
+            self.archived += await asyncio.get_running_loop().run_in_executor(self._writer, self._write, rows)
+        except Exception as e:
+            logger.error(f"Error archiving {len(rows)} posts: {e}")
+
+    def prune(self, before: float) -> int:
+        """Delete up to DELETE_CHUNK posts dated before the given Unix time; returns how many."""
+        with STORAGE_WRITE_SECONDS.time('archive_prune'):
+            with self._write_conn:
+                return self._write_conn.execute(
+                    'DELETE FROM posts WHERE id IN (SELECT id FROM posts WHERE date < ? LIMIT ?)',
+                    (before, DELETE_CHUNK)
+                ).rowcount
+
+    def compact(self):
+        """Merge index segments left by inserts and deletes, then give free pages back to the filesystem."""
+        for _ in range(MERGE_STEPS):
+            with STORAGE_WRITE_SECONDS.time('archive_merge'):
+                with self._write_conn:
+                    before = self._write_conn.total_changes
+                    self._write_conn.execute("INSERT INTO posts_fts (posts_fts, rank) VALUES ('merge', ?)",
+                                             (MERGE_PAGES,))
+                    # Per the FTS5 docs, fewer than two changes means there is nothing left to merge
+                    if self._write_conn.total_changes - before < 2:
+                        break
+        # The pragma frees a page per step, so its rows have to be read
+        self._write_conn.execute('PRAGMA incremental_vacuum').fetchall()
+
+    async def maintain(self):
+        """Prune old posts and compact the index, writing buffered posts between chunks."""
+        loop = asyncio.get_running_loop()
+        if ARCHIVE_RETENTION_DAYS:
+            before = time.time() - ARCHIVE_RETENTION_DAYS * 24 * 3600
+            deleted = 0
+            while True:
+                chunk = await loop.run_in_executor(self._writer, self.prune, before)
+                deleted += chunk
+                if chunk < DELETE_CHUNK:
+                    break
+                await self.flush()
+            if deleted:
+                logger.info(f"Pruned {deleted} posts older than {ARCHIVE_RETENTION_DAYS:g} days from the archive")
+        await loop.run_in_executor(self._writer, self.compact)
+
+    async def run(self):
+        """Write buffered posts in batches and maintain the archive, until cancelled."""
+        self._full = asyncio.Event()
+        maintained_at = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), ARCHIVE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+            if time.monotonic() - maintained_at >= ARCHIVE_MAINTENANCE_INTERVAL:
+                maintained_at = time.monotonic()
+                try:
+                    await self.maintain()
+                except Exception as e:
+                    logger.error(f"Error maintaining the archive: {e}")
+
+    def _search(self, terms: List[Tuple[str, bool]], query: str, offset: int, limit: int) -> List[SearchHit]:
+        with SEARCH_SECONDS.time():
+            # Walking matches newest first is cheap, ranking them all isn't: rank the newest SEARCH_CANDIDATES
+            rows = self._read_conn.execute("""
+                SELECT p.source_type, p.source_id, p.link, p.date, p.text
+                FROM posts_fts JOIN posts p ON p.id = posts_fts.rowid
+                WHERE posts_fts MATCH ?
+                ORDER BY posts_fts.rowid DESC
+                LIMIT ?
+            """, (query, SEARCH_CANDIDATES)).fetchall()
+            order = rank(terms, [row[4] for row in rows])[offset:offset + limit]
+            return [SearchHit(*rows[i][:4], snippet(rows[i][4], terms)) for i in order]
+
+    async def search(self, text: str, sources: List[Tuple[str, str]], offset: int = 0,
+                     limit: int = 10) -> List[SearchHit]:
+        """Posts of the given (source_type, source_id) sources matching all words of text, best first.
+
+        Only the newest SEARCH_CANDIDATES matches are ranked, which keeps common words fast.
+        """
+        terms = query_terms(text)
+        query = fts_query(terms, sources)
+        if query is None:
+            return []
+        return await asyncio.get_running_loop().run_in_executor(
+            self._reader, self._search, terms, query, offset, limit
+        )
+
+    def close(self):
+        """Write what is still buffered and close the database."""
+        rows, self._buffer = self._buffer, []
+        self._writer.shutdown()
+        self._reader.shutdown()
+        if rows:
+            self._write(rows)
+        self._write_conn.close()
+        self._read_conn.close()
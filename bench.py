@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+import fakeapi
+
+logger = logging.getLogger('bench')
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MAIN_FILE = os.path.join(ROOT, 'main.py')
+RESULTS_FILE = os.path.join(ROOT, 'bench_results.jsonl')
+
+# Bot settings for a run of a minute instead of hours; any of them can be overridden with --env
+DEFAULT_ENV = {
+    'POLL_INTERVAL': '5',
+    'POLL_MIN_INTERVAL': '5',
+    'POLL_MAX_INTERVAL': '30',
+    'SCHEDULER_TICK': '0.5',
+    'RESOLVE_REFRESH_INTERVAL': '5',
+    'TELEGRAM_CHAT_INTERVAL': '0.1',
+    'TELEGRAM_GLOBAL_RATE': '1000',  # Measure the delivery pipeline rather than the throttle
+}
+
+# Result name -> True if higher is better
+RESULTS = {
+    'startup_seconds': False,
+    'ready_seconds': False,
+    'poll_cycle_mean_seconds': False,
+    'poll_cycle_p95_seconds': False,
+    'posts_per_second': True,
+    'messages_per_second': True,
+    'delivery_p95_seconds': False,
+    'rss_mb': False,
+    'memory_per_source_kb': False,
+}
+
+METRIC_LINE = re.compile(r'^([a-zA-Z_:][\w:]*)(\{[^}]*\})?\s+(\S+)$')
+
+def parse_metrics(text: str) -> Dict[Tuple[str, str], float]:
+    """Samples of a Prometheus text page as {(name, labels): value}."""
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            samples[(match.group(1), match.group(2) or '')] = float(match.group(3))
+    return samples
+
+def metric_sum(samples: Dict[Tuple[str, str], float], name: str) -> float:
+    return sum(value for (sample, _), value in samples.items() if sample == name)
+
+def histogram_delta(before: Dict, after: Dict, name: str) -> Tuple[float, float, List[Tuple[float, float]]]:
+    """Count, sum and cumulative (bound, count) buckets observed between two scrapes, over all labels."""
+    count = metric_sum(after, f"{name}_count") - metric_sum(before, f"{name}_count")
+    total = metric_sum(after, f"{name}_sum") - metric_sum(before, f"{name}_sum")
+    buckets = {}
+    for (sample, labels), value in after.items():
+        if sample != f"{name}_bucket":
+            continue
+        bound = float(re.search(r'le="([^"]+)"', labels).group(1))
+        buckets[bound] = buckets.get(bound, 0) + value - before.get((sample, labels), 0)
+    return count, total, sorted(buckets.items())
+
+def quantile(buckets: List[Tuple[float, float]], count: float, q: float) -> Optional[float]:
+    """Upper bound of the bucket holding the q-quantile, like Histogram.stats in metrics.py.
+
+    None if there were no observations or the quantile is beyond the largest bucket.
+    """
+    for bound, cumulative in buckets:
+        if count and cumulative >= q * count:
+            return bound if bound != float('inf') else None
+    return None
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def rss_kb(pid: int) -> Optional[int]:
+    """Resident memory of a process in kB (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def version() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def setup_database(plan_file: str):
+    """Add the sources and subscriptions of a plan; run in the bot's working directory by `--setup`."""
+    sys.path.insert(0, ROOT)
+    from storage import Storage
+    with open(plan_file) as f:
+        plan = json.load(f)
+    storage = Storage()
+    for chat_id in range(1, plan['chats'] + 1):
+        storage.add_chat(chat_id)
+    rng = random.Random(0)
+    sources = [(source_type, source_id) for source_type, ids in plan['sources'].items() for source_id in ids]
+    resolved = plan.get('resolved', {})
+    for source_type, source_id in sources:
+        storage.add_source(source_type, source_id, source_id.rsplit('/', 1)[-1],
+                           resolved.get(source_type, {}).get(source_id))
+    for chat_id in range(1, plan['chats'] + 1):
+        for source_type, source_id in rng.sample(sources, min(plan['subscriptions'], len(sources))):
+            storage.subscribe(chat_id, source_type, source_id)
+
+class BotRun:
+    """One bot process against the fake APIs, in a working directory of its own."""
+
+    def __init__(self, fake: fakeapi.FakeAPI, env: Dict[str, str]):
+        self.fake = fake
+        self.workdir = tempfile.mkdtemp(prefix='bench-')
+        self.metrics_port = free_port()
+        self.env = dict(os.environ)
+        self.env.update({
+            'TELEGRAM_BOT_TOKEN': '123456:fake', 'VK_ACCESS_TOKEN': 'fake', 'TWITTER_BEARER_TOKEN': 'fake',
+            'TWITTER_API_KEY': 'fake', 'TWITTER_API_SECRET': 'fake', 'TWITTER_ACCESS_TOKEN': 'fake',
+            'TWITTER_ACCESS_TOKEN_SECRET': 'fake', 'BOT_MODE': 'polling', 'METRICS_HOST': '127.0.0.1',
+            'METRICS_PORT': str(self.metrics_port)
+        })
+        self.env.update(fake.env())
+        self.env.update(env)
+        self.process = None
+
+    def setup(self, chats: int, subscriptions: int, resolved: bool = False):
+        """Add the fake sources and chats; `resolved` stores their numeric IDs as if the bot had looked them up."""
+        plan_file = os.path.join(self.workdir, 'plan.json')
+        with open(plan_file, 'w') as f:
+            json.dump({'sources': self.fake.source_ids(), 'chats': chats, 'subscriptions': subscriptions,
+                       'resolved': self.fake.resolved_ids() if resolved else {}}, f)
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--setup', plan_file], cwd=self.workdir,
+                       env=self.env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    async def start(self, timeout: float = 60) -> float:
+        """Start the bot and wait until it asks for updates; returns the seconds that took."""
+        self.fake.reset()
+        started = time.time()
+        self.output = open(os.path.join(self.workdir, 'bot.out'), 'wb')
+        self.process = subprocess.Popen([sys.executable, MAIN_FILE], cwd=self.workdir, env=self.env,
+                                        stdout=self.output, stderr=subprocess.STDOUT)
+        while self.fake.first_update_at is None:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Bot exited with code {self.process.returncode}, see {self.workdir}/bot.out")
+            if time.time() - started > timeout:
+                raise RuntimeError(f"Bot didn't start within {timeout}s, see {self.workdir}/bot.out")
+            await asyncio.sleep(0.05)
+        return self.fake.first_update_at - started
+
+    async def scrape(self) -> Dict[Tuple[str, str], float]:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{self.metrics_port}/metrics") as response:
+                return parse_metrics(await response.text())
+
+    async def first_cycle(self, timeout: float = 120):
+        """Wait until the first poll cycle, which takes in the backlog of every source, is over."""
+        started = time.time()
+        while not metric_sum(await self.scrape(), 'bot_poll_cycle_seconds_count'):
+            if time.time() - started > timeout:
+                raise RuntimeError(f"No poll cycle finished within {timeout}s, see {self.workdir}/bot.out")
+            await asyncio.sleep(0.2)
+
+    def stop(self, keep: bool = False):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                self.process.wait(15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.output.close()
+        if not keep:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    env = dict(DEFAULT_ENV)
+    env.update(item.split('=', 1) for item in args.env)
+    fake = fakeapi.from_arguments(args)
+    await fake.start(port=0)
+    sources = sum(len(ids) for ids in fake.source_ids().values())
+    results = {}
+    try:
+        # A bot without sources: cold start and baseline memory
+        idle = BotRun(fake, env)
+        try:
+            await idle.start()
+            await asyncio.sleep(2)
+            idle_rss = rss_kb(idle.process.pid)
+        finally:
+            idle.stop(args.keep)
+
+        run = BotRun(fake, env)
+        try:
+            run.setup(args.chats, args.subscriptions)
+            results['ready_seconds'] = await run.start()
+            logger.info(f"Bot with {sources} sources and {args.chats} chats is up after "
+                        f"{results['ready_seconds']:.2f}s, warming up for {args.warmup:g}s after the first poll")
+            await run.first_cycle()
+            await asyncio.sleep(args.warmup)
+            before = await run.scrape()
+            messages = fake.messages
+            started = time.monotonic()
+            await asyncio.sleep(args.duration)
+            after = await run.scrape()
+            elapsed = time.monotonic() - started
+            messages = fake.messages - messages
+            load_rss = rss_kb(run.process.pid)
+        finally:
+            run.stop(args.keep)
+            if args.keep:
+                logger.info(f"Kept the working directories {idle.workdir} and {run.workdir}")
+    finally:
+        await fake.stop()
+
+    results['startup_seconds'] = metric_sum(after, 'bot_startup_seconds')
+    cycles, cycle_seconds, buckets = histogram_delta(before, after, 'bot_poll_cycle_seconds')
+    results['poll_cycle_mean_seconds'] = cycle_seconds / cycles if cycles else None
+    results['poll_cycle_p95_seconds'] = quantile(buckets, cycles, 0.95)
+    posts = metric_sum(after, 'bot_posts_found_sum') - metric_sum(before, 'bot_posts_found_sum')
+    results['posts_per_second'] = posts / elapsed
+    results['messages_per_second'] = messages / elapsed
+    sent, _, buckets = histogram_delta(before, after, 'bot_delivery_seconds')
+    results['delivery_p95_seconds'] = quantile(buckets, sent, 0.95)
+    results['rss_mb'] = load_rss / 1024 if load_rss else None
+    if load_rss and idle_rss and sources:
+        results['memory_per_source_kb'] = (load_rss - idle_rss) / sources
+    results['poll_cycles'] = cycles
+    results['requests'] = dict(fake.requests)
+    results['injected_faults'] = dict(fake.injected)
+    return results
+
+def scenario(args: argparse.Namespace) -> Dict[str, Any]:
+    """The settings a result depends on; only results of the same scenario are compared."""
+    keys = ('vk', 'twitter', 'rss', 'rate', 'backlog', 'text_size', 'photos', 'fixtures', 'latency', 'jitter',
+            'error_rate', 'rate_limit_rate', 'telegram_latency', 'telegram_error_rate', 'telegram_rate_limit_rate',
+            'chats', 'subscriptions', 'duration', 'warmup')
+    settings = {key: getattr(args, key) for key in keys}
+    settings['env'] = dict(sorted({**DEFAULT_ENV, **dict(item.split('=', 1) for item in args.env)}.items()))
+    return settings
+
+def load_previous(path: str, settings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The latest saved result of the same scenario."""
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry['scenario'] == settings:
+                previous = entry
+    return previous
+
+def compare(results: Dict[str, Any], previous: Optional[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Print the results next to the previous ones; returns the names of results that got worse than tolerance."""
+    regressions = []
+    old = previous['results'] if previous else {}
+    header = f"{'result':<26}{'value':>12}"
+    if previous:
+        header += f"{previous['version']:>14}{'change':>10}"
+    print(header)
+    for name, higher_is_better in RESULTS.items():
+        value = results.get(name)
+        line = f"{name:<26}{'-' if value is None else f'{value:.4g}':>12}"
+        before = old.get(name)
+        if value is not None and before:
+            change = (value - before) / before
+            worse = -change if higher_is_better else change
+            marker = '  REGRESSION' if worse > tolerance else ''
+            if marker:
+                regressions.append(name)
+            line += f"{before:>14.4g}{change:>+10.1%}{marker}"
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of the bot against fakeapi.py')
+    fakeapi.add_arguments(parser)
+    parser.set_defaults(vk=100, twitter=50, rss=50, rate=0.02, backlog=5)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--subscriptions', type=int, default=10, help='random sources each chat subscribes to')
+    parser.add_argument('--duration', type=float, default=60, help='seconds measured')
+    parser.add_argument('--warmup', type=float, default=10, help='seconds before measuring')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE', help='bot setting for the run')
+    parser.add_argument('--results', default=RESULTS_FILE, help='JSON lines file results are appended to')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='change that counts as a regression')
+    parser.add_argument('--no-save', action='store_true', help="don't append the results")
+    parser.add_argument('--keep', action='store_true', help='keep the working directories with the bot logs')
+    parser.add_argument('--setup', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.setup:
+        setup_database(args.setup)
+        return
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    settings = scenario(args)
+    results = asyncio.run(run_benchmark(args))
+    previous = load_previous(args.results, settings)
+    regressions = compare(results, previous, args.tolerance)
+    if not args.no_save:
+        with open(args.results, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'version': version(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                                'scenario': settings, 'results': results}, ensure_ascii=False) + '\n')
+    if regressions:
+        print(f"Worse than {previous['version']} by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Microbenchmarks of single components, run from the repository root as `python -m benchmarks.<name>`.
+
+bench.py measures the whole bot against fakeapi.py; these time one component with
+synthetic data at the sizes its request was written for, and print a table.
+"""
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Iterable, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The bot's modules create bot.log, bot.db and the like in the working directory; keep them out of the checkout
+WORKDIR = tempfile.mkdtemp(prefix='bot-bench-')
+os.chdir(WORKDIR)
+
+def timed(func: Callable, *args, repeat: int = 1) -> Tuple[float, Any]:
+    """Best wall time of `repeat` calls in seconds, and the result of the last call."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def percentile(values: Iterable[float], q: float) -> float:
+    """The q-quantile of the values, by the nearest-rank method."""
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(q * len(values) + 0.5) - 1))]
+
+def report(title: str, rows: Iterable[Tuple[str, Any, str]]):
+    """Print (name, value, unit) rows under a title."""
+    print(title)
+    for name, value, unit in rows:
+        text = f"{value:.4g}" if isinstance(value, float) else str(value)
+        print(f"  {name:<44}{text:>12} {unit}")
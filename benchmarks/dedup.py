@@ -0,0 +1,62 @@
+"""Dedup index at 1,000,000 remembered fingerprints: fingerprinting, lookups, memory and persistence.
+
+A check of a post normalizes it, computes its SimHash and looks it up.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+import bench
+import fakeapi
+from benchmarks import WORKDIR, percentile, report, timed
+from dedup import DedupIndex, normalize, simhash
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fingerprints', type=int, default=1000000)
+    parser.add_argument('--posts', type=int, default=2000, help='synthetic posts checked against the index')
+    parser.add_argument('--text-size', type=int, default=300, help='characters in a post')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    fake = fakeapi.FakeAPI(vk=args.posts // 20, rate=0, backlog=20, text_size=args.text_size)
+    posts = [feed.post(index)['text'] for feed in fake.vk.values() for index in range(20)]
+    tokens = [normalize(post) for post in posts]
+    hashing = [timed(simhash, post_tokens)[0] for post_tokens in tokens]
+
+    index = DedupIndex(os.path.join(WORKDIR, 'dedup.bin'), max_entries=args.fingerprints)
+    rss_before = bench.rss_kb(os.getpid())
+    now = time.time()
+    fill_seconds, _ = timed(lambda: [index._add(rng.getrandbits(64), now, (rng.randrange(1000),)) for _ in range(args.fingerprints)])
+    rss_after = bench.rss_kb(os.getpid())
+
+    misses = [timed(index.find, rng.getrandbits(64))[0] for _ in range(args.posts)]
+    remembered = [fingerprint for _, fingerprint in rng.sample(index._entries, args.posts)]
+    # Near duplicates: a remembered fingerprint with a couple of bits flipped
+    hits = [timed(index.find, fingerprint ^ 1 << rng.randrange(64) ^ 1 << rng.randrange(64))[0]
+            for fingerprint in remembered]
+    checks = [timed(lambda: index.duplicates_for(index.fingerprint(post), [1]))[0] for post in posts]
+    save_seconds, _ = timed(index.save)
+    loaded = DedupIndex(index.path, max_entries=args.fingerprints)
+    load_seconds, _ = timed(loaded.load)
+
+    buckets = [len(bucket) for bucket in index._buckets.values()]
+    report(f"{len(index)} fingerprints, {len(posts)} posts of {args.text_size} characters", [
+        ('simhash of a post, mean', statistics.mean(hashing) * 1e6, 'us'),
+        ('fill the index', fill_seconds, 's'),
+        ('memory per fingerprint', (rss_after - rss_before) * 1024 / args.fingerprints
+         if rss_before and rss_after else None, 'B'),
+        ('fingerprints per band bucket, mean', statistics.mean(buckets), ''),
+        ('lookup of a new fingerprint, mean', statistics.mean(misses) * 1e6, 'us'),
+        ('lookup of a new fingerprint, p99', percentile(misses, 0.99) * 1e6, 'us'),
+        ('lookup of a near duplicate, mean', statistics.mean(hits) * 1e6, 'us'),
+        ('check of a post, mean', statistics.mean(checks) * 1e6, 'us'),
+        ('check of a post, p99', percentile(checks, 0.99) * 1e6, 'us'),
+        ('save', save_seconds, 's'),
+        ('load', load_seconds, 's'),
+    ])
+
+if __name__ == '__main__':
+    main()
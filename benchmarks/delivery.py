@@ -0,0 +1,120 @@
+"""Delivery under load: messages per second and the time from fetch to delivery, against fakeapi.py.
+
+The bot runs with Telegram's real limits, TELEGRAM_GLOBAL_RATE messages a second and one
+message a second per chat, while the fake Bot API adds latency and answers some sends with
+RetryAfter. Each run offers a given number of messages a second: VK posts appear at the rate
+that makes their subscribers add up to it, and every group is polled each POLL_INTERVAL.
+The time of a message runs from the moment the fake API handed its post to the bot until
+the send arrived, so it covers filtering, dedup, the outbox and the delivery queue, but
+not the poll interval.
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import sqlite3
+import statistics
+import time
+
+import bench
+import fakeapi
+from benchmarks import percentile, report
+
+POST = re.compile(r'\n\n(.+?): новость (\d+)\.')
+
+class DeliveryLog(fakeapi.FakeAPI):
+    """Fake API that records every message it accepted, with the time it arrived."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deliveries = []  # (arrived at, chat ID, text)
+
+    async def handle_telegram(self, request):
+        response = await super().handle_telegram(request)
+        if request.match_info['method'].lower() == 'sendmessage' and response.status == 200:
+            params = await self._params(request)
+            self.deliveries.append((time.time(), int(params['chat_id']), params.get('text', '')))
+        return response
+
+def subscribers(run: bench.BotRun):
+    """Source ID -> number of chats subscribed to it."""
+    conn = sqlite3.connect(os.path.join(run.workdir, 'bot.db'))
+    try:
+        return dict(conn.execute('SELECT source_id, COUNT(*) FROM subscriptions GROUP BY source_id'))
+    finally:
+        conn.close()
+
+async def run(args: argparse.Namespace, load: float):
+    rate = load / (args.chats * args.subscriptions)
+    fake = DeliveryLog(vk=args.sources, rate=rate, backlog=0)
+    # Spread the groups' posts over their interval rather than have every group post at once
+    rng = random.Random(0)
+    for feed in fake.vk.values():
+        feed.started_at -= rng.uniform(0, 1 / rate)
+    fake.faults['telegram'] = fakeapi.Faults(args.telegram_latency, args.telegram_jitter, 0.0, args.retry_after_rate)
+    await fake.start(port=0)
+    interval = str(args.interval)
+    run = bench.BotRun(fake, {**bench.DEFAULT_ENV, 'TELEGRAM_GLOBAL_RATE': str(args.global_rate),
+                              'TELEGRAM_CHAT_INTERVAL': '1', 'POLL_INTERVAL': interval,
+                              'POLL_MIN_INTERVAL': interval, 'POLL_MAX_INTERVAL': interval})
+    try:
+        run.setup(args.chats, min(args.subscriptions, args.sources), resolved=True)
+        chats = subscribers(run)
+        await run.start()
+        await run.first_cycle()
+        await asyncio.sleep(args.warmup)
+        started = time.time()
+        await asyncio.sleep(args.duration)
+        ended = time.time()
+    finally:
+        run.stop()
+        await fake.stop()
+
+    titles = {feed.title: feed for feed in fake.vk.values()}
+    latencies, reordered, last = [], 0, {}
+    for arrived_at, chat_id, text in fake.deliveries:
+        match = POST.search(text)
+        if match is None or match.group(1) not in titles:
+            continue
+        feed, post_id = titles[match.group(1)], int(match.group(2))
+        # Messages of a source reach a chat oldest first
+        if post_id < last.get((chat_id, feed.name), 0):
+            reordered += 1
+        last[(chat_id, feed.name)] = post_id
+        if started <= arrived_at < ended and post_id in feed.served_at:
+            latencies.append(arrived_at - feed.served_at[post_id])
+    queued = sum(chats.get(feed.name, 0) for feed in fake.vk.values() for served_at in feed.served_at.values()
+                 if started <= served_at < ended)
+    return [
+        ('messages fetched per second', queued / (ended - started), '/s'),
+        ('messages delivered per second', len(latencies) / (ended - started), '/s'),
+        ('fetch to delivery, p50', percentile(latencies, 0.5) if latencies else None, 's'),
+        ('fetch to delivery, p99', percentile(latencies, 0.99) if latencies else None, 's'),
+        ('fetch to delivery, mean', statistics.mean(latencies) if latencies else None, 's'),
+        ('RetryAfter answers', fake.injected.get('telegram:rate_limit', 0), ''),
+        ('messages out of order within a chat', reordered, ''),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--loads', type=float, nargs='+', default=[15, 25, 40],
+                        help='messages per second offered, below and above TELEGRAM_GLOBAL_RATE')
+    parser.add_argument('--global-rate', type=float, default=30, help='TELEGRAM_GLOBAL_RATE of the bot')
+    parser.add_argument('--sources', type=int, default=100, help='VK groups')
+    parser.add_argument('--interval', type=float, default=5, help='POLL_INTERVAL of the bot, kept fixed')
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--subscriptions', type=int, default=10, help='random sources each chat subscribes to')
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help='seconds per Bot API call')
+    parser.add_argument('--telegram-jitter', type=float, default=0.05, help='up to this many extra seconds')
+    parser.add_argument('--retry-after-rate', type=float, default=0.01, help='share of sends answered with RetryAfter')
+    parser.add_argument('--warmup', type=float, default=10, help='seconds after the first poll cycle')
+    parser.add_argument('--duration', type=float, default=60, help='seconds measured')
+    args = parser.parse_args()
+
+    for load in args.loads:
+        report(f"{load:g} messages/s offered, {args.global_rate:g}/s allowed, {args.chats} chats",
+               asyncio.run(run(args, load)))
+
+if __name__ == '__main__':
+    main()
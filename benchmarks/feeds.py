@@ -0,0 +1,137 @@
+"""RSS polling of 1000 feeds against the feed server of fakeapi.py, and the memory a large feed takes to parse.
+
+The first round fetches every feed, the second finds them all unchanged, which costs a
+304 without a body each, and the third finds new items in some of them; items the feeds
+send again aren't returned twice. Feeds are fetched RSS_CONCURRENCY at a time over one
+keep-alive pool, as the bot's poller does. All of them live on one host here, so
+RSS_CONNECTIONS_PER_HOST connections and the response latency set the pace. The large
+feed is turned into posts chunk by chunk as rss.py reads it, next to parsing the whole
+document first.
+"""
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from email.utils import formatdate
+from xml.sax.saxutils import escape
+
+import fakeapi
+from benchmarks import report, timed
+from config import RSS_CONCURRENCY, RSS_CONNECTIONS_PER_HOST
+from rss import CHUNK_SIZE, FeedParser, RSSParser, item_to_post
+
+class ConnectionLog(fakeapi.FakeAPI):
+    """Fake API that counts feed responses by status, the bytes they carried and the connections they came over."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statuses = {}
+        self.sent_bytes = 0
+        self.connections = set()
+
+    async def handle_rss(self, request):
+        response = await super().handle_rss(request)
+        self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+        self.sent_bytes += len(response.body or b'')
+        self.connections.add(request.transport.get_extra_info('peername'))
+        return response
+
+async def poll(parser: RSSParser, states):
+    """Fetch every feed as the bot does; returns the new posts and updates the saved states."""
+    semaphore = asyncio.Semaphore(RSS_CONCURRENCY)
+
+    async def one(url):
+        async with semaphore:
+            posts, states[url] = await parser.get_new_posts(url, states[url])
+            return len(posts)
+
+    return sum(await asyncio.gather(*(one(url) for url in states)))
+
+async def measure(fake: ConnectionLog, parser: RSSParser, states, title: str):
+    fake.statuses, fake.sent_bytes, fake.connections = {}, 0, set()
+    started = time.perf_counter()
+    posts = await poll(parser, states)
+    elapsed = time.perf_counter() - started
+    return [
+        (title, elapsed, 's'),
+        ('  feeds per second', len(states) / elapsed, '/s'),
+        ('  answered 200 / 304', f"{fake.statuses.get(200, 0)} / {fake.statuses.get(304, 0)}", ''),
+        ('  feed bytes received', fake.sent_bytes / 2 ** 20, 'MB'),
+        ('  new items returned', posts, ''),
+        ('  connections opened', len(fake.connections), ''),
+    ]
+
+async def run(args: argparse.Namespace):
+    fake = ConnectionLog(rss=args.feeds, rate=0, backlog=args.items, text_size=args.text_size)
+    fake.faults['rss'] = fakeapi.Faults(latency=args.latency, jitter=args.jitter)
+    await fake.start(port=0)
+    parser = RSSParser()
+    states = {url: None for url in fake.source_ids()['rss']}
+    try:
+        rows = await measure(fake, parser, states, 'first poll, every feed')
+        rows += await measure(fake, parser, states, 'second poll, nothing changed')
+        # A new item in some feeds; each still sends its previous items along
+        changed = random.Random(0).sample(list(fake.rss.values()), round(args.feeds * args.changed))
+        for feed in changed:
+            feed.backlog += 1
+        rows += await measure(fake, parser, states, f"third poll, {len(changed)} feeds with a new item")
+    finally:
+        await parser.close()
+        await fake.stop()
+    return rows
+
+def large_feed(items: int, text_size: int) -> bytes:
+    feed = fakeapi.Feed('large', 1, 0, items, text_size)
+    body = ''.join(
+        f"<item><title>{escape(post['text'][:80])}</title><guid>large-{post['id']}</guid>"
+        f"<pubDate>{formatdate(post['date'])}</pubDate><description>{escape(post['text'])}</description></item>"
+        for post in map(feed.post, range(items))
+    )
+    return (f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Large</title>{body}'
+            f'</channel></rss>').encode()
+
+def streamed(body: bytes) -> int:
+    parser = FeedParser()
+    posts = 0
+    for offset in range(0, len(body), CHUNK_SIZE):
+        posts += len(parser.feed(body[offset:offset + CHUNK_SIZE]))
+    return posts + len(parser.close())
+
+def whole(body: bytes) -> int:
+    return len([item_to_post(item) for item in ET.fromstring(body).iter('item')])
+
+def peak_memory(func, *args) -> int:
+    """The most memory a call had allocated at once, in bytes."""
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--feeds', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=20, help='items in each feed')
+    parser.add_argument('--text-size', type=int, default=300, help='characters in an item')
+    parser.add_argument('--changed', type=float, default=0.1, help='share of feeds with a new item in the third poll')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per feed response')
+    parser.add_argument('--jitter', type=float, default=0.05, help='up to this many extra seconds per response')
+    parser.add_argument('--large-items', type=int, default=20000, help='items in the large feed')
+    args = parser.parse_args()
+
+    report(f"{args.feeds} feeds of {args.items} items, {args.latency:g}s+{args.jitter:g}s latency, "
+           f"{RSS_CONCURRENCY} at a time, {RSS_CONNECTIONS_PER_HOST} connections to the host", asyncio.run(run(args)))
+
+    body = large_feed(args.large_items, args.text_size)
+    report(f"Large feed of {args.large_items} items, {len(body) / 2 ** 20:.1f} MB", [
+        ('parsed in chunks', timed(streamed, body)[0], 's'),
+        ('  peak memory', peak_memory(streamed, body) / 2 ** 20, 'MB'),
+        ('whole document first', timed(whole, body)[0], 's'),
+        ('  peak memory', peak_memory(whole, body) / 2 ** 20, 'MB'),
+    ])
+
+if __name__ == '__main__':
+    main()
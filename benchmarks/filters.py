@@ -0,0 +1,88 @@
+"""Per-chat filters at 10,000 chats with 50 rules each: load, automaton build, per-post cost and rule churn."""
+import argparse
+import random
+import statistics
+
+from benchmarks import percentile, report, timed
+from filters import FilterEngine, INCLUDE, EXCLUDE, KEYWORD, REGEX
+
+def vocabulary(rng: random.Random, size: int):
+    letters = 'абвгдежзиклмнопрстуфхцчшыэюя'
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(4, 10))))
+    return sorted(words)
+
+def chat_rules(rng: random.Random, words, regexes, count: int, regex_count: int):
+    rules = []
+    for pattern in rng.sample(regexes, regex_count):
+        rules.append((rng.choice((INCLUDE, EXCLUDE)), REGEX, pattern))
+    # Popular words are shared by many chats, like real topics
+    while len(rules) < count:
+        word = words[min(len(words) - 1, int(rng.paretovariate(1.2)) - 1)]
+        rule = (rng.choice((INCLUDE, EXCLUDE)), KEYWORD, word)
+        if rule not in rules:
+            rules.append(rule)
+    return rules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chats', type=int, default=10000)
+    parser.add_argument('--rules', type=int, default=50, help='rules per chat')
+    parser.add_argument('--regexes', type=int, default=2, help='of which regex rules')
+    parser.add_argument('--words', type=int, default=20000, help='distinct keywords to draw from')
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--subscribers', type=int, default=100, help='chats a typical post goes to')
+    parser.add_argument('--churn', type=int, default=1000, help='rule changes measured')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = vocabulary(rng, args.words)
+    regexes = [rf"\b{word}\w*" for word in rng.sample(words, 200)]
+    rules = {chat_id: chat_rules(rng, words, regexes, args.rules, args.regexes) for chat_id in range(args.chats)}
+    posts = [' '.join(rng.choice(words) for _ in range(rng.randint(30, 200))) for _ in range(args.posts)]
+    chat_ids = list(rules)
+
+    engine = FilterEngine()
+    load_seconds, _ = timed(engine.sync, rules)
+    build_seconds, _ = timed(engine.allowed_chats, posts[0], chat_ids[:1])
+
+    typical = []
+    for post in posts:
+        seconds, _ = timed(engine.allowed_chats, post, rng.sample(chat_ids, args.subscribers))
+        typical.append(seconds)
+    everyone = [timed(engine.allowed_chats, post, chat_ids)[0] for post in posts[:20]]
+
+    # Rule changes a chat makes with /filter: swap one keyword for another one someone already uses,
+    # then for a brand new one; only the new keyword may rebuild the automaton
+    known = [rule[2] for chat in rules.values() for rule in chat if rule[1] == KEYWORD]
+    rebuilds = engine.rebuilds
+    churn_seconds = []
+    for _ in range(args.churn):
+        chat_id = rng.choice(chat_ids)
+        current = engine._chats[chat_id].rules
+        replacement = (EXCLUDE, KEYWORD, rng.choice(known))
+        while replacement in current:
+            replacement = (EXCLUDE, KEYWORD, rng.choice(known))
+        changed = current[1:] + [replacement]
+        seconds, _ = timed(engine.set_rules, chat_id, changed)
+        churn_seconds.append(seconds)
+        engine.allowed_chats(posts[0], [chat_id])
+    known_rebuilds = engine.rebuilds - rebuilds
+    chat_id = chat_ids[0]
+    engine.set_rules(chat_id, engine._chats[chat_id].rules + [(INCLUDE, KEYWORD, 'совершенноновоеслово')])
+    new_seconds, _ = timed(engine.allowed_chats, posts[0], [chat_id])
+
+    report(f"{args.chats} chats x {args.rules} rules ({len(engine._owners)} distinct keywords)", [
+        ('load all rules (sync)', load_seconds, 's'),
+        ('first automaton build', build_seconds, 's'),
+        (f"post to {args.subscribers} chats, mean", statistics.mean(typical) * 1000, 'ms'),
+        (f"post to {args.subscribers} chats, p99", percentile(typical, 0.99) * 1000, 'ms'),
+        (f"post to all {args.chats} chats, mean", statistics.mean(everyone) * 1000, 'ms'),
+        ('set_rules with a known keyword, mean', statistics.mean(churn_seconds) * 1000, 'ms'),
+        (f"rebuilds after {len(churn_seconds)} known-keyword changes", known_rebuilds, ''),
+        ('rebuild after a brand new keyword', new_seconds, 's'),
+    ])
+
+if __name__ == '__main__':
+    main()
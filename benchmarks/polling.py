@@ -0,0 +1,102 @@
+"""Poll cycle time at 10, 100 and 1000 VK and Twitter sources, with the bot running against fakeapi.py.
+
+Every source with subscribers is due once the bot starts, so the first sweep fetches all
+of them and takes in their backlog; it ends when the fake API has served the last one.
+The bot keeps within the platforms' quotas, VK_REQUESTS_PER_SECOND execute calls of
+VK_EXECUTE_BATCH groups and one Twitter timeline a second, so the quota floor is the best
+a sweep can do. The event loop lag shows whether fetching stalled the rest of the bot.
+"""
+import argparse
+import asyncio
+import math
+import os
+import sqlite3
+import time
+
+import bench
+import fakeapi
+from benchmarks import report
+from config import VK_EXECUTE_BATCH, VK_REQUESTS_PER_SECOND
+
+# Twitter timeline quota the bot's rate limiter keeps to, in requests a second and burst
+TWITTER_TIMELINES_PER_SECOND = 1
+TWITTER_TIMELINES_BURST = 5
+
+def quota_floor(requests: int, rate: float, burst: int) -> float:
+    """Seconds a token bucket that starts full needs to let the requests through."""
+    return max(0, requests - burst) / rate
+
+def subscribed(run: bench.BotRun):
+    """(source type, source ID) of the sources the bot polls, the ones with subscribers."""
+    conn = sqlite3.connect(os.path.join(run.workdir, 'bot.db'))
+    try:
+        return set(conn.execute('SELECT DISTINCT source_type, source_id FROM subscriptions'))
+    finally:
+        conn.close()
+
+async def sweep(feeds, timeout: float) -> bool:
+    """Wait until every feed was fetched; False if some weren't within the timeout."""
+    started = time.monotonic()
+    while any(feed.fetched_at is None for feed in feeds):
+        if time.monotonic() - started > timeout:
+            return False
+        await asyncio.sleep(0.1)
+    return True
+
+async def run(args: argparse.Namespace, sources: int):
+    twitter = round(sources * args.twitter_share)
+    faults = fakeapi.Faults(latency=args.latency, jitter=args.jitter)
+    fake = fakeapi.FakeAPI(vk=sources - twitter, twitter=twitter, rate=args.rate, backlog=args.backlog,
+                           faults={'vk': faults, 'twitter': faults})
+    await fake.start(port=0)
+    run = bench.BotRun(fake, {**bench.DEFAULT_ENV, 'POLL_INTERVAL': str(args.interval),
+                              'POLL_MIN_INTERVAL': str(args.interval), 'POLL_MAX_INTERVAL': str(args.interval)})
+    try:
+        run.setup(args.chats, args.subscriptions, resolved=True)
+        polled = subscribed(run)
+        feeds = {platform: [feed for feed in getattr(fake, platform).values() if (platform, feed.name) in polled]
+                 for platform in ('vk', 'twitter')}
+        await run.start()
+        ready_at = fake.first_update_at
+        complete = await sweep(feeds['vk'] + feeds['twitter'], args.timeout)
+        after = await run.scrape()
+    finally:
+        run.stop()
+        await fake.stop()
+
+    def swept(feeds):
+        return max(feed.fetched_at for feed in feeds) - ready_at if feeds and complete else None
+
+    lags, _, lag_buckets = bench.histogram_delta({}, after, 'bot_event_loop_lag_seconds')
+    return [
+        ('VK groups with subscribers', len(feeds['vk']), ''),
+        ('  sweep', swept(feeds['vk']), 's'),
+        ('  quota floor', quota_floor(math.ceil(len(feeds['vk']) / VK_EXECUTE_BATCH), VK_REQUESTS_PER_SECOND, 1), 's'),
+        ('Twitter users with subscribers', len(feeds['twitter']), ''),
+        ('  sweep', swept(feeds['twitter']), 's'),
+        ('  quota floor', quota_floor(len(feeds['twitter']), TWITTER_TIMELINES_PER_SECOND, TWITTER_TIMELINES_BURST),
+         's'),
+        ('poll cycles finished meanwhile', int(bench.metric_sum(after, 'bot_poll_cycle_seconds_count')), ''),
+        ('event loop lag, p99 (bucket bound)', bench.quantile(lag_buckets, lags, 0.99), 's'),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sources', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--twitter-share', type=float, default=0.1,
+                        help='share of Twitter users among the sources, which cost a second each')
+    parser.add_argument('--backlog', type=int, default=5, help='posts each source has at the start')
+    parser.add_argument('--rate', type=float, default=0.05, help='new posts per second per source')
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds per VK and Twitter API response')
+    parser.add_argument('--jitter', type=float, default=0.1, help='up to this many extra seconds per response')
+    parser.add_argument('--interval', type=float, default=60, help='POLL_INTERVAL of the bot')
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--subscriptions', type=int, default=30, help='random sources each chat subscribes to')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds a sweep may take')
+    args = parser.parse_args()
+
+    for sources in args.sources:
+        report(f"{sources} sources, {args.latency:g}s+{args.jitter:g}s API latency", asyncio.run(run(args, sources)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Archive ingest and /search latency at 10,000,000 posts.
+
+Posts are written the way the bot writes them, ARCHIVE_BATCH at a time through
+Archive.flush on its writer thread, while a probe measures how late the event loop
+wakes up. Their words follow a Zipf distribution, so queries can use common, middling
+and rare words; each query is narrowed to the sources of one chat, as /search is.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from datetime import datetime
+from itertools import accumulate
+
+from adapters import Post
+from archive import DELETE_CHUNK, Archive
+from benchmarks import WORKDIR, percentile, report, timed
+from config import ARCHIVE_BATCH, SEARCH_PAGE_SIZE
+
+LETTERS = 'абвгдеёжзийклмнопрстуфхцчшщыэюя'
+
+def vocabulary(size: int, rng: random.Random):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(LETTERS) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+class LoopLag:
+    """Measures how late the event loop wakes up from short sleeps that begin and end during one write."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.writing = None  # Number of the batch being written
+        self.lags = []
+
+    async def run(self):
+        while True:
+            writing = self.writing
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            # Generating the posts of the next batch blocks the loop too, but the bot doesn't do that
+            if writing is not None and writing == self.writing:
+                self.lags.append(time.monotonic() - started - self.interval)
+
+async def fill(archive: Archive, args: argparse.Namespace, words, weights, rng: random.Random):
+    """Write args.posts posts; returns the seconds each batch took and the event loop lags meanwhile."""
+    started_at = time.time() - args.days * 24 * 3600
+    step = args.days * 24 * 3600 / args.posts
+    lag = LoopLag()
+    probe = asyncio.create_task(lag.run())
+    batches = []
+    try:
+        for first in range(0, args.posts, ARCHIVE_BATCH):
+            for n in range(first, min(first + ARCHIVE_BATCH, args.posts)):
+                text = ' '.join(rng.choices(words, cum_weights=weights, k=args.words))
+                post = Post(n, text, f"https://example.com/{n}", datetime.fromtimestamp(started_at + n * step))
+                archive.add('vk', f"group{n % args.sources}", [post])
+            lag.writing = len(batches)
+            started = time.perf_counter()
+            await archive.flush()
+            batches.append(time.perf_counter() - started)
+            lag.writing = None
+            if len(batches) % 200 == 0:
+                print(f"  {archive.archived} posts written", flush=True)
+    finally:
+        probe.cancel()
+    return batches, lag.lags
+
+async def queries(archive: Archive, args: argparse.Namespace, words, rng: random.Random):
+    """Query kind -> seconds each search took, for the first and the second page."""
+    chat = [('vk', f"group{n}") for n in rng.sample(range(args.sources), args.chat_sources)]
+    common, middling, rare = words[:20], words[len(words) // 50:len(words) // 20], words[-len(words) // 5:]
+    kinds = {
+        'common word': lambda: rng.choice(common),
+        'middling word': lambda: rng.choice(middling),
+        'rare word': lambda: rng.choice(rare),
+        'common + middling word': lambda: f"{rng.choice(common)} {rng.choice(middling)}",
+    }
+    seconds = {}
+    for kind, query in kinds.items():
+        for page in (0, 1):
+            times = seconds[(kind, page)] = []
+            for _ in range(args.queries):
+                started = time.perf_counter()
+                await archive.search(query(), chat, page * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE + 1)
+                times.append(time.perf_counter() - started)
+    return seconds
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(0)
+    words = vocabulary(args.vocabulary, rng)
+    # Zipf: the n-th most common word is n times rarer than the first
+    weights = list(accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    path = os.path.join(WORKDIR, 'archive.db')
+    archive = Archive(path)
+    try:
+        started = time.perf_counter()
+        batches, lags = await fill(archive, args, words, weights, rng)
+        filled = time.perf_counter() - started
+        searches = await queries(archive, args, words, rng)
+        # Old enough for a full chunk of posts to go
+        before = time.time() - args.days * 24 * 3600 * (1 - 2 * DELETE_CHUNK / args.posts)
+        prune_seconds, pruned = timed(archive.prune, before)
+        compact_seconds, _ = timed(archive.compact)
+    finally:
+        archive.close()
+
+    tail = batches[-max(1, len(batches) // 10):]
+    rows = [
+        ('posts written per second', archive.archived / sum(batches), '/s'),
+        ('  including generating them', archive.archived / filled, '/s'),
+        (f"write of {ARCHIVE_BATCH} posts, mean", statistics.mean(batches) * 1000, 'ms'),
+        ('  p99', percentile(batches, 0.99) * 1000, 'ms'),
+        ('  mean of the last tenth', statistics.mean(tail) * 1000, 'ms'),
+        ('event loop lag while writing, p99', percentile(lags, 0.99) * 1000 if lags else None, 'ms'),
+        ('database size per post', os.path.getsize(path) / archive.archived, 'B'),
+    ]
+    for (kind, page), times in searches.items():
+        name = kind + (', page 2' if page else '')
+        rows.append((f"{name}, p50", percentile(times, 0.5) * 1000, 'ms'))
+        rows.append((f"{name}, p99", percentile(times, 0.99) * 1000, 'ms'))
+    rows += [
+        (f"prune of {pruned} old posts", prune_seconds * 1000, 'ms'),
+        ('compact', compact_seconds, 's'),
+    ]
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--posts', type=int, default=10000000)
+    parser.add_argument('--sources', type=int, default=1000)
+    parser.add_argument('--words', type=int, default=40, help='words in a post')
+    parser.add_argument('--vocabulary', type=int, default=50000, help='distinct words')
+    parser.add_argument('--days', type=float, default=180, help='days the posts are spread over')
+    parser.add_argument('--chat-sources', type=int, default=30, help='sources a search is narrowed to')
+    parser.add_argument('--queries', type=int, default=50, help='searches of each kind')
+    args = parser.parse_args()
+
+    report(f"{args.posts} posts of {args.words} words from {args.sources} sources, "
+           f"searched in {args.chat_sources} of them", asyncio.run(run(args)))
+
+if __name__ == '__main__':
+    main()
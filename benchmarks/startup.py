@@ -0,0 +1,113 @@
+"""Startup: time until the bot takes updates and answers a command, with VK and Twitter up, down or slow.
+
+The bot creates its parsers and checks their credentials in the background, so neither
+an unreachable nor a slow platform should hold up serving. A /start command is waiting
+in getUpdates from the beginning; its reply shows when commands are handled. The
+credential checks are timed by the log lines that mark each platform healthy or degraded.
+"""
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import time
+
+import bench
+import fakeapi
+from benchmarks import report
+from benchmarks.webhook import update
+
+CHAT_ID = 1
+PLATFORMS = ('vk', 'twitter')
+CHECKED = re.compile(rf"Platform ({'|'.join(PLATFORMS)}) is (healthy|degraded)")
+
+class FirstReply(fakeapi.FakeAPI):
+    """Fake API that notes when the bot first sent a message to CHAT_ID."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replied_at = None
+
+    def reset(self):
+        super().reset()
+        self.replied_at = None
+
+    async def handle_telegram(self, request):
+        response = await super().handle_telegram(request)
+        if (request.match_info['method'].lower() == 'sendmessage' and self.replied_at is None
+                and int((await self._params(request)).get('chat_id', 0)) == CHAT_ID):
+            self.replied_at = time.time()
+        return response
+
+async def replied(fake: FirstReply, timeout: float):
+    started = time.time()
+    while fake.replied_at is None:
+        if time.time() - started > timeout:
+            raise RuntimeError(f"No reply to /start within {timeout}s")
+        await asyncio.sleep(0.01)
+
+async def checked(run: bench.BotRun, started: float, timeout: float):
+    """Platform -> (status, seconds from the start until its credential check was over)."""
+    states = {}
+    while len(states) < len(PLATFORMS) and time.time() - started < timeout:
+        with open(os.path.join(run.workdir, 'bot.out'), encoding='utf-8', errors='replace') as f:
+            for platform, status in CHECKED.findall(f.read()):
+                states.setdefault(platform, (status, time.time() - started))
+        await asyncio.sleep(0.05)
+    return states
+
+async def start(args: argparse.Namespace, faults: fakeapi.Faults):
+    fake = FirstReply(vk=args.sources, twitter=args.sources, rate=0, backlog=0,
+                      faults={'vk': faults, 'twitter': faults})
+    fake.updates.append(update(1, CHAT_ID, '/start'))
+    await fake.start(port=0)
+    run = bench.BotRun(fake, bench.DEFAULT_ENV)
+    try:
+        run.setup(args.chats, args.subscriptions)
+        started = time.time()
+        ready = await run.start()
+        await replied(fake, args.timeout)
+        samples = await run.scrape()
+        states = await checked(run, started, args.timeout)
+    finally:
+        run.stop()
+        await fake.stop()
+    return ready, fake.replied_at - started, bench.metric_sum(samples, 'bot_startup_seconds'), states
+
+async def run(args: argparse.Namespace, faults: fakeapi.Faults):
+    runs = [await start(args, faults) for _ in range(args.runs)]
+    ready, reply, startup, states = zip(*runs)
+    rows = [
+        ('taking updates, median', statistics.median(ready), 's'),
+        ('taking updates, max', max(ready), 's'),
+        ('reply to /start, median', statistics.median(reply), 's'),
+        ('reply to /start, max', max(reply), 's'),
+        ('bot_startup_seconds, median', statistics.median(startup), 's'),
+    ]
+    for platform in PLATFORMS:
+        done = [state[platform] for state in states if platform in state]
+        rows.append((f"{platform} checked, median", statistics.median(seconds for _, seconds in done) if done else None,
+                     ', '.join(sorted({status for status, _ in done})) or f"not within {args.timeout:g}s"))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5, help='starts per scenario')
+    parser.add_argument('--sources', type=int, default=100, help='VK groups and as many Twitter users')
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--subscriptions', type=int, default=10, help='random sources each chat subscribes to')
+    parser.add_argument('--slow', type=float, default=10, help='seconds per response of the slow APIs')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for the reply')
+    args = parser.parse_args()
+
+    scenarios = {
+        'VK and Twitter up': fakeapi.Faults(),
+        'VK and Twitter down': fakeapi.Faults(error_rate=1.0),
+        f"VK and Twitter answering in {args.slow:g}s": fakeapi.Faults(latency=args.slow),
+    }
+    for title, faults in scenarios.items():
+        report(f"{title}, {args.runs} starts, {args.sources * 2} sources, {args.chats} chats",
+               asyncio.run(run(args, faults)))
+
+if __name__ == '__main__':
+    main()
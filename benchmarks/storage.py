@@ -0,0 +1,71 @@
+"""Storage lookups, cursor updates and removals at 1,000 and 10,000 sources.
+
+Lookups and no-op removals only touch the in-memory indexes, so their cost should not grow
+with the number of sources; cursor updates and removals add one SQLite transaction each.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+
+from benchmarks import report, timed
+from storage import Storage
+
+SOURCE_TYPES = ('vk', 'twitter', 'rss')
+
+def populate(path: str, sources: int, chats: int, subscriptions: int):
+    storage = Storage(path, SOURCE_TYPES)
+    keys = [(SOURCE_TYPES[n % len(SOURCE_TYPES)], f"source{n}") for n in range(sources)]
+    rng = random.Random(0)
+    with storage.conn:
+        storage.conn.executemany('INSERT INTO sources (source_type, source_id, name) VALUES (?, ?, ?)',
+                                 [(source_type, source_id, source_id) for source_type, source_id in keys])
+        storage.conn.executemany('INSERT INTO chats (chat_id) VALUES (?)', [(chat_id,) for chat_id in range(chats)])
+        storage.conn.executemany('INSERT INTO subscriptions VALUES (?, ?, ?)', [
+            (chat_id, source_type, source_id)
+            for chat_id in range(chats) for source_type, source_id in rng.sample(keys, subscriptions)
+        ])
+    storage.close()
+    return keys
+
+def run(args: argparse.Namespace, sources: int):
+    path = os.path.join(tempfile.mkdtemp(prefix='bot-bench-storage-'), 'bot.db')
+    keys = populate(path, sources, args.chats, args.subscriptions)
+    load_seconds, storage = timed(Storage, path, SOURCE_TYPES)
+    rng = random.Random(1)
+    sample = rng.sample(keys, min(args.operations, len(keys)))
+
+    lookups = [timed(storage.get_source, *key, repeat=3)[0] for key in sample]
+    updates = [timed(storage.update_last_post_id, *key, 100)[0] for key in sample]
+    batch_seconds, _ = timed(storage.update_last_post_ids, [(*key, 200) for key in keys])
+    changes = storage.conn.total_changes
+    missing = [timed(storage.remove_source, source_type, f"missing{n}")[0]
+               for n, (source_type, _) in enumerate(sample)]
+    noop_writes = storage.conn.total_changes - changes
+    removals = [timed(storage.remove_source, *key)[0] for key in sample]
+    storage.close()
+
+    return [
+        ('load sources and subscriptions', load_seconds, 's'),
+        ('get_source, mean', statistics.mean(lookups) * 1e6, 'us'),
+        ('update_last_post_id, mean', statistics.mean(updates) * 1000, 'ms'),
+        (f"update_last_post_ids of all {sources}", batch_seconds * 1000, 'ms'),
+        ('remove_source of a missing source, mean', statistics.mean(missing) * 1e6, 'us'),
+        ('rows written by those removals', noop_writes, ''),
+        ('remove_source, mean', statistics.mean(removals) * 1000, 'ms'),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sources', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--subscriptions', type=int, default=20, help='sources each chat subscribes to')
+    parser.add_argument('--operations', type=int, default=500, help='lookups, updates and removals measured')
+    args = parser.parse_args()
+
+    for sources in args.sources:
+        report(f"{sources} sources, {args.chats} chats x {args.subscriptions} subscriptions", run(args, sources))
+
+if __name__ == '__main__':
+    main()
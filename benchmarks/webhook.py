@@ -0,0 +1,131 @@
+"""Webhook load: updates per second and reply latency with one or more WEBHOOK_WORKERS processes, against fakeapi.py.
+
+Every simulated user sends a command from a chat of its own and waits for the bot's
+reply before sending the next, so the reply latency includes queuing in the webhook
+server, the refresh of state other processes changed, the handler and the Bot API call.
+Some commands change chats' filters and digest mode, which the other processes reload.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import aiohttp
+
+import bench
+import fakeapi
+from benchmarks import percentile, report
+
+SECRET = 'bench'
+# Mostly reads, with writes to the shared tables in between; /list_sources answers with a message per source
+COMMANDS = (['/list_sources'] * 6 + ['/filter include выборы', '/filter clear', '/digest on', '/digest off'])
+
+class ReplyWatcher(fakeapi.FakeAPI):
+    """Fake API that tells a waiting user when its chat got all the messages of a reply."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._waiting = {}  # Chat ID -> [messages still expected, event set once they arrived]
+
+    def expect(self, chat_id: int, messages: int) -> asyncio.Event:
+        event = asyncio.Event()
+        self._waiting[chat_id] = [messages, event]
+        return event
+
+    async def handle_telegram(self, request):
+        response = await super().handle_telegram(request)
+        if request.match_info['method'].lower() in ('sendmessage', 'sendphoto', 'sendmediagroup'):
+            waiting = self._waiting.get(int((await self._params(request)).get('chat_id', 0)))
+            if waiting is not None:
+                waiting[0] -= 1
+                if waiting[0] <= 0:
+                    waiting[1].set()
+        return response
+
+def update(update_id: int, chat_id: int, text: str):
+    command = text.split()[0]
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': text,
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    }}
+
+async def user(session, url: str, fake: ReplyWatcher, chat_id: int, subscriptions: int, updates,
+               rng: random.Random, acks, replies, timeout: float):
+    while True:
+        try:
+            update_id = next(updates)
+        except StopIteration:
+            return
+        command = rng.choice(COMMANDS)
+        replied = fake.expect(chat_id, subscriptions if command == '/list_sources' else 1)
+        started = time.monotonic()
+        async with session.post(url, json=update(update_id, chat_id, command),
+                                headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as response:
+            response.raise_for_status()
+        acks.append(time.monotonic() - started)
+        try:
+            await asyncio.wait_for(replied.wait(), timeout)
+        except asyncio.TimeoutError:
+            continue
+        replies.append(time.monotonic() - started)
+
+async def run(args: argparse.Namespace, workers: int):
+    fake = ReplyWatcher(rss=args.feeds, rate=0, backlog=0)  # Feeds without posts: only replies reach the chats
+    fake.faults['telegram'] = fakeapi.Faults(latency=args.telegram_latency)
+    await fake.start(port=0)
+    port = bench.free_port()
+    run = bench.BotRun(fake, {
+        'BOT_MODE': 'webhook', 'WEBHOOK_URL': f"http://127.0.0.1:{port}/webhook", 'WEBHOOK_SECRET': SECRET,
+        'WEBAPP_HOST': '127.0.0.1', 'WEBAPP_PORT': str(port), 'WEBHOOK_WORKERS': str(workers),
+        'TELEGRAM_GLOBAL_RATE': '10000', 'TELEGRAM_CHAT_INTERVAL': '0'
+    })
+    acks, replies = [], []
+    try:
+        run.setup(args.chats, args.subscriptions)
+        await run.start()
+        # The extra processes start listening on the shared port after the primary one
+        await asyncio.sleep(args.settle)
+        updates = iter(range(1, args.updates + 1))
+        rng = random.Random(0)
+        started = time.monotonic()
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.users)) as session:
+            await asyncio.gather(*(
+                user(session, f"http://127.0.0.1:{port}/webhook", fake, chat_id, min(args.subscriptions, args.feeds),
+                     updates, rng, acks, replies, args.timeout)
+                for chat_id in range(1, args.users + 1)
+            ))
+        elapsed = time.monotonic() - started
+    finally:
+        run.stop()
+        await fake.stop()
+    return elapsed, acks, replies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help='WEBHOOK_WORKERS values to compare')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=64, help='chats sending commands at once')
+    parser.add_argument('--chats', type=int, default=1000, help='chats in the database')
+    parser.add_argument('--feeds', type=int, default=100)
+    parser.add_argument('--subscriptions', type=int, default=5, help='feeds per chat')
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help='seconds per Bot API call')
+    parser.add_argument('--settle', type=float, default=3, help='seconds given to the extra processes to start')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds a user waits for a reply')
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        elapsed, acks, replies = asyncio.run(run(args, workers))
+        report(f"{workers} webhook processes, {args.users} users, {args.chats} chats", [
+            ('updates per second', len(acks) / elapsed, '/s'),
+            ('acknowledged, p50', percentile(acks, 0.5) * 1000, 'ms'),
+            ('acknowledged, p99', percentile(acks, 0.99) * 1000, 'ms'),
+            ('replied, mean', statistics.mean(replies) * 1000 if replies else None, 'ms'),
+            ('replied, p99', percentile(replies, 0.99) * 1000 if replies else None, 'ms'),
+            ('updates without a reply', len(acks) - len(replies), ''),
+        ])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+DISABLED = 'disabled'
+
+class Breaker:
+    """Circuit breaker state of one source or platform."""
+    __slots__ = ('key', 'state', 'failures', 'first_failure_at', 'retry_at', 'last_error', 'probe_started_at')
+
+    def __init__(self, key: str, state: str = CLOSED, failures: int = 0, first_failure_at: Optional[float] = None,
+                 retry_at: float = 0.0, last_error: Optional[str] = None):
+        self.key = key
+        self.state = state
+        self.failures = failures  # Consecutive failures
+        self.first_failure_at = first_failure_at  # Unix time the current failure streak began
+        self.retry_at = retry_at  # Unix time an open breaker lets a probe through
+        self.last_error = last_error
+        self.probe_started_at = None
+
+    def to_row(self) -> Tuple:
+        return self.key, self.state, self.failures, self.first_failure_at, self.retry_at, self.last_error
+
+class CircuitBreakers:
+    """Circuit breakers keyed by source or platform.
+
+    After `threshold` consecutive failures a breaker opens and calls are refused until
+    its delay passes; the delay doubles with every further failure up to `max_delay`.
+    Then a single probe is let through (half-open): success closes the breaker, failure
+    opens it again. A breaker failing for longer than `disable_after` seconds is
+    disabled and stays so until reset.
+    """
+
+    def __init__(self, threshold: int, base_delay: float, max_delay: float, disable_after: Optional[float] = None,
+                 probe_timeout: float = 300, breakers: Iterable[Breaker] = ()):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.disable_after = disable_after
+        self.probe_timeout = probe_timeout  # A probe that never reported back is replaced after this
+        self._breakers: Dict[str, Breaker] = {}
+        self._dirty = set()
+        self.load(breakers)
+
+    def load(self, breakers: Iterable[Breaker]):
+        """Replace the state with saved breakers, e.g. after another process changed them."""
+        self._breakers = {breaker.key: breaker for breaker in breakers}
+        self._dirty.clear()
+
+    def get(self, key: str) -> Breaker:
+        breaker = self._breakers.get(key)
+        return breaker if breaker is not None else Breaker(key)
+
+    def allow(self, key: str) -> bool:
+        """Whether a call may go out now; an open breaker whose delay passed admits one probe."""
+        breaker = self._breakers.get(key)
+        if breaker is None or breaker.state == CLOSED:
+            return True
+        if breaker.state == DISABLED:
+            return False
+        now = time.time()
+        if breaker.state == OPEN:
+            if now < breaker.retry_at:
+                return False
+            breaker.state = HALF_OPEN
+            self._dirty.add(key)
+        elif breaker.probe_started_at is not None and now - breaker.probe_started_at < self.probe_timeout:
+            return False
+        breaker.probe_started_at = now
+        return True
+
+    def release(self, key: str):
+        """Give back a probe that wasn't used, so the next call can probe instead."""
+        breaker = self._breakers.get(key)
+        if breaker is not None:
+            breaker.probe_started_at = None
+
+    def paused_until(self, key: str) -> float:
+        """Unix time until which an open breaker refuses calls, or 0."""
+        breaker = self._breakers.get(key)
+        return breaker.retry_at if breaker is not None and breaker.state == OPEN else 0.0
+
+    def retry_at(self, key: str) -> float:
+        """Unix time a refused call should be retried."""
+        breaker = self.get(key)
+        return max(breaker.retry_at, time.time() + 1) if breaker.state == OPEN else time.time() + self.base_delay
+
+    def is_disabled(self, key: str) -> bool:
+        breaker = self._breakers.get(key)
+        return breaker is not None and breaker.state == DISABLED
+
+    def record_success(self, key: str) -> Optional[str]:
+        """Close the breaker; returns the state it left if it wasn't closed."""
+        breaker = self._breakers.pop(key, None)
+        if breaker is None:
+            return None
+        self._dirty.add(key)
+        return breaker.state if breaker.state != CLOSED else None
+
+    def record_failure(self, key: str, error: str) -> Optional[str]:
+        """Count a failure; returns the new state if the breaker just opened or got disabled."""
+        now = time.time()
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = Breaker(key, first_failure_at=now)
+        if breaker.state == DISABLED:
+            return None
+        previous = breaker.state
+        breaker.failures += 1
+        breaker.last_error = error[:500]
+        breaker.probe_started_at = None
+        self._dirty.add(key)
+
+        if self.disable_after is not None and now - breaker.first_failure_at >= self.disable_after \
+                and breaker.failures >= self.threshold:
+            breaker.state = DISABLED
+            return DISABLED
+        if breaker.failures >= self.threshold:
+            delay = min(self.max_delay, self.base_delay * 2 ** (breaker.failures - self.threshold))
+            breaker.state = OPEN
+            breaker.retry_at = now + delay
+            return OPEN if previous == CLOSED else None
+        return None
+
+    def reset(self, key: str) -> bool:
+        """Forget a breaker, re-enabling a disabled source; returns True if it wasn't closed."""
+        return self.record_success(key) is not None
+
+    def discard(self, key: str):
+        """Forget a breaker whose source was removed."""
+        if self._breakers.pop(key, None) is not None:
+            self._dirty.add(key)
+
+    def pop_dirty(self) -> Tuple[List[Tuple], List[str]]:
+        """Breakers changed since the last call: rows to save and keys to delete."""
+        rows, deleted = [], []
+        for key in self._dirty:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                deleted.append(key)
+            else:
+                rows.append(breaker.to_row())
+        self._dirty.clear()
+        return rows, deleted
+
+    def problems(self) -> List[Breaker]:
+        """Breakers that aren't closed, worst first."""
+        order = {DISABLED: 0, OPEN: 1, HALF_OPEN: 2, CLOSED: 3}
+        return sorted(
+            (breaker for breaker in self._breakers.values() if breaker.state != CLOSED),
+            key=lambda breaker: (order[breaker.state], breaker.key)
+        )
+
+def source_key(source_type: str, source_id: str) -> str:
+    return f"{source_type}:{source_id}"
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from config import POST_CACHE_SIZE, POST_CACHE_TTL, POST_CACHE_POSTS, logger
+from adapters import Post
+
+class PostCache:
+    """Bounded LRU cache of the latest posts of each source, with a TTL.
+
+    The background poller keeps entries fresh, so button clicks are served from
+    memory. Concurrent misses for the same source share a single fetch. Entries the
+    poller started with fewer posts than a click shows are only served once polls
+    have filled them up.
+    """
+
+    def __init__(self, max_sources: int = POST_CACHE_SIZE, ttl: float = POST_CACHE_TTL,
+                 posts_per_source: int = POST_CACHE_POSTS):
+        self.max_sources = max_sources
+        self.ttl = ttl
+        self.posts_per_source = posts_per_source
+        self._entries: 'OrderedDict[Hashable, List[Any]]' = OrderedDict()  # key -> [stored_at, posts, complete]
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[List[Post]]:
+        """Cached posts of a source, newest first, or None if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            return None
+        if not entry[2]:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Hashable, posts: List[Post], complete: bool = True):
+        """Store the latest posts of a source, newest first; incomplete ones aren't served yet."""
+        self._entries[key] = [time.monotonic(), posts[:self.posts_per_source], complete]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_sources:
+            self._entries.popitem(last=False)
+
+    def add_new(self, key: Hashable, new_posts: List[Post]):
+        """Merge freshly polled posts into a cached entry and renew its TTL.
+
+        An empty poll still proves the cached posts are current. Polls of sources that
+        aren't cached start an entry, which is complete once they add up to a full page.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            if new_posts:
+                self.put(key, new_posts, len(new_posts) >= self.posts_per_source)
+            return
+        known = {post.id for post in new_posts}
+        posts = list(new_posts) + [post for post in entry[1] if post.id not in known]
+        self.put(key, posts, entry[2] or len(posts) >= self.posts_per_source)
+
+    def discard(self, key: Hashable):
+        """Forget a source."""
+        self._entries.pop(key, None)
+
+    async def get_or_fetch(self, key: Hashable,
+                           fetch: Callable[[], Awaitable[List[Post]]]) -> List[Post]:
+        """Return cached posts, fetching them once for all concurrent callers on a miss."""
+        posts = self.get(key)
+        if posts is not None:
+            self.hits += 1
+            return posts
+
+        self.misses += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            posts = await fetch()
+            # Empty results are usually errors, so don't pin them in the cache
+            if posts:
+                self.put(key, posts)
+            future.set_result(posts)
+            return posts
+        except Exception as e:
+            logger.error(f"Error fetching posts for {key}: {e}")
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            # A cancelled fetch would otherwise leave the waiters hanging
+            if not future.done():
+                future.cancel()
+            del self._inflight[key]
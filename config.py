@@ -1,29 +1,47 @@
 import os
+import atexit
 import logging
+import logging.handlers
+import queue
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 # File paths
-SOURCES_FILE = 'sources.json'
+SOURCES_FILE = 'sources.json'  # Legacy storage, migrated into DATABASE_FILE on first start
+DATABASE_FILE = os.getenv('DATABASE_FILE', 'bot.db')
 LOG_FILE = 'bot.log'
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: records are queued and written to the file and console by a
+# background thread, so logging never blocks the event loop on disk
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [logging.FileHandler(LOG_FILE), logging.StreamHandler()]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # Full format is applied by the listener
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
 logger = logging.getLogger(__name__)
 
 # Bot configuration
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+ADMIN_CHAT_ID = int(os.getenv('ADMIN_CHAT_ID', '0')) or None  # Chat allowed to use /stats
 VK_ACCESS_TOKEN = os.getenv('VK_ACCESS_TOKEN')
 
+# Update delivery: 'polling' (long polling) or 'webhook' (aiohttp server)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public HTTPS URL Telegram posts updates to, e.g. https://example.com/webhook
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Checked against Telegram's secret token header
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8080'))
+WEBHOOK_MAX_HANDLERS = int(os.getenv('WEBHOOK_MAX_HANDLERS', '64'))  # Updates processed at once per process
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '1'))  # Processes sharing the webhook port
+
 # Twitter API configuration
 TWITTER_API_KEY = os.getenv('TWITTER_API_KEY')
 TWITTER_API_SECRET = os.getenv('TWITTER_API_SECRET')
@@ -31,6 +49,134 @@ TWITTER_ACCESS_TOKEN = os.getenv('TWITTER_ACCESS_TOKEN')
 TWITTER_ACCESS_TOKEN_SECRET = os.getenv('TWITTER_ACCESS_TOKEN_SECRET')
 TWITTER_BEARER_TOKEN = os.getenv('TWITTER_BEARER_TOKEN')  # Bearer token for v2 API
 
+# API hosts; point them at fakeapi.py to run offline or benchmark without credentials
+VK_API_URL = os.getenv('VK_API_URL', 'https://api.vk.com')
+TWITTER_API_URL = os.getenv('TWITTER_API_URL', 'https://api.twitter.com')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # Bot API base URL, api.telegram.org if unset
+
+# Polling configuration
+POLL_CONCURRENCY = int(os.getenv('POLL_CONCURRENCY', '16'))  # Global limit of simultaneous fetches
+VK_CONCURRENCY = int(os.getenv('VK_CONCURRENCY', '3'))
+TWITTER_CONCURRENCY = int(os.getenv('TWITTER_CONCURRENCY', '4'))
+FETCH_TIMEOUT = float(os.getenv('FETCH_TIMEOUT', '60'))  # Seconds before a single source fetch is abandoned
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '15'))  # Seconds for a single HTTP request to VK/Twitter
+VK_REQUESTS_PER_SECOND = float(os.getenv('VK_REQUESTS_PER_SECOND', '3'))  # Per-token VK API limit
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '5'))  # Longest a call waits for a token before postponing
+VK_EXECUTE_BATCH = min(int(os.getenv('VK_EXECUTE_BATCH', '25')), 25)  # wall.get calls per execute request (VK max is 25)
+
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', '60'))  # Seconds between checks of a degraded platform
+
+# Circuit breakers: sources and whole platforms that keep failing are paused, probed and finally disabled
+BREAKER_THRESHOLD = int(os.getenv('BREAKER_THRESHOLD', '3'))  # Consecutive failures before a source is paused
+BREAKER_BASE_DELAY = float(os.getenv('BREAKER_BASE_DELAY', '900'))  # First pause, doubled after every failed probe
+BREAKER_MAX_DELAY = float(os.getenv('BREAKER_MAX_DELAY', str(12 * 3600)))
+BREAKER_DISABLE_AFTER = float(os.getenv('BREAKER_DISABLE_AFTER', str(3 * 24 * 3600)))  # Seconds of failure before disabling
+PLATFORM_BREAKER_THRESHOLD = int(os.getenv('PLATFORM_BREAKER_THRESHOLD', '10'))  # Consecutive failures across sources
+PLATFORM_BREAKER_BASE_DELAY = float(os.getenv('PLATFORM_BREAKER_BASE_DELAY', '60'))
+PLATFORM_BREAKER_MAX_DELAY = float(os.getenv('PLATFORM_BREAKER_MAX_DELAY', '3600'))
+
+# Catch-up pagination for sources that posted more than one page since the last poll
+CATCHUP_MAX_POSTS = int(os.getenv('CATCHUP_MAX_POSTS', '200'))  # How far back a single poll may go
+VK_PAGE_SIZE = 100  # wall.get maximum
+TWITTER_PAGE_SIZE = 100  # get_users_tweets maximum
+
+# RSS/Atom feeds, fetched over a shared keep-alive connection pool
+RSS_CONCURRENCY = int(os.getenv('RSS_CONCURRENCY', '16'))  # Simultaneous feed downloads
+RSS_CONNECTIONS_PER_HOST = int(os.getenv('RSS_CONNECTIONS_PER_HOST', '4'))
+RSS_KEEPALIVE_TIMEOUT = float(os.getenv('RSS_KEEPALIVE_TIMEOUT', '120'))  # Seconds an idle connection is kept open
+RSS_MAX_FEED_BYTES = int(os.getenv('RSS_MAX_FEED_BYTES', str(20 * 1024 * 1024)))  # Larger feeds are abandoned
+RSS_SEEN_GUIDS = int(os.getenv('RSS_SEEN_GUIDS', '500'))  # Item GUIDs remembered per feed
+RSS_FIRST_POSTS = 10  # Items delivered when a feed is polled for the first time
+RSS_TEXT_LIMIT = 1500  # Characters of an item's description included in the message
+RSS_USER_AGENT = os.getenv('RSS_USER_AGENT', 'NewsTelegramBot/1.0 (+https://github.com/Yoxi228/News-Telegram-Bot)')
+
+# Adaptive scheduling: per-source intervals in seconds
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', '600'))  # Starting interval for a new source
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', '60'))
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', '3600'))
+POLL_JITTER = float(os.getenv('POLL_JITTER', '0.1'))  # Fraction of the interval added or removed at random
+POLL_ERROR_BACKOFF_MAX = float(os.getenv('POLL_ERROR_BACKOFF_MAX', '21600'))
+SCHEDULER_TICK = float(os.getenv('SCHEDULER_TICK', '5'))  # Longest sleep between scheduler checks
+BATCH_FILL_WINDOW = float(os.getenv('BATCH_FILL_WINDOW', '0.1'))  # Share of its interval a source may be polled early to fill a batch
+
+# Source name -> numeric ID resolution cache
+RESOLVE_TTL = int(os.getenv('RESOLVE_TTL', str(7 * 24 * 3600)))  # Seconds before a resolved ID is refreshed
+RESOLVE_REFRESH_INTERVAL = int(os.getenv('RESOLVE_REFRESH_INTERVAL', '3600'))
+
+# Cache of the latest posts shown by the "show posts" button
+POST_CACHE_SIZE = int(os.getenv('POST_CACHE_SIZE', '1000'))  # Sources kept in memory
+POST_CACHE_POSTS = 10  # Posts kept per source
+POST_CACHE_TTL = float(os.getenv('POST_CACHE_TTL', str(2 * POLL_MAX_INTERVAL)))
+
+# Cross-source deduplication of near-identical posts
+DEDUP_FILE = os.getenv('DEDUP_FILE', 'dedup.bin')
+DEDUP_WINDOW = float(os.getenv('DEDUP_WINDOW', str(48 * 3600)))  # Seconds a post is remembered
+DEDUP_MAX_ENTRIES = int(os.getenv('DEDUP_MAX_ENTRIES', '200000'))  # Memory bound of the index
+DEDUP_MAX_DISTANCE = int(os.getenv('DEDUP_MAX_DISTANCE', '3'))  # SimHash bits that may differ (at most 3)
+DEDUP_MIN_TOKENS = int(os.getenv('DEDUP_MIN_TOKENS', '5'))  # Shorter posts are never treated as duplicates
+DEDUP_SAVE_INTERVAL = float(os.getenv('DEDUP_SAVE_INTERVAL', '300'))
+
+# Per-chat filters of delivered posts
+FILTER_MAX_RULES = int(os.getenv('FILTER_MAX_RULES', '50'))  # Rules per chat
+FILTER_MAX_PATTERN_LENGTH = 200  # Characters per keyword or regex
+
+# Telegram delivery configuration
+DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', '8'))
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))  # Messages per second across all chats
+TELEGRAM_CHAT_INTERVAL = float(os.getenv('TELEGRAM_CHAT_INTERVAL', '1'))  # Seconds between messages to one chat
+DELIVERY_MAX_ATTEMPTS = int(os.getenv('DELIVERY_MAX_ATTEMPTS', '3'))
+
+# Outbox: messages are stored before cursors move and kept until Telegram accepts them
+OUTBOX_RETRY_INTERVAL = float(os.getenv('OUTBOX_RETRY_INTERVAL', '60'))  # Seconds between resends of failed messages
+OUTBOX_KEY_TTL = float(os.getenv('OUTBOX_KEY_TTL', str(7 * 24 * 3600)))  # Seconds a sent message's key blocks repeats
+OUTBOX_MAX_AGE = float(os.getenv('OUTBOX_MAX_AGE', str(24 * 3600)))  # Seconds before an unsent message is given up
+OUTBOX_ACK_INTERVAL = float(os.getenv('OUTBOX_ACK_INTERVAL', '1'))  # Seconds sent messages wait to be marked in one write
+OUTBOX_ACK_BATCH = int(os.getenv('OUTBOX_ACK_BATCH', '100'))  # Sent messages that are marked without waiting for the interval
+
+# Photo albums
+MEDIA_DOWNLOAD_WORKERS = int(os.getenv('MEDIA_DOWNLOAD_WORKERS', '4'))  # Concurrent photo downloads
+MEDIA_CACHE_SIZE = int(os.getenv('MEDIA_CACHE_SIZE', '10000'))  # Photo URL -> Telegram file_id entries kept
+MEDIA_PREFETCH_LIMIT = int(os.getenv('MEDIA_PREFETCH_LIMIT', '200'))  # Downloaded photos kept in memory until uploaded
+MEDIA_MAX_BYTES = 10 * 1024 * 1024  # Telegram photo upload limit
+
+# Digest mode: a chat's posts are collected and sent as a few long messages
+DIGEST_INTERVAL = float(os.getenv('DIGEST_INTERVAL', '3600'))  # Default seconds a digest collects posts
+DIGEST_MIN_INTERVAL = float(os.getenv('DIGEST_MIN_INTERVAL', '60'))
+DIGEST_MAX_INTERVAL = float(os.getenv('DIGEST_MAX_INTERVAL', str(24 * 3600)))
+DIGEST_MAX_POSTS = int(os.getenv('DIGEST_MAX_POSTS', '50'))  # Default posts that send a digest early
+DIGEST_POSTS_LIMIT = 500  # Most posts a chat may let a digest collect
+DIGEST_POST_LIMIT = int(os.getenv('DIGEST_POST_LIMIT', '500'))  # Characters of a post's text in a digest
+
+# Archive of fetched posts with full-text search
+ARCHIVE_FILE = os.getenv('ARCHIVE_FILE', 'archive.db')
+ARCHIVE_FLUSH_INTERVAL = float(os.getenv('ARCHIVE_FLUSH_INTERVAL', '5'))  # Seconds between batched writes
+ARCHIVE_BATCH = int(os.getenv('ARCHIVE_BATCH', '5000'))  # Buffered posts that trigger a write right away
+ARCHIVE_RETENTION_DAYS = float(os.getenv('ARCHIVE_RETENTION_DAYS', '180'))  # 0 keeps posts forever
+ARCHIVE_MAINTENANCE_INTERVAL = float(os.getenv('ARCHIVE_MAINTENANCE_INTERVAL', '3600'))  # Pruning and index merging
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '5'))  # Results per /search page
+SEARCH_CANDIDATES = int(os.getenv('SEARCH_CANDIDATES', '1000'))  # Newest matches ranked per search
+
+# Sharded polling: worker processes split the sources between them, this process only talks to Telegram
+POLL_WORKERS = int(os.getenv('POLL_WORKERS', '0'))  # 0 polls in the bot process itself
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv('WORKER_HEARTBEAT_INTERVAL', '5'))
+WORKER_LEASE_TTL = float(os.getenv('WORKER_LEASE_TTL', '30'))  # Seconds without a heartbeat before a shard is taken over
+SHARD_VNODES = 64  # Points per worker on the consistent hash ring
+RELAY_INTERVAL = float(os.getenv('RELAY_INTERVAL', '1'))  # Seconds between checks for posts published by workers
+RELAY_BATCH = 500  # Published posts delivered per check
+
+# Metrics
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))  # Port of the /metrics endpoint, 0 disables it
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '1'))  # Seconds between event loop lag probes
+
+def worker_env(name: str, worker_id: int = None):
+    """A credential for a poll worker: NAME_<worker_id> if set, otherwise NAME."""
+    if worker_id is not None:
+        value = os.getenv(f"{name}_{worker_id}")
+        if value:
+            return value
+    return os.getenv(name)
+
 def check_config():
     """Check if all required environment variables are set."""
     required_vars = [
@@ -43,6 +189,9 @@ def check_config():
         'TWITTER_BEARER_TOKEN'  # Added Bearer token check
     ]
 
+    if BOT_MODE == 'webhook':
+        required_vars.append('WEBHOOK_URL')
+
     missing_vars = [var for var in required_vars if not os.getenv(var)]
     if missing_vars:
         logger.error(f"Missing required environment variables: {', '.join(missing_vars)}")
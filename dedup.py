@@ -0,0 +1,233 @@
+import hashlib
+import os
+import re
+import time
+from array import array
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import (
+    DEDUP_FILE,
+    DEDUP_WINDOW,
+    DEDUP_MAX_ENTRIES,
+    DEDUP_MAX_DISTANCE,
+    DEDUP_MIN_TOKENS,
+    logger
+)
+
+URL_RE = re.compile(r'(?:https?://|www\.)\S+', re.IGNORECASE)
+TRACKING_PARAM_RE = re.compile(r'([?&])(?:utm_[a-z]+|fbclid|gclid|ref|from)=[^&#]*', re.IGNORECASE)
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+BANDS = 4  # 64-bit fingerprints split into 4 bands of 16 bits
+BAND_BITS = 64 // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+FILE_MAGIC = 0x6465647570763200  # Saved indexes with recipients start with it; older files had none
+
+def normalize_url(url: str) -> str:
+    """Reduce a link to a canonical form: no scheme, www, tracking params or trailing slash."""
+    url = url.lower().rstrip('.,;:!?)»"\'')
+    url = re.sub(r'^(?:https?://)?(?:www\.|m\.|mobile\.)?', '', url)
+    url = TRACKING_PARAM_RE.sub(r'\1', url)
+    return url.rstrip('?&#/')
+
+def normalize(text: str) -> List[str]:
+    """Turn post text into tokens: lowercased words plus canonical links."""
+    links = [normalize_url(url) for url in URL_RE.findall(text)]
+    words = WORD_RE.findall(URL_RE.sub(' ', text).lower())
+    return words + links
+
+def _hash64(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def simhash(tokens: List[str]) -> int:
+    """64-bit SimHash of word bigrams, so reordered or slightly edited texts stay close.
+
+    A bit is set when more than half of the shingle hashes have it. The hashes are joined
+    as one binary string and each bit is counted over a strided slice of it, which keeps the
+    per-hash work out of Python; this runs on the event loop for every fetched post.
+    """
+    shingles = [' '.join(tokens[i:i + 2]) for i in range(max(1, len(tokens) - 1))]
+    bits = ''.join([format(_hash64(shingle), '064b') for shingle in shingles])
+    half = len(shingles) / 2
+    fingerprint = 0
+    for offset in range(64):  # Most significant bit first
+        fingerprint = fingerprint << 1 | (bits[offset::64].count('1') > half)
+    return fingerprint
+
+class DedupIndex:
+    """Time-windowed, memory-bounded index of post fingerprints for near-duplicate detection.
+
+    Fingerprints within DEDUP_MAX_DISTANCE bits of each other are duplicates. With the
+    fingerprint split into BANDS bands, any such pair shares at least one exact band
+    (as long as the distance is below BANDS), so a lookup only compares against the
+    few fingerprints in the matching band buckets. Every fingerprint keeps the chats the
+    post went to, since a chat that didn't get the story from one source should still
+    get it from another.
+    """
+
+    def __init__(self, path: str = DEDUP_FILE, window: float = DEDUP_WINDOW,
+                 max_entries: int = DEDUP_MAX_ENTRIES, max_distance: int = DEDUP_MAX_DISTANCE):
+        self.path = path
+        self.window = window
+        self.max_entries = max_entries
+        self.max_distance = min(max_distance, BANDS - 1)
+        self._entries: Deque[Tuple[float, int]] = deque()  # (added_at, fingerprint), oldest first
+        self._buckets: Dict[int, List[int]] = {}  # band key -> fingerprints
+        self._chats: Dict[int, Set[int]] = {}  # fingerprint -> chats the post went to
+        self.duplicates = 0
+        self.dirty = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _band_keys(fingerprint: int):
+        for band in range(BANDS):
+            yield band << BAND_BITS | (fingerprint >> (band * BAND_BITS) & BAND_MASK)
+
+    def _add(self, fingerprint: int, added_at: float, chat_ids: Iterable[int]):
+        self._entries.append((added_at, fingerprint))
+        self._chats[fingerprint] = set(chat_ids)
+        for key in self._band_keys(fingerprint):
+            self._buckets.setdefault(key, []).append(fingerprint)
+
+    def _drop(self, fingerprint: int):
+        del self._chats[fingerprint]
+        for key in self._band_keys(fingerprint):
+            bucket = self._buckets[key]
+            bucket.remove(fingerprint)
+            if not bucket:
+                del self._buckets[key]
+
+    def _evict(self, now: float):
+        """Drop fingerprints older than the window or beyond the size bound."""
+        while self._entries and (len(self._entries) > self.max_entries or now - self._entries[0][0] > self.window):
+            _, fingerprint = self._entries.popleft()
+            self._drop(fingerprint)
+
+    def find(self, fingerprint: int) -> Optional[int]:
+        """Return a remembered fingerprint close to the given one, if any."""
+        for key in self._band_keys(fingerprint):
+            for candidate in self._buckets.get(key, ()):
+                if bin(candidate ^ fingerprint).count('1') <= self.max_distance:
+                    return candidate
+        return None
+
+    def delivered_to(self, fingerprint: int) -> Set[int]:
+        """Chats that got a post close to the given fingerprint."""
+        chat_ids = set()
+        for key in self._band_keys(fingerprint):
+            for candidate in self._buckets.get(key, ()):
+                if bin(candidate ^ fingerprint).count('1') <= self.max_distance:
+                    chat_ids |= self._chats[candidate]
+        return chat_ids
+
+    @staticmethod
+    def fingerprint(text: str) -> Optional[int]:
+        """Fingerprint of a post's text, or None if there's too little text to tell stories apart."""
+        tokens = normalize(text)
+        # E.g. photo-only posts
+        if len(tokens) < DEDUP_MIN_TOKENS:
+            return None
+        return simhash(tokens)
+
+    def duplicates_for(self, fingerprint: int, chat_ids: Iterable[int]) -> List[int]:
+        """Return the chats among chat_ids that recently got a near duplicate."""
+        self._evict(time.time())
+        seen = self.delivered_to(fingerprint)
+        duplicates = [chat_id for chat_id in chat_ids if chat_id in seen]
+        self.duplicates += len(duplicates)
+        return duplicates
+
+    def remember(self, fingerprint: int, chat_ids: Iterable[int], added: Optional[List[Tuple[int, frozenset]]] = None):
+        """Remember that a post went to the given chats.
+
+        What is remembered is also appended to `added`, so it can be forgotten if the
+        deliveries aren't stored after all.
+        """
+        now = time.time()
+        self._evict(now)
+        new = frozenset(chat_ids) - self._chats.get(fingerprint, set())
+        if not new:
+            return
+        if fingerprint in self._chats:
+            self._chats[fingerprint] |= new
+        else:
+            self._add(fingerprint, now, new)
+        if added is not None:
+            added.append((fingerprint, new))
+        self.dirty = True
+
+    def forget(self, entries: List[Tuple[int, frozenset]]):
+        """Drop what remember() added, e.g. for posts whose deliveries couldn't be stored."""
+        dropped = set()
+        for fingerprint, chat_ids in entries:
+            # Entries evicted meanwhile are simply not found
+            remembered = self._chats.get(fingerprint)
+            if remembered is None:
+                continue
+            remembered -= chat_ids
+            if not remembered:
+                self._drop(fingerprint)
+                dropped.add(fingerprint)
+            self.dirty = True
+        if dropped:
+            self._entries = deque(entry for entry in self._entries if entry[1] not in dropped)
+
+    def snapshot(self) -> Tuple[array, array, array, array]:
+        """Copy the index into compact arrays for saving."""
+        times = array('d', (added_at for added_at, _ in self._entries))
+        fingerprints = array('Q', (fingerprint for _, fingerprint in self._entries))
+        counts = array('Q', (len(self._chats[fingerprint]) for fingerprint in fingerprints))
+        chat_ids = array('q', (chat_id for fingerprint in fingerprints for chat_id in self._chats[fingerprint]))
+        self.dirty = False
+        return times, fingerprints, counts, chat_ids
+
+    def save(self, snapshot: Tuple[array, array, array, array] = None):
+        """Atomically write the index to disk; safe to call from a worker thread with a snapshot."""
+        times, fingerprints, counts, chat_ids = snapshot or self.snapshot()
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                array('Q', [FILE_MAGIC, len(times), len(chat_ids)]).tofile(f)
+                times.tofile(f)
+                fingerprints.tofile(f)
+                counts.tofile(f)
+                chat_ids.tofile(f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving dedup index: {e}")
+
+    def load(self):
+        """Load a saved index, skipping fingerprints that fell out of the window."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                header = array('Q')
+                header.fromfile(f, 1)
+                if header[0] != FILE_MAGIC:
+                    logger.info("Dedup index was saved without the chats posts went to, starting empty")
+                    return
+                header.fromfile(f, 2)
+                times = array('d')
+                times.fromfile(f, header[1])
+                fingerprints = array('Q')
+                fingerprints.fromfile(f, header[1])
+                counts = array('Q')
+                counts.fromfile(f, header[1])
+                chat_ids = array('q')
+                chat_ids.fromfile(f, header[2])
+        except (OSError, EOFError) as e:
+            logger.error(f"Error loading dedup index, starting empty: {e}")
+            return
+
+        now = time.time()
+        offset = 0
+        for added_at, fingerprint, count in zip(times, fingerprints, counts):
+            if now - added_at <= self.window:
+                self._add(fingerprint, added_at, chat_ids[offset:offset + count])
+            offset += count
+        self._evict(now)
+        logger.info(f"Loaded {len(self)} post fingerprints for deduplication")
@@ -0,0 +1,180 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiogram.utils.exceptions import RetryAfter, Unauthorized, ChatNotFound
+
+from config import (
+    DELIVERY_WORKERS,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_INTERVAL,
+    DELIVERY_MAX_ATTEMPTS,
+    logger
+)
+from ratelimit import TokenBucket
+from metrics import DELIVERY_SECONDS, SEND_SECONDS, SEND_ERRORS
+
+# How a delivery ended, as reported to `on_done`
+SENT = 'sent'
+CHAT_UNAVAILABLE = 'chat_unavailable'
+FAILED = 'failed'
+
+class Delivery:
+    """A message waiting to be sent to one chat, with its outbox ID if it has one."""
+    __slots__ = ('payload', 'outbox_id', 'enqueued_at', 'attempts')
+
+    def __init__(self, payload: Any, outbox_id: Optional[int] = None):
+        self.payload = payload
+        self.outbox_id = outbox_id
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+class DeliveryQueue:
+    """Fan messages out to chats with a worker pool, within Telegram's rate limits.
+
+    Every chat has its own FIFO, and a chat is handled by at most one worker at a
+    time, so messages to a chat keep their order. Chats become ready again after
+    TELEGRAM_CHAT_INTERVAL seconds, or after the delay Telegram asks for in
+    `RetryAfter`. All sends share a global token bucket of TELEGRAM_GLOBAL_RATE msg/s.
+    Messages from the outbox are reported to `on_done` with their outbox ID and how
+    their delivery ended.
+    """
+
+    def __init__(self, sender: Callable[[int, Any], Awaitable[Any]], workers: int = DELIVERY_WORKERS,
+                 global_rate: float = TELEGRAM_GLOBAL_RATE, chat_interval: float = TELEGRAM_CHAT_INTERVAL,
+                 on_done: Optional[Callable[[int, str], None]] = None):
+        self.sender = sender
+        self.on_done = on_done
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.bucket = TokenBucket(global_rate)
+        self._chats: Dict[int, Deque[Delivery]] = {}
+        self._ready: List[Tuple[float, int, int]] = []  # (ready_at, seq, chat_id) heap
+        self._scheduled = set()  # Chats that are in the heap or being sent to
+        self._next_allowed: Dict[int, float] = {}
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._idle = None
+        self._tasks = []
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the worker pool on the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Cancel the workers; undelivered messages are dropped."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def pending(self) -> int:
+        """Number of messages waiting to be sent."""
+        return sum(len(items) for items in self._chats.values())
+
+    def enqueue(self, chat_id: int, payload: Any, outbox_id: Optional[int] = None):
+        """Queue a message for a chat without waiting for it to be sent."""
+        self._chats.setdefault(chat_id, deque()).append(Delivery(payload, outbox_id))
+        if chat_id not in self._scheduled:
+            self._schedule(chat_id, self._next_allowed.get(chat_id, 0))
+        self._idle.clear()
+
+    async def join(self):
+        """Wait until every queued message has been sent or dropped."""
+        await self._idle.wait()
+
+    def _done(self, delivery: Delivery, outcome: str):
+        if delivery.outbox_id is None or self.on_done is None:
+            return
+        try:
+            self.on_done(delivery.outbox_id, outcome)
+        except Exception as e:
+            # The message stays in the outbox and is sent again later, which is the safe side
+            logger.error(f"Error recording delivery {delivery.outbox_id} as {outcome}: {e}")
+
+    def _schedule(self, chat_id: int, ready_at: float):
+        self._scheduled.add(chat_id)
+        heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    async def _next_chat(self) -> int:
+        """Wait for the chat with the earliest ready time to become ready."""
+        while True:
+            if self._ready:
+                ready_at = self._ready[0][0]
+                delay = ready_at - time.monotonic()
+                if delay <= 0:
+                    return heapq.heappop(self._ready)[2]
+            else:
+                delay = None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._next_chat()
+            items = self._chats[chat_id]
+            delivery = items[0]
+            ready_at = None
+
+            await self.bucket.acquire()
+            try:
+                with SEND_SECONDS.time():
+                    await self.sender(chat_id, delivery.payload)
+            except RetryAfter as e:
+                # Keep the message at the head of the chat queue and try again later
+                SEND_ERRORS.inc('retry_after')
+                logger.warning(f"Telegram asked to retry chat {chat_id} in {e.timeout}s")
+                ready_at = time.monotonic() + e.timeout
+            except (Unauthorized, ChatNotFound) as e:
+                # Bot was blocked/kicked or the chat is gone: nothing for this chat can be delivered
+                SEND_ERRORS.inc('chat_unavailable')
+                logger.error(f"Dropping {len(items)} messages for chat {chat_id}: {e}")
+                self.failed += len(items)
+                for item in items:
+                    self._done(item, CHAT_UNAVAILABLE)
+                items.clear()
+            except Exception as e:
+                SEND_ERRORS.inc(type(e).__name__)
+                delivery.attempts += 1
+                if delivery.attempts < DELIVERY_MAX_ATTEMPTS:
+                    logger.warning(f"Error sending message to chat {chat_id} "
+                                   f"(attempt {delivery.attempts}/{DELIVERY_MAX_ATTEMPTS}): {e}")
+                    ready_at = time.monotonic() + self.chat_interval * 2 ** delivery.attempts
+                else:
+                    logger.error(f"Error sending message to chat {chat_id}, giving up: {e}")
+                    self.failed += 1
+                    items.popleft()
+                    self._done(delivery, FAILED)
+            else:
+                self.sent += 1
+                DELIVERY_SECONDS.observe(time.monotonic() - delivery.enqueued_at)
+                items.popleft()
+                self._done(delivery, SENT)
+
+            now = time.monotonic()
+            self._next_allowed[chat_id] = now + self.chat_interval
+            if items:
+                self._schedule(chat_id, max(ready_at or 0, self._next_allowed[chat_id]))
+            else:
+                self._scheduled.discard(chat_id)
+                del self._chats[chat_id]
+                if not self._chats:
+                    self._idle.set()
+
+            # Forget rate-limit state of chats that have been quiet for a while
+            if len(self._next_allowed) > 10000:
+                self._next_allowed = {
+                    chat: allowed for chat, allowed in self._next_allowed.items() if allowed > now
+                }
@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import DIGEST_POST_LIMIT, OUTBOX_RETRY_INTERVAL, logger
+from metrics import DIGEST_POSTS, DIGEST_MESSAGES
+
+MESSAGE_LIMIT = 4096  # Telegram message length limit, in UTF-16 code units
+
+class DigestItem:
+    """A post waiting in a chat's digest."""
+    __slots__ = ('source_name', 'text', 'link')
+
+    def __init__(self, source_name: str, text: str, link: Optional[str]):
+        self.source_name = source_name
+        self.text = text
+        self.link = link
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'source_name': self.source_name, 'text': self.text, 'link': self.link}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DigestItem':
+        return cls(data['source_name'], data['text'], data.get('link'))
+
+def _length(text: str) -> int:
+    """Length as Telegram counts it: emoji and other astral characters take two units."""
+    return len(text.encode('utf-16-le')) // 2
+
+def shorten(text: str, limit: int) -> str:
+    """Cut text to at most limit units, at a word boundary when there is one nearby."""
+    if _length(text) <= limit:
+        return text
+    if limit <= 1:
+        return ''
+    cut = text[:limit - 1]
+    while _length(cut) > limit - 1:
+        # A character takes at most two units, so this never cuts more than needed
+        cut = cut[:len(cut) - (_length(cut) - (limit - 1) + 1) // 2]
+    space = cut.rfind(' ')
+    if space > len(cut) * 0.8:
+        cut = cut[:space]
+    return cut.rstrip() + '…'
+
+def _block(item: DigestItem, with_name: bool, post_limit: int, limit: int) -> str:
+    """A post in a digest: the source name unless the previous post has it, the text and the whole link."""
+    name = f"▪️ {item.source_name}" if with_name else ''
+    link = f"🔗 {item.link}" if item.link else ''
+    budget = min(post_limit, limit - _length(name) - _length(link) - 2)
+    return '\n'.join(part for part in (name, shorten(item.text.strip(), budget), link) if part)
+
+def render_digest(items: List[DigestItem], post_limit: int = DIGEST_POST_LIMIT,
+                  limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Pack posts, oldest first, into as few messages under the length limit as possible.
+
+    A post is never split between messages: its text is shortened to `post_limit`,
+    and links are always kept whole.
+    """
+    messages = []
+    current = f"📰 Дайджест, новых постов: {len(items)}"
+    current_source = None
+    for item in items:
+        block = _block(item, item.source_name != current_source, post_limit, limit)
+        if _length(current) + 2 + _length(block) > limit:
+            messages.append(current)
+            current = _block(item, True, post_limit, limit)
+        else:
+            current += '\n\n' + block
+        current_source = item.source_name
+    messages.append(current)
+    return messages
+
+class DigestBuffer:
+    """Digests of chats in digest mode, sent as a few long messages each.
+
+    The posts wait in the outbox, written in the same transaction as the cursors they
+    were fetched with (Outbox.queue with `digest_items`), so they survive a restart; this
+    keeps only how many posts each chat has and when its digest is due. A digest is due
+    `interval` seconds after its first post, or as soon as it holds `max_posts` posts.
+    One task sleeps until the earliest due digest, so the work is per digest rather than
+    per post. `queue` (Outbox.queue) stores the messages of a digest and marks its posts
+    sent in one transaction.
+    """
+
+    def __init__(self, storage, queue: Callable[..., Any]):
+        self.storage = storage
+        self.queue = queue
+        self._counts: Dict[int, int] = {}  # Chat ID -> posts waiting
+        self._due_at: Dict[int, float] = {}
+        self._heap: List[Tuple[float, int, int]] = []  # (due_at, seq, chat_id) heap
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        """Start sending due digests on the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop sending; the posts stay in the outbox until the next start."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def pending(self) -> int:
+        """Number of posts waiting for their digest."""
+        return sum(self._counts.values())
+
+    def _schedule(self, chat_id: int, due_at: float):
+        self._due_at[chat_id] = due_at
+        heapq.heappush(self._heap, (due_at, next(self._seq), chat_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def add(self, chat_id: int, due_at: float, max_posts: int, count: int = 1):
+        """Count posts stored for a chat's next digest; `due_at` (Unix time) is when the first of them is due."""
+        self._counts[chat_id] = self._counts.get(chat_id, 0) + count
+        if self._counts[chat_id] >= max_posts:
+            due_at = time.time()
+        if due_at < self._due_at.get(chat_id, float('inf')):
+            self._schedule(chat_id, due_at)
+
+    def restore(self):
+        """Schedule the digests of posts stored by the previous run."""
+        for chat_id, count, due_at in self.storage.get_digest_backlog():
+            settings = self.storage.get_digest(chat_id)
+            # A chat that left digest mode meanwhile gets its posts right away
+            self.add(chat_id, due_at if settings else time.time(), settings[1] if settings else 1, count)
+        if self._counts:
+            logger.info(f"Restored {self.pending()} posts waiting for the digests of {len(self._counts)} chats")
+
+    def sync(self):
+        """Send right away the digests of chats that another process took out of digest mode."""
+        for chat_id in list(self._counts):
+            if self.storage.get_digest(chat_id) is None:
+                self._schedule(chat_id, time.time())
+
+    def flush(self, chat_id: int):
+        """Queue a chat's digest right away, if it has posts waiting."""
+        rows = self.storage.get_digest_items(chat_id)
+        if not rows:
+            self._counts.pop(chat_id, None)
+            self._due_at.pop(chat_id, None)
+            return
+        items = [DigestItem.from_dict(json.loads(row['payload'])) for row in rows]
+        messages = render_digest(items)
+        self.queue([(chat_id, None, message) for message in messages], acks=[row['id'] for row in rows])
+        self._counts.pop(chat_id, None)
+        self._due_at.pop(chat_id, None)
+        DIGEST_POSTS.inc(amount=len(items))
+        DIGEST_MESSAGES.inc(amount=len(messages))
+        logger.info(f"Sending digest of {len(items)} posts in {len(messages)} messages to chat {chat_id}")
+
+    async def _run(self):
+        while True:
+            while self._heap:
+                due_at, _, chat_id = self._heap[0]
+                # Skip entries of digests sent or rescheduled since
+                if self._due_at.get(chat_id) != due_at:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = due_at - time.time()
+                if delay > 0:
+                    break
+                heapq.heappop(self._heap)
+                try:
+                    self.flush(chat_id)
+                except Exception as e:
+                    logger.error(f"Error sending digest to chat {chat_id}, retrying in {OUTBOX_RETRY_INTERVAL:g}s: {e}")
+                    self._schedule(chat_id, time.time() + OUTBOX_RETRY_INTERVAL)
+            else:
+                delay = None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,552 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from email.utils import formatdate
+from html import escape
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger('fakeapi')
+
+# Group the bot checks its VK token with
+VERIFY_GROUP = 'apiclub'
+
+# Served for photo attachments; the fake Bot API never decodes uploads
+PHOTO_BYTES = b'\xff\xd8\xff\xd9'
+
+WORDS = ('новости', 'город', 'власти', 'решение', 'проект', 'жители', 'погода', 'дорога', 'школа', 'матч',
+         'выборы', 'бюджет', 'ремонт', 'концерт', 'выставка', 'цены', 'рынок', 'банк', 'курс', 'заявление',
+         'суд', 'полиция', 'больница', 'врачи', 'студенты', 'транспорт', 'метро', 'авария', 'пожар', 'снег',
+         'data', 'release', 'update', 'market', 'report', 'science', 'space', 'launch', 'game', 'team')
+
+@dataclass
+class Faults:
+    """Latency and failures injected into the responses of one API."""
+    latency: float = 0.0  # Seconds added to every response
+    jitter: float = 0.0  # Up to this many extra random seconds
+    error_rate: float = 0.0  # Share of requests answered with a server error
+    rate_limit_rate: float = 0.0  # Share of requests answered with the API's rate limit error
+
+    async def delay(self):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def pick(self) -> Optional[str]:
+        """'rate_limit', 'error' or None for a normal response."""
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            return 'rate_limit'
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 'error'
+        return None
+
+class Feed:
+    """Posts of one source that appear over time, oldest first.
+
+    `backlog` posts are there from the start, then a new one appears every 1/`rate`
+    seconds. A synthetic feed makes its posts up; a recorded one releases the items of a
+    fixture in their original order and stops growing once they run out.
+    """
+
+    def __init__(self, name: str, number: int, rate: float, backlog: int, text_size: int = 300,
+                 photos: int = 0, title: Optional[str] = None, items: Optional[List[Dict[str, Any]]] = None):
+        self.name = name
+        self.number = number  # Numeric ID of the source on its platform
+        self.title = title or name
+        self.rate = rate
+        self.backlog = backlog
+        self.text_size = text_size
+        self.photos = photos
+        self.items = sorted(items, key=lambda item: int(item['id'])) if items is not None else None
+        self.started_at = time.time()
+        self.fetched_at = None  # When the bot first asked for the posts since the last FakeAPI.reset
+        self.served_at: Dict[int, float] = {}  # Post ID -> when the bot first got the post
+
+    def count(self) -> int:
+        count = self.backlog + int((time.time() - self.started_at) * self.rate)
+        return count if self.items is None else min(count, len(self.items))
+
+    def post(self, index: int) -> Dict[str, Any]:
+        """The index-th post: a recorded raw item, or a synthetic {id, date, text, photos}."""
+        if self.items is not None:
+            return self.items[index]
+        rng = random.Random(f"{self.name}:{index}")
+        words = [f"{self.title}: новость {index + 1}."]
+        length = len(words[0])
+        while length < self.text_size:
+            word = rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return {
+            'id': index + 1,
+            'date': int(self.started_at + (index - self.backlog) / self.rate) if self.rate else int(self.started_at),
+            'text': ' '.join(words),
+            'photos': self.photos if self.photos and index % 3 == 0 else 0
+        }
+
+    def latest(self, offset: int = 0, count: int = 20, since_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Posts newest first, skipping `offset` of them and stopping at since_id."""
+        now = time.time()
+        if self.fetched_at is None:
+            self.fetched_at = now
+        posts = []
+        for index in range(self.count() - 1 - offset, -1, -1):
+            if len(posts) >= count:
+                break
+            post = self.post(index)
+            if since_id is not None and int(post['id']) <= since_id:
+                break
+            posts.append(post)
+            self.served_at.setdefault(int(post['id']), now)
+        return posts
+
+class FakeAPI:
+    """Local stand-in for the VK, Twitter v2, RSS and Telegram Bot API endpoints the bot uses.
+
+    Sources are synthetic (group<n>, user<n>, feed<n>) or replayed from a fixture file
+    written by `record`. Every API gets its own `Faults`, so latency, rate limit responses
+    and errors can be injected per platform. Counters of requests, injected faults and
+    sent messages are kept for the benchmark.
+    """
+
+    def __init__(self, vk: int = 0, twitter: int = 0, rss: int = 0, rate: float = 0.05, backlog: int = 20,
+                 text_size: int = 300, photos: int = 0, fixtures: Optional[str] = None,
+                 faults: Optional[Dict[str, Faults]] = None, retry_after: int = 1, reset_after: float = 15):
+        self.faults = {api: Faults() for api in ('vk', 'twitter', 'rss', 'telegram')}
+        self.faults.update(faults or {})
+        self.retry_after = retry_after  # Seconds Telegram asks to wait in its rate limit errors
+        self.reset_after = reset_after  # Seconds until a rate limited Twitter quota resets
+        self.vk: Dict[str, Feed] = {}
+        self.twitter: Dict[str, Feed] = {}
+        self.rss: Dict[str, Feed] = {}
+        self._numbers: Dict[Tuple[str, int], Feed] = {}  # (platform, numeric ID) -> feed
+        for n in range(1, vk + 1):
+            self._add('vk', Feed(f"group{n}", n, rate, backlog, text_size, photos, f"Группа {n}"))
+        for n in range(1, twitter + 1):
+            self._add('twitter', Feed(f"user{n}", n, rate, backlog, text_size, 0, f"User {n}"))
+        for n in range(1, rss + 1):
+            self._add('rss', Feed(f"feed{n}", n, rate, backlog, text_size, 0, f"Лента {n}"))
+        if fixtures:
+            self.load_fixtures(fixtures, rate, backlog)
+        self.updates: List[Dict[str, Any]] = []  # Updates getUpdates hands out, e.g. commands of simulated users
+        self.base_url = None
+        self._runner = None
+        self.reset()
+
+    def _add(self, platform: str, feed: Feed):
+        getattr(self, platform)[feed.name.lower()] = feed
+        self._numbers[(platform, feed.number)] = feed
+
+    def load_fixtures(self, path: str, rate: float, backlog: int):
+        """Replay sources recorded by `record`."""
+        with open(path, encoding='utf-8') as f:
+            fixtures = json.load(f)
+        for name, group in fixtures.get('vk', {}).items():
+            self._add('vk', Feed(name, int(group['id']), rate, backlog, title=group.get('name'), items=group['items']))
+        for name, user in fixtures.get('twitter', {}).items():
+            self._add('twitter', Feed(name, int(user['id']), rate, backlog, title=user.get('name'), items=user['tweets']))
+        logger.info(f"Loaded {len(fixtures.get('vk', {}))} VK groups and {len(fixtures.get('twitter', {}))} "
+                    f"Twitter users from {path}")
+
+    def reset(self):
+        """Clear the counters, e.g. between benchmark runs."""
+        self.requests = Counter()  # '<api>:<endpoint>' -> requests
+        self.injected = Counter()  # '<api>:<fault>' -> injected faults
+        self.messages = 0
+        self.sent = Counter()  # (chat_id, text or caption) -> times sent, to find lost and repeated messages
+        self.first_update_at = None  # When the bot first asked for updates or set its webhook, i.e. finished starting
+        self._message_id = 0
+        for feed in self._numbers.values():
+            feed.fetched_at = None
+            feed.served_at = {}
+
+    async def _fault(self, api: str, endpoint: str) -> Optional[str]:
+        self.requests[f"{api}:{endpoint}"] += 1
+        faults = self.faults[api]
+        await faults.delay()
+        fault = faults.pick()
+        if fault is not None:
+            self.injected[f"{api}:{fault}"] += 1
+        return fault
+
+    @staticmethod
+    async def _params(request: web.Request) -> Dict[str, Any]:
+        params = dict(request.query)
+        if request.method == 'POST':
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        return params
+
+    # VK
+
+    def _vk_group(self, feed: Feed) -> Dict[str, Any]:
+        return {'id': feed.number, 'name': feed.title, 'screen_name': feed.name, 'is_closed': 0, 'type': 'page'}
+
+    def _vk_find(self, params: Dict[str, Any]) -> Optional[Feed]:
+        if 'owner_id' in params:
+            return self._numbers.get(('vk', -int(params['owner_id'])))
+        return self.vk.get(str(params.get('domain', '')).lower())
+
+    def _vk_item(self, feed: Feed, post: Dict[str, Any]) -> Dict[str, Any]:
+        if feed.items is not None:
+            return post
+        item = {'id': post['id'], 'owner_id': -feed.number, 'from_id': -feed.number, 'date': post['date'],
+                'text': post['text'], 'marked_as_ads': 0}
+        if post['photos']:
+            item['attachments'] = [{'type': 'photo', 'photo': {'id': post['id'] * 10 + i, 'owner_id': -feed.number, 'sizes': [
+                {'type': 'x', 'width': 604, 'height': 403,
+                 'url': f"{self.base_url}/photo/{feed.name}/{post['id']}/{i}.jpg"}
+            ]}} for i in range(post['photos'])]
+        return item
+
+    def _wall_get(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        feed = self._vk_find(params)
+        if feed is None:
+            return None
+        posts = feed.latest(int(params.get('offset', 0)), int(params.get('count', 20)))
+        return {'count': feed.count(), 'items': [self._vk_item(feed, post) for post in posts]}
+
+    @staticmethod
+    def _vk_error(code: int, message: str) -> web.Response:
+        return web.json_response({'error': {'error_code': code, 'error_msg': message, 'request_params': []}})
+
+    async def handle_vk(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        fault = await self._fault('vk', method)
+        if fault == 'rate_limit':
+            return self._vk_error(6, 'Too many requests per second')
+        if fault == 'error':
+            return self._vk_error(10, 'Internal server error')
+        params = await self._params(request)
+
+        if method == 'groups.getById':
+            names = str(params.get('group_ids') or params.get('group_id', '')).lower().split(',')
+            groups = [self._vk_group(feed) for feed in self.vk.values()
+                      if feed.name.lower() in names or str(feed.number) in names]
+            if VERIFY_GROUP in names:
+                groups.append({'id': 1, 'name': 'VK API', 'screen_name': VERIFY_GROUP, 'is_closed': 0, 'type': 'page'})
+            if not groups:
+                return self._vk_error(100, 'One of the parameters specified was missing or invalid')
+            return web.json_response({'response': groups})
+        if method == 'wall.get':
+            wall = self._wall_get(params)
+            if wall is None:
+                return self._vk_error(100, 'One of the parameters specified was missing or invalid')
+            return web.json_response({'response': wall})
+        if method == 'execute':
+            # The bot only batches wall.get calls: return [API.wall.get({...}), ...];
+            calls = [json.loads(call) for call in re.findall(r'API\.wall\.get\((\{[^{}]*\})\)', params.get('code', ''))]
+            walls = [self._wall_get(call) for call in calls]
+            response = {'response': [wall if wall is not None else False for wall in walls]}
+            errors = [{'method': 'wall.get', 'error_code': 100, 'error_msg': 'Invalid owner'}
+                      for wall in walls if wall is None]
+            if errors:
+                response['execute_errors'] = errors
+            return web.json_response(response)
+        return self._vk_error(3, 'Unknown method passed')
+
+    # Twitter
+
+    @staticmethod
+    def _twitter_error(status: int, title: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+        return web.json_response({'title': title, 'detail': title, 'type': 'about:blank', 'status': status},
+                                 status=status, headers=headers)
+
+    def _tweet(self, feed: Feed, post: Dict[str, Any]) -> Dict[str, Any]:
+        if feed.items is not None:
+            return post
+        created_at = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(post['date']))
+        return {'id': str(post['id']), 'text': post['text'], 'created_at': created_at,
+                'edit_history_tweet_ids': [str(post['id'])]}
+
+    async def handle_twitter(self, request: web.Request) -> web.Response:
+        path = request.match_info['path']
+        if path == 'users/me':
+            endpoint = 'me'
+        elif path.startswith('users/by/username/'):
+            endpoint = 'user_lookup'
+        elif path.startswith('users/') and path.endswith('/tweets'):
+            endpoint = 'users_tweets'
+        else:
+            endpoint = 'other'
+        fault = await self._fault('twitter', endpoint)
+        if fault == 'rate_limit':
+            reset_at = int(time.time() + self.reset_after)
+            return self._twitter_error(429, 'Too Many Requests', {
+                'x-rate-limit-limit': '1500', 'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(reset_at)
+            })
+        if fault == 'error':
+            return self._twitter_error(503, 'Service Unavailable')
+
+        if endpoint == 'me':
+            return web.json_response({'data': {'id': '1', 'name': 'Fake API', 'username': 'fakeapi'}})
+        if endpoint == 'user_lookup':
+            feed = self.twitter.get(path.rsplit('/', 1)[1].lower())
+            if feed is None:
+                return web.json_response({'errors': [{'title': 'Not Found Error', 'detail': 'Could not find user'}]})
+            return web.json_response({'data': {'id': str(feed.number), 'name': feed.title, 'username': feed.name}})
+        if endpoint == 'users_tweets':
+            feed = self._numbers.get(('twitter', int(path.split('/')[1])))
+            if feed is None:
+                return self._twitter_error(404, 'Not Found Error')
+            offset = int(request.query.get('pagination_token', 0))
+            count = max(5, min(100, int(request.query.get('max_results', 10))))
+            since_id = int(request.query['since_id']) if 'since_id' in request.query else None
+            posts = feed.latest(offset, count + 1, since_id)
+            tweets = [self._tweet(feed, post) for post in posts[:count]]
+            meta = {'result_count': len(tweets)}
+            if tweets:
+                meta.update(newest_id=tweets[0]['id'], oldest_id=tweets[-1]['id'])
+            if len(posts) > count:
+                meta['next_token'] = str(offset + count)
+            response = {'meta': meta}
+            if tweets:
+                response['data'] = tweets
+            return web.json_response(response)
+        return self._twitter_error(404, 'Not Found Error')
+
+    # RSS
+
+    async def handle_rss(self, request: web.Request) -> web.Response:
+        feed = self.rss.get(request.match_info['name'].lower())
+        fault = await self._fault('rss', 'feed')
+        if fault == 'rate_limit':
+            return web.Response(status=429, headers={'Retry-After': str(self.retry_after)})
+        if fault == 'error':
+            return web.Response(status=503)
+        if feed is None:
+            return web.Response(status=404)
+        etag = f'"{feed.count()}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304)
+        items = ''.join(
+            f"<item><title>{escape(post['text'][:80])}</title><guid>{feed.name}-{post['id']}</guid>"
+            f"<link>{self.base_url}/post/{feed.name}/{post['id']}</link>"
+            f"<pubDate>{formatdate(post['date'])}</pubDate><description>{escape(post['text'])}</description></item>"
+            for post in feed.latest(count=20)
+        )
+        body = f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>{escape(feed.title)}</title>{items}</channel></rss>'
+        return web.Response(text=body, content_type='application/rss+xml', headers={'ETag': etag})
+
+    async def handle_photo(self, request: web.Request) -> web.Response:
+        self.requests['photo:get'] += 1
+        return web.Response(body=PHOTO_BYTES, content_type='image/jpeg')
+
+    # Telegram
+
+    @staticmethod
+    def _telegram_error(code: int, description: str, parameters: Optional[Dict[str, Any]] = None) -> web.Response:
+        data = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            data['parameters'] = parameters
+        return web.json_response(data, status=code)
+
+    def _message(self, chat_id: Any, **fields) -> Dict[str, Any]:
+        self._message_id += 1
+        message = {'message_id': self._message_id, 'date': int(time.time()),
+                   'chat': {'id': int(chat_id), 'type': 'private'}}
+        message.update(fields)
+        return message
+
+    def _photo(self) -> List[Dict[str, Any]]:
+        file_id = f"photo{self._message_id}"
+        return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 604, 'height': 403}]
+
+    async def handle_telegram(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        params = await self._params(request)
+        if method == 'getupdates':
+            self.requests['telegram:getUpdates'] += 1
+            if self.first_update_at is None:
+                self.first_update_at = time.time()
+            offset = int(params.get('offset') or 0)
+            pending = [update for update in self.updates if update['update_id'] >= offset]
+            if pending:
+                return web.json_response({'ok': True, 'result': pending})
+            # Long polling with nothing to deliver; kept short so shutting down doesn't wait
+            await asyncio.sleep(min(float(params.get('timeout') or 0), 1))
+            return web.json_response({'ok': True, 'result': []})
+        if method == 'getme':
+            self.requests['telegram:getMe'] += 1
+            return web.json_response({'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'Fake API', 'username': 'fakeapi_bot'
+            }})
+        if method not in ('sendmessage', 'sendphoto', 'sendmediagroup'):
+            self.requests[f"telegram:{request.match_info['method']}"] += 1
+            if method == 'setwebhook' and self.first_update_at is None:
+                self.first_update_at = time.time()
+            return web.json_response({'ok': True, 'result': True})
+
+        fault = await self._fault('telegram', request.match_info['method'])
+        if fault == 'rate_limit':
+            return self._telegram_error(429, f"Too Many Requests: retry after {self.retry_after}",
+                                        {'retry_after': self.retry_after})
+        if fault == 'error':
+            return self._telegram_error(500, 'Internal Server Error')
+        chat_id = params.get('chat_id', 0)
+        self.messages += 1
+        self.sent[(int(chat_id), params.get('text') or params.get('caption') or '')] += 1
+        if method == 'sendmessage':
+            result = self._message(chat_id, text=params.get('text', ''))
+        elif method == 'sendphoto':
+            result = self._message(chat_id, photo=self._photo(), caption=params.get('caption'))
+        else:
+            media = json.loads(params.get('media', '[]'))
+            result = [self._message(chat_id, photo=self._photo(), media_group_id='1') for _ in media]
+        return web.json_response({'ok': True, 'result': result})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('*', '/method/{method}', self.handle_vk)
+        app.router.add_get('/2/{path:.*}', self.handle_twitter)
+        app.router.add_get('/rss/{name}', self.handle_rss)
+        app.router.add_get('/photo/{path:.*}', self.handle_photo)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_telegram)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8081) -> str:
+        """Start serving; returns the base URL, with the actual port if `port` is 0."""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def env(self) -> Dict[str, str]:
+        """Environment pointing the bot at this server."""
+        return {'VK_API_URL': self.base_url, 'TWITTER_API_URL': self.base_url, 'TELEGRAM_API_URL': self.base_url}
+
+    def resolved_ids(self) -> Dict[str, Dict[str, int]]:
+        """Numeric platform IDs of the VK groups and Twitter users, as the bot resolves them."""
+        return {
+            'vk': {feed.name: feed.number for feed in self.vk.values()},
+            'twitter': {feed.name: feed.number for feed in self.twitter.values()}
+        }
+
+    def source_ids(self) -> Dict[str, List[str]]:
+        """Source IDs to add to the bot, per source type."""
+        return {
+            'vk': [feed.name for feed in self.vk.values()],
+            'twitter': [feed.name for feed in self.twitter.values()],
+            'rss': [f"{self.base_url}/rss/{feed.name}" for feed in self.rss.values()]
+        }
+
+def record(vk_groups: List[str], twitter_users: List[str], path: str, count: int = 100):
+    """Save the latest posts of real VK groups and Twitter users as fixtures for replay.
+
+    Uses VK_ACCESS_TOKEN and TWITTER_BEARER_TOKEN from the environment.
+    """
+    import requests
+    fixtures = {'vk': {}, 'twitter': {}}
+    session = requests.Session()
+    for name in vk_groups:
+        params = {'access_token': os.environ['VK_ACCESS_TOKEN'], 'v': '5.131'}
+        group = session.post('https://api.vk.com/method/groups.getById', {**params, 'group_id': name}).json()
+        wall = session.post('https://api.vk.com/method/wall.get',
+                            {**params, 'domain': name, 'count': min(count, 100), 'filter': 'owner'}).json()
+        if 'error' in group or 'error' in wall:
+            logger.error(f"Skipping VK group {name}: {(group.get('error') or wall.get('error'))['error_msg']}")
+            continue
+        info = group['response'][0] if isinstance(group['response'], list) else group['response']['groups'][0]
+        fixtures['vk'][name] = {'id': info['id'], 'name': info['name'], 'items': wall['response']['items']}
+        logger.info(f"Recorded {len(wall['response']['items'])} posts of VK group {name}")
+
+    headers = {'Authorization': f"Bearer {os.environ.get('TWITTER_BEARER_TOKEN', '')}"}
+    for username in twitter_users:
+        user = session.get(f"https://api.twitter.com/2/users/by/username/{username}", headers=headers).json()
+        if 'data' not in user:
+            logger.error(f"Skipping Twitter user {username}: {user}")
+            continue
+        tweets = session.get(f"https://api.twitter.com/2/users/{user['data']['id']}/tweets", headers=headers, params={
+            'max_results': max(5, min(count, 100)), 'tweet.fields': 'created_at', 'exclude': 'retweets,replies'
+        }).json()
+        fixtures['twitter'][username] = {'id': user['data']['id'], 'name': user['data']['name'],
+                                         'tweets': tweets.get('data', [])}
+        logger.info(f"Recorded {len(tweets.get('data', []))} tweets of {username}")
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(fixtures, f, ensure_ascii=False, indent=1)
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Options of the fake sources and faults, shared with bench.py."""
+    parser.add_argument('--vk', type=int, default=0, help='synthetic VK groups')
+    parser.add_argument('--twitter', type=int, default=0, help='synthetic Twitter users')
+    parser.add_argument('--rss', type=int, default=0, help='synthetic RSS feeds')
+    parser.add_argument('--rate', type=float, default=0.05, help='new posts per second per source')
+    parser.add_argument('--backlog', type=int, default=20, help='posts each source has at the start')
+    parser.add_argument('--text-size', type=int, default=300, help='characters in a synthetic post')
+    parser.add_argument('--photos', type=int, default=0, help='photos in every third VK post')
+    parser.add_argument('--fixtures', help='JSON file written by "fakeapi.py record" to replay')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to source API responses')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra seconds of source API latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of source API requests that fail')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                        help='share of source API requests answered with a rate limit error')
+    parser.add_argument('--telegram-latency', type=float, default=0.0)
+    parser.add_argument('--telegram-error-rate', type=float, default=0.0)
+    parser.add_argument('--telegram-rate-limit-rate', type=float, default=0.0)
+
+def from_arguments(args: argparse.Namespace) -> FakeAPI:
+    sources = Faults(args.latency, args.jitter, args.error_rate, args.rate_limit_rate)
+    telegram = Faults(args.telegram_latency, 0.0, args.telegram_error_rate, args.telegram_rate_limit_rate)
+    return FakeAPI(args.vk, args.twitter, args.rss, args.rate, args.backlog, args.text_size, args.photos,
+                   args.fixtures, {'vk': sources, 'twitter': sources, 'rss': sources, 'telegram': telegram})
+
+async def serve(args: argparse.Namespace):
+    fake = from_arguments(args)
+    base_url = await fake.start(args.host, args.port)
+    logger.info(f"Serving fake APIs on {base_url}; run the bot with "
+                + ' '.join(f"{name}={value}" for name, value in fake.env().items()))
+    for source_type, ids in fake.source_ids().items():
+        if ids:
+            logger.info(f"{source_type} sources: {', '.join(ids[:5])}{' ...' if len(ids) > 5 else ''}")
+    try:
+        while True:
+            await asyncio.sleep(60)
+            logger.info(f"Requests: {dict(fake.requests)}, injected faults: {dict(fake.injected)}, "
+                        f"messages: {fake.messages}")
+    finally:
+        await fake.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the VK, Twitter, RSS and Telegram Bot APIs')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='serve synthetic or recorded sources')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8081)
+    add_arguments(serve_parser)
+    record_parser = commands.add_parser('record', help='record real sources into a fixture file')
+    record_parser.add_argument('--vk-groups', default='', help='comma-separated VK short names')
+    record_parser.add_argument('--twitter-users', default='', help='comma-separated Twitter usernames')
+    record_parser.add_argument('--count', type=int, default=100, help='posts per source')
+    record_parser.add_argument('--out', default='fixtures.json')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'record':
+        record([name for name in args.vk_groups.split(',') if name],
+               [name for name in args.twitter_users.split(',') if name], args.out, args.count)
+    else:
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
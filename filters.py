@@ -0,0 +1,217 @@
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import FILTER_MAX_PATTERN_LENGTH, logger
+
+INCLUDE = 'include'
+EXCLUDE = 'exclude'
+KEYWORD = 'keyword'
+REGEX = 'regex'
+
+class FilterRuleError(ValueError):
+    """Raised for a filter rule that can't be used, with a message for the user."""
+
+class AhoCorasick:
+    """Automaton finding every occurrence of many keywords in one pass over the text.
+
+    Matches count only as whole words, so 'war' doesn't match inside 'software'.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]  # Keyword indexes ending at each state, including via fail links
+        for keyword in keywords:
+            self._add(keyword)
+        self._link()
+
+    def _add(self, keyword: str):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append(len(self.keywords))
+        self.keywords.append(keyword)
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def search(self, text: str) -> Set[int]:
+        """Indexes of the keywords found in text, which must already be lowercased."""
+        found = set()
+        goto, fail, out, keywords = self._goto, self._fail, self._out, self.keywords
+        state = 0
+        length = len(text)
+        for end, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not out[state]:
+                continue
+            after_ok = end + 1 == length or not text[end + 1].isalnum()
+            if not after_ok:
+                continue
+            for index in out[state]:
+                start = end + 1 - len(keywords[index])
+                if start == 0 or not text[start - 1].isalnum():
+                    found.add(index)
+        return found
+
+class ChatFilter:
+    """Compiled rules of one chat: its keywords and one combined regex per action."""
+    __slots__ = ('rules', 'keywords', 'has_include', 'include_regex', 'exclude_regex')
+
+    def __init__(self, rules: List[Tuple[str, str, str]]):
+        self.rules = rules
+        self.keywords: Dict[str, str] = {}  # Lowercased keyword -> action
+        regexes = {INCLUDE: [], EXCLUDE: []}
+        for action, kind, pattern in rules:
+            if kind == KEYWORD:
+                # An exclude wins over an include of the same keyword
+                if self.keywords.get(pattern.lower()) != EXCLUDE:
+                    self.keywords[pattern.lower()] = action
+            else:
+                regexes[action].append(f"(?:{pattern})")
+        self.has_include = any(action == INCLUDE for action, _, _ in rules)
+        self.include_regex = self._compile(regexes[INCLUDE])
+        self.exclude_regex = self._compile(regexes[EXCLUDE])
+
+    @staticmethod
+    def _compile(patterns: List[str]) -> Optional[re.Pattern]:
+        if not patterns:
+            return None
+        try:
+            return re.compile('|'.join(patterns), re.IGNORECASE)
+        except re.error as e:
+            # Rules are checked when added, so only a rule saved by an older version gets here
+            logger.error(f"Ignoring invalid filter regex: {e}")
+            return None
+
+def check_rule(kind: str, pattern: str) -> str:
+    """Validate and normalize a rule pattern before it is saved."""
+    pattern = pattern.strip()
+    if not pattern:
+        raise FilterRuleError("Пустое правило.")
+    if len(pattern) > FILTER_MAX_PATTERN_LENGTH:
+        raise FilterRuleError(f"Правило длиннее {FILTER_MAX_PATTERN_LENGTH} символов.")
+    if kind == REGEX:
+        try:
+            re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            raise FilterRuleError(f"Некорректное регулярное выражение: {e}")
+    return pattern
+
+class FilterEngine:
+    """Decides which subscribed chats get a post, according to each chat's filter rules.
+
+    A post reaches a chat unless it matches one of the chat's exclude rules, or the chat
+    has include rules and the post matches none of them. Keywords of all chats share one
+    Aho-Corasick automaton, so a post is scanned once however many chats and rules there
+    are; regexes are combined into one pattern per chat and action. Changing a chat's
+    rules recompiles that chat only; the automaton is rebuilt on the next post when a
+    keyword it doesn't know yet was added. Keywords nobody uses anymore stay in it until
+    then, so removing a rule or adding back one it still has doesn't cause a rebuild.
+    """
+
+    def __init__(self):
+        self._chats: Dict[int, ChatFilter] = {}
+        self._owners: Dict[str, Dict[int, str]] = {}  # Keyword -> chat ID -> action
+        self._automaton = AhoCorasick(())
+        self._known: Set[str] = set()  # Keywords of the current automaton
+        self._stale = False
+        self.rebuilds = 0
+        self.filtered = 0
+
+    def set_rules(self, chat_id: int, rules: List[Tuple[str, str, str]]):
+        """Replace the rules of a chat; a chat without rules gets every post."""
+        old = self._chats.get(chat_id)
+        if old is not None:
+            if old.rules == rules:
+                return
+            for keyword in old.keywords:
+                owners = self._owners.get(keyword)
+                owners.pop(chat_id, None)
+                if not owners:
+                    del self._owners[keyword]
+        if not rules:
+            self._chats.pop(chat_id, None)
+            return
+
+        chat_filter = self._chats[chat_id] = ChatFilter(list(rules))
+        for keyword, action in chat_filter.keywords.items():
+            if keyword not in self._known:
+                self._stale = True
+            self._owners.setdefault(keyword, {})[chat_id] = action
+
+    def sync(self, rules_by_chat: Dict[int, List[Tuple[str, str, str]]]):
+        """Bring every chat's rules in line with storage, recompiling only the chats that changed."""
+        for chat_id in list(self._chats):
+            if chat_id not in rules_by_chat:
+                self.set_rules(chat_id, [])
+        for chat_id, rules in rules_by_chat.items():
+            self.set_rules(chat_id, rules)
+
+    def _keyword_hits(self, text: str) -> Tuple[Set[int], Set[int]]:
+        """Chats with an include keyword and chats with an exclude keyword in the text."""
+        if self._stale:
+            self._automaton = AhoCorasick(self._owners)
+            self._known = set(self._automaton.keywords)
+            self._stale = False
+            self.rebuilds += 1
+        included, excluded = set(), set()
+        keywords = self._automaton.keywords
+        for index in self._automaton.search(text.lower()):
+            # Keywords nobody uses anymore stay in the automaton until the next rebuild
+            for chat_id, action in self._owners.get(keywords[index], {}).items():
+                (included if action == INCLUDE else excluded).add(chat_id)
+        return included, excluded
+
+    def allowed_chats(self, text: str, chat_ids: Iterable[int]) -> List[int]:
+        """The chats among chat_ids that should get a post with this text."""
+        chat_ids = list(chat_ids)
+        if not self._chats:
+            return chat_ids
+        included = excluded = None
+        regex_hits: Dict[str, bool] = {}  # Chats with the same regex rules share one search
+
+        def matches(regex: Optional[re.Pattern]) -> bool:
+            if regex is None:
+                return False
+            hit = regex_hits.get(regex.pattern)
+            if hit is None:
+                hit = regex_hits[regex.pattern] = regex.search(text) is not None
+            return hit
+
+        allowed = []
+        for chat_id in chat_ids:
+            chat_filter = self._chats.get(chat_id)
+            if chat_filter is None:
+                allowed.append(chat_id)
+                continue
+            if included is None and chat_filter.keywords:
+                included, excluded = self._keyword_hits(text)
+            if chat_filter.keywords and chat_id in excluded or matches(chat_filter.exclude_regex):
+                continue
+            if chat_filter.has_include and not (
+                    chat_filter.keywords and chat_id in included or matches(chat_filter.include_regex)):
+                continue
+            allowed.append(chat_id)
+        self.filtered += len(chat_ids) - len(allowed)
+        return allowed
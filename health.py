@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from config import HEALTH_CHECK_INTERVAL, logger
+
+STARTING = 'starting'
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+
+class PlatformState:
+    """Health of one platform: whether its client could be created and its credentials work."""
+    __slots__ = ('status', 'account', 'error', 'checked_at', 'retry_at')
+
+    def __init__(self):
+        self.status = STARTING
+        self.account = None  # What the credentials resolved to, e.g. the Twitter username
+        self.error = None
+        self.checked_at = None
+        self.retry_at = 0.0  # Unix time before which a degraded platform isn't polled
+
+class PlatformHealth:
+    """Per-platform health, so one platform being down doesn't stop the others."""
+
+    def __init__(self, check_interval: float = HEALTH_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._states: Dict[str, PlatformState] = {}
+
+    def state(self, platform: str) -> PlatformState:
+        return self._states.setdefault(platform, PlatformState())
+
+    def mark_healthy(self, platform: str, account: Any = None):
+        state = self.state(platform)
+        if state.status != HEALTHY:
+            logger.info(f"Platform {platform} is healthy ({account})")
+        state.status = HEALTHY
+        state.account = account
+        state.error = None
+        state.checked_at = time.time()
+        state.retry_at = 0.0
+
+    def mark_degraded(self, platform: str, error: str, retry_at: Optional[float] = None):
+        state = self.state(platform)
+        state.status = DEGRADED
+        state.error = error
+        state.checked_at = time.time()
+        state.retry_at = retry_at or state.checked_at + self.check_interval
+        logger.error(f"Platform {platform} is degraded until {time.ctime(state.retry_at)}: {error}")
+
+    def is_healthy(self, platform: str) -> bool:
+        return self.state(platform).status == HEALTHY
+
+    def is_checking(self, platform: str) -> bool:
+        """Whether the first check of a platform is still under way."""
+        return self.state(platform).status == STARTING
+
+    def unavailable_until(self, platform: str) -> float:
+        """Unix time until which a degraded platform shouldn't be polled, or 0."""
+        state = self.state(platform)
+        if state.status == DEGRADED and state.retry_at > time.time():
+            return state.retry_at
+        return 0.0
+
+    def needs_check(self, platform: str) -> bool:
+        state = self.state(platform)
+        return state.status == STARTING or (state.status == DEGRADED and state.retry_at <= time.time())
+
+    def snapshot(self) -> Dict[str, PlatformState]:
+        return dict(self._states)
+
+class LazyParser:
+    """Stand-in for a parser that is created, with its API library imported, on first use.
+
+    Attribute access returns a function that resolves the parser when called, so calls
+    made through Poller.run create it in a worker thread rather than on the event loop.
+    """
+
+    def __init__(self, platform: str, factory: Callable[[], Any]):
+        self.platform = platform
+        self._factory = factory
+        self._parser = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        """The parser, created now if needed; raises if it can't be created."""
+        if self._parser is None:
+            with self._lock:
+                if self._parser is None:
+                    started = time.monotonic()
+                    self._parser = self._factory()
+                    logger.info(f"Created {self.platform} parser in {time.monotonic() - started:.2f}s")
+        return self._parser
+
+    def __getattr__(self, name: str) -> Callable:
+        def call(*args, **kwargs):
+            return getattr(self.get(), name)(*args, **kwargs)
+        call.__name__ = name
+        return call
+
+platform_health = PlatformHealth()
@@ -1,66 +1,214 @@
 import asyncio
+import hashlib
+import json
+import multiprocessing
+import signal
 import schedule
 import time
+started_at = time.monotonic()  # Cold start is measured from here, before the heavy imports
 from datetime import datetime
+from urllib.parse import urlparse
 from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.dispatcher.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from config import TELEGRAM_BOT_TOKEN, logger, check_config
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_API_URL,
+    RESOLVE_TTL,
+    RESOLVE_REFRESH_INTERVAL,
+    SCHEDULER_TICK,
+    DEDUP_SAVE_INTERVAL,
+    VK_EXECUTE_BATCH,
+    ADMIN_CHAT_ID,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_MAX_HANDLERS,
+    WEBHOOK_WORKERS,
+    POLL_WORKERS,
+    WORKER_HEARTBEAT_INTERVAL,
+    RELAY_INTERVAL,
+    RELAY_BATCH,
+    METRICS_PORT,
+    FILTER_MAX_RULES,
+    DIGEST_INTERVAL,
+    DIGEST_MIN_INTERVAL,
+    DIGEST_MAX_INTERVAL,
+    DIGEST_MAX_POSTS,
+    DIGEST_POSTS_LIMIT,
+    SEARCH_PAGE_SIZE,
+    BREAKER_THRESHOLD,
+    BREAKER_BASE_DELAY,
+    BREAKER_MAX_DELAY,
+    BREAKER_DISABLE_AFTER,
+    PLATFORM_BREAKER_THRESHOLD,
+    PLATFORM_BREAKER_BASE_DELAY,
+    PLATFORM_BREAKER_MAX_DELAY,
+    logger,
+    check_config,
+    worker_env
+)
 from storage import Storage
-from parsers import VKParser, TwitterParser
+from poller import Poller, PollResult, SourceSchedule
+from delivery import DeliveryQueue
+from media import Album, MediaSender, build_messages
+from ratelimit import rate_limiter, RateLimitExceeded
+from cache import PostCache
+from dedup import DedupIndex
+from webhook import WebhookServer
+from health import LazyParser, platform_health
+from breaker import Breaker, CircuitBreakers, source_key, CLOSED, OPEN, HALF_OPEN, DISABLED
+from adapters import format_body, registry, Post, RSSAdapter, TwitterAdapter, VKAdapter
+from rss import RSSParser
+from sharding import ShardLease
+from digest import DigestBuffer, DigestItem
+from archive import Archive
+from outbox import Outbox
+from filters import FilterEngine, FilterRuleError, check_rule, INCLUDE, EXCLUDE, KEYWORD, REGEX
+import metrics
 
 # Initialize bot and dispatcher
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
+bot = Bot(token=TELEGRAM_BOT_TOKEN,
+          server=TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else TELEGRAM_PRODUCTION)
 dp = Dispatcher(bot)
 
-# Initialize storage and parsers
-storage = Storage()
-vk_parser = VKParser()
-twitter_parser = TwitterParser()
+# Set in poll worker processes, which poll their shard of the sources and leave Telegram to this process
+worker_id = None
+shard_lease = None
+
+def create_vk_parser():
+    # vk_api and tweepy are imported here, off the startup path
+    from parsers import VKParser
+    # Poll workers may have credentials of their own, e.g. VK_ACCESS_TOKEN_2
+    return VKParser(worker_env('VK_ACCESS_TOKEN', worker_id))
+
+def create_twitter_parser():
+    from parsers import TwitterParser
+    return TwitterParser(*(
+        worker_env(name, worker_id)
+        for name in ('TWITTER_BEARER_TOKEN', 'TWITTER_API_KEY', 'TWITTER_API_SECRET',
+                     'TWITTER_ACCESS_TOKEN', 'TWITTER_ACCESS_TOKEN_SECRET')
+    ))
+
+# Initialize parsers and storage; parsers are created on first use in a worker thread
+vk_parser = LazyParser('vk', create_vk_parser)
+twitter_parser = LazyParser('twitter', create_twitter_parser)
+rss_parser = RSSParser()
+poller = Poller(registry)
+registry.register(VKAdapter(vk_parser, poller.run, VK_EXECUTE_BATCH))
+registry.register(TwitterAdapter(twitter_parser, poller.run))
+registry.register(RSSAdapter(rss_parser, poller.run))
+storage = Storage(source_types=registry.types())
+source_schedule = SourceSchedule({adapter.source_type: adapter.batch_size for adapter in registry})
+post_cache = PostCache()  # Latest posts per source for the "show posts" button
+dedup_index = DedupIndex()  # Fingerprints of recently forwarded posts
+filter_engine = FilterEngine()  # Per-chat include/exclude rules
+filter_engine.sync(storage.filters)
+archive = Archive()  # Every fetched post, searchable with /search
+
+# Circuit breakers pause sources and platforms that keep failing; their state survives restarts
+source_breakers = CircuitBreakers(BREAKER_THRESHOLD, BREAKER_BASE_DELAY, BREAKER_MAX_DELAY, BREAKER_DISABLE_AFTER,
+                                  breakers=[Breaker(*row) for row in storage.get_breakers('source')])
+platform_breakers = CircuitBreakers(PLATFORM_BREAKER_THRESHOLD, PLATFORM_BREAKER_BASE_DELAY, PLATFORM_BREAKER_MAX_DELAY,
+                                    breakers=[Breaker(*row) for row in storage.get_breakers('platform')])
+
+media_sender = MediaSender(bot)  # Uploads each photo once and reuses its file_id
+delivery = DeliveryQueue(media_sender.send, on_done=lambda outbox_id, outcome: outbox.done(outbox_id, outcome))
+outbox = Outbox(storage, delivery)  # Messages kept in the database until Telegram accepts them
+digests = DigestBuffer(storage, outbox.queue)  # When the digests of chats in digest mode are due
+
+# Gauges read at scrape time from the components that own the state
+metrics.DELIVERY_PENDING.set_function(delivery.pending)
+metrics.DIGEST_PENDING.set_function(digests.pending)
+metrics.ARCHIVE_PENDING.set_function(archive.pending)
+metrics.API_QUOTA_REMAINING.set_function(lambda: {
+    endpoint: quota['remaining']
+    for endpoint, quota in rate_limiter.snapshot().items()
+    if quota['remaining'] is not None
+})
+metrics.PLATFORM_HEALTHY.set_function(lambda: {
+    platform: int(state.status == 'healthy') for platform, state in platform_health.snapshot().items()
+})
+
+PLATFORM_STATUS_NAMES = {'starting': 'проверяется', 'healthy': 'работает', 'degraded': 'недоступен'}
+BREAKER_STATE_NAMES = {OPEN: 'приостановлен', HALF_OPEN: 'проверяется', DISABLED: 'отключён'}
+
+def notify_admin(text: str):
+    """Queue a service message for the admin chat, if one is configured"""
+    logger.warning(text)
+    if ADMIN_CHAT_ID is None:
+        return
+    if worker_id is not None:
+        # Only the bot process talks to Telegram
+        storage.publish_notice(text)
+    elif outbox.delivery is None:
+        # Extra webhook processes leave their messages to the primary one
+        outbox.send(ADMIN_CHAT_ID, text)
+    else:
+        delivery.enqueue(ADMIN_CHAT_ID, text)
+
+def save_breakers():
+    """Persist breakers changed since the last save"""
+    storage.save_breakers('source', *source_breakers.pop_dirty())
+    storage.save_breakers('platform', *platform_breakers.pop_dirty())
+
+def refresh_shared_state():
+    """Pick up sources, subscriptions, filters, breakers and messages changed by another process"""
+    changed = storage.refresh()
+    if 'filters' in changed:
+        filter_engine.sync(storage.filters)
+    if 'breakers' in changed:
+        source_breakers.load([Breaker(*row) for row in storage.get_breakers('source')])
+        platform_breakers.load([Breaker(*row) for row in storage.get_breakers('platform')])
+    if 'digests' in changed:
+        digests.sync()
+    if 'outbox' in changed:
+        outbox.pick_up()
+
+CALLBACK_DATA_LIMIT = 64  # Telegram limit in bytes
+
+def source_ref(source_id: str) -> str:
+    """Short stand-in for a source ID too long for callback data, such as a feed URL"""
+    return '#' + hashlib.sha1(source_id.encode('utf-8')).hexdigest()[:16]
+
+def find_source(source_type: str, ref: str):
+    """Get a source by its ID or by the stand-in made by source_ref"""
+    if not ref.startswith('#'):
+        return storage.get_source(source_type, ref)
+    return next((source for source in storage.get_sources(source_type) if source_ref(source.id) == ref), None)
 
 def get_show_posts_keyboard(source_type: str, source_id: str) -> InlineKeyboardMarkup:
     """Create inline keyboard for showing posts"""
+    callback_data = f"show_posts:{source_type}:{source_id}"
+    if len(callback_data.encode('utf-8')) > CALLBACK_DATA_LIMIT:
+        callback_data = f"show_posts:{source_type}:{source_ref(source_id)}"
     keyboard = InlineKeyboardMarkup()
-    keyboard.add(InlineKeyboardButton(
-        "📝 Показать последние посты",
-        callback_data=f"show_posts:{source_type}:{source_id}"
-    ))
+    keyboard.add(InlineKeyboardButton("📝 Показать последние посты", callback_data=callback_data))
     return keyboard
 
 @dp.callback_query_handler(lambda c: c.data.startswith('show_posts:'))
 async def process_show_posts(callback_query: types.CallbackQuery):
     """Handle show posts button click"""
     try:
-        # Parse callback data
-        _, source_type, source_id = callback_query.data.split(':')
-
-        # Get posts based on source type
-        if source_type == 'vk':
-            posts = vk_parser.get_posts(source_id)
-            source = next((s for s in storage.get_sources('vk') if s['id'] == source_id), None)
-            if not source:
-                await callback_query.answer("Источник не найден")
-                return
+        # Parse callback data; source IDs may contain colons
+        _, source_type, source_id = callback_query.data.split(':', 2)
 
-            # Send posts
-            await callback_query.message.answer(f"📢 Последние посты из группы VK '{source['name']}':")
-            for post in posts:
-                message = f"{post['text']}\n\n🔗 {post['link']}"
-                await callback_query.message.answer(message)
-
-        elif source_type == 'twitter':
-            tweets = twitter_parser.get_tweets(source_id)
-            source = next((s for s in storage.get_sources('twitter') if s['id'] == source_id), None)
-            if not source:
-                await callback_query.answer("Источник не найден")
-                return
+        adapter = registry.get(source_type)
+        source = find_source(source_type, source_id) if adapter else None
+        if not source:
+            await callback_query.answer("Источник не найден")
+            return
+        posts = await post_cache.get_or_fetch((source_type, source.id), lambda: adapter.fetch_latest(source))
 
-            # Send tweets
-            await callback_query.message.answer(f"🐦 Последние твиты от {source['name']}:")
-            for tweet in tweets:
-                message = f"{tweet['text']}\n\n🔗 {tweet['link']}"
-                await callback_query.message.answer(message)
+        # Send posts
+        await callback_query.message.answer(adapter.latest_header.format(name=source.name))
+        for post in posts:
+            for part in build_messages(format_body(post), post.attachments):
+                await media_sender.send(callback_query.message.chat.id, part)
 
         await callback_query.answer()
 
@@ -71,110 +219,119 @@ async def process_show_posts(callback_query: types.CallbackQuery):
 # Command handlers
 @dp.message_handler(commands=['start'])
 async def cmd_start(message: types.Message):
-    # Add chat to receive messages
+    # Add chat to receive messages; its subscriptions are kept across /stop
     storage.add_chat(message.chat.id)
     await message.answer(
         "👋 Привет! Я бот для агрегации новостей из VK и Twitter.\n\n"
         "Доступные команды:\n"
         "/help - Показать справку\n"
-        "/add_vk_source <group_id> - Добавить группу VK\n"
-        "/add_twitter_source <username> - Добавить аккаунт Twitter\n"
-        "/list_sources - Показать все источники\n"
-        "/remove_source <source_id> - Удалить источник\n"
-        "/stop - Отписаться от уведомлений"
+        "/add_vk_source <group_id> - Подписаться на группу VK\n"
+        "/add_twitter_source <username> - Подписаться на аккаунт Twitter\n"
+        "/add_rss_source <url> - Подписаться на RSS или Atom ленту\n"
+        "/list_sources - Показать ваши источники\n"
+        "/remove_source <source_id> - Отписаться от источника\n"
+        "/filter - Фильтры постов по словам\n"
+        "/digest - Получать посты сводкой\n"
+        "/search <запрос> - Найти посты ваших источников\n"
+        "/stop - Приостановить уведомления"
     )
 
 @dp.message_handler(commands=['stop'])
 async def cmd_stop(message: types.Message):
     storage.remove_chat(message.chat.id)
-    await message.answer("Вы отписались от уведомлений. Чтобы снова получать новости, отправьте /start")
+    await message.answer("Уведомления приостановлены. Чтобы снова получать новости, отправьте /start")
 
 @dp.message_handler(commands=['help'])
 async def cmd_help(message: types.Message):
     await message.answer(
         "📚 Справка по командам:\n\n"
-        "/add_vk_source <group_id> - Добавить группу VK как источник новостей\n"
-        "/add_twitter_source <username> - Добавить аккаунт Twitter как источник новостей\n"
-        "/list_sources - Показать список всех добавленных источников\n"
-        "/remove_source <source_id> - Удалить источник по его ID\n"
-        "/stop - Отписаться от уведомлений\n\n"
+        "/add_vk_source <group_id> - Подписать этот чат на группу VK\n"
+        "/add_twitter_source <username> - Подписать этот чат на аккаунт Twitter\n"
+        "/add_rss_source <url> - Подписать этот чат на RSS или Atom ленту\n"
+        "/list_sources - Показать источники, на которые подписан этот чат\n"
+        "/remove_source <source_id> - Отписать этот чат от источника по его ID\n"
+        "/filter - Настроить фильтры постов по словам и регулярным выражениям\n"
+        "/digest - Получать посты сводкой раз в заданное время\n"
+        "/search <запрос> - Найти посты источников этого чата\n"
+        "/quota - Показать состояние квот API\n"
+        "/health - Показать источники с ошибками\n"
+        "/stop - Приостановить уведомления (подписки сохранятся)\n\n"
         "Примеры:\n"
         "/add_vk_source 123456\n"
-        "/add_twitter_source elonmusk"
+        "/add_twitter_source elonmusk\n"
+        "/add_rss_source https://habr.com/ru/rss/articles/\n"
+        "/search курс рубля"
     )
 
-@dp.message_handler(commands=['add_vk_source'])
-async def cmd_add_vk_source(message: types.Message):
+async def add_source(message: types.Message, adapter):
+    """Subscribe the chat to a source of the adapter's type, looking it up if it's new"""
     try:
-        group_id = message.text.split()[1]
-        group_info = vk_parser.get_group_info(group_id)
-
-        if not group_info:
-            await message.answer("❌ Не удалось найти группу VK. Проверьте ID группы.")
-            return
+        source_id = message.text.split()[1]
 
-        if storage.add_source('vk', group_id, group_info['name']):
-            await message.answer(
-                f"✅ Группа VK '{group_info['name']}' успешно добавлена!",
-                reply_markup=get_show_posts_keyboard('vk', group_id)
-            )
-        else:
-            await message.answer("❌ Эта группа уже добавлена.")
-    except IndexError:
-        await message.answer("❌ Укажите ID группы VK. Пример: /add_vk_source 123456")
-    except Exception as e:
-        logger.error(f"Error adding VK source: {e}")
-        await message.answer("❌ Произошла ошибка при добавлении группы VK.")
+        # Another chat may have added the source already, then no API lookup is needed
+        source = storage.get_source(adapter.source_type, source_id)
+        if source is not None and source_breakers.reset(source_key(adapter.source_type, source_id)):
+            # Adding a paused or disabled source again is the way to retry it right away
+            save_breakers()
+            await message.answer(adapter.reenabled_text)
+        if source is None:
+            if platform_health.unavailable_until(adapter.source_type):
+                await message.answer(adapter.unavailable_text)
+                return
+            resolved = await adapter.resolve(source_id)
 
-@dp.message_handler(commands=['add_twitter_source'])
-async def cmd_add_twitter_source(message: types.Message):
-    try:
-        username = message.text.split()[1]
-        user_info = twitter_parser.get_user_info(username)
+            if not resolved:
+                await message.answer(adapter.not_found_text)
+                return
 
-        if not user_info:
-            await message.answer("❌ Не удалось найти пользователя Twitter. Проверьте имя пользователя.")
-            return
+            storage.add_source(adapter.source_type, source_id, *resolved)
+            source = storage.get_source(adapter.source_type, source_id)
 
-        if storage.add_source('twitter', username, user_info.name):
+        storage.add_chat(message.chat.id)
+        if storage.subscribe(message.chat.id, adapter.source_type, source_id):
             await message.answer(
-                f"✅ Аккаунт Twitter '{user_info.name}' успешно добавлен!",
-                reply_markup=get_show_posts_keyboard('twitter', username)
+                adapter.added_text.format(name=source.name),
+                reply_markup=get_show_posts_keyboard(adapter.source_type, source_id)
             )
         else:
-            await message.answer("❌ Этот аккаунт уже добавлен.")
+            await message.answer(adapter.exists_text)
     except IndexError:
-        await message.answer("❌ Укажите имя пользователя Twitter. Пример: /add_twitter_source elonmusk")
+        await message.answer(adapter.usage_text)
     except Exception as e:
-        logger.error(f"Error adding Twitter source: {e}")
-        await message.answer("❌ Произошла ошибка при добавлении аккаунта Twitter.")
+        logger.error(f"Error adding {adapter.source_type} source: {e}")
+        await message.answer("❌ Произошла ошибка при добавлении источника.")
+
+def register_add_commands():
+    """Register an /add_*_source command for every source adapter"""
+    for adapter in registry:
+        async def cmd_add_source(message: types.Message, adapter=adapter):
+            await add_source(message, adapter)
+        dp.register_message_handler(cmd_add_source, commands=[adapter.add_command])
+
+register_add_commands()
 
 @dp.message_handler(commands=['list_sources'])
 async def cmd_list_sources(message: types.Message):
-    sources = storage.get_sources()
-    if not sources['vk'] and not sources['twitter']:
+    sources = {}
+    for source in storage.get_subscriptions(message.chat.id):
+        sources.setdefault(source.source_type, []).append(source)
+    if not sources:
         await message.answer("📝 Список источников пуст.")
         return
 
     response = "📝 Список источников:\n\n"
 
-    if sources['vk']:
-        response += "VK группы:\n"
-        for source in sources['vk']:
-            response += f"- {source['name']} (ID: {source['id']})\n"
-            # Add show posts button for each source
-            keyboard = get_show_posts_keyboard('vk', source['id'])
-            await message.answer(response, reply_markup=keyboard)
-            response = ""
-
-    if sources['twitter']:
-        response += "\nTwitter аккаунты:\n"
-        for source in sources['twitter']:
-            response += f"- {source['name']} (@{source['id']})\n"
+    for adapter in registry:
+        if not sources.get(adapter.source_type):
+            continue
+        response += f"{adapter.list_title}\n"
+        for source in sources[adapter.source_type]:
+            response += adapter.list_item.format(name=source.name, id=source.id) + "\n"
             # Add show posts button for each source
-            keyboard = get_show_posts_keyboard('twitter', source['id'])
+            keyboard = get_show_posts_keyboard(adapter.source_type, source.id)
             await message.answer(response, reply_markup=keyboard)
             response = ""
+        response = "\n"
 
 @dp.message_handler(commands=['remove_source'])
 async def cmd_remove_source(message: types.Message):
@@ -182,13 +339,14 @@ async def cmd_remove_source(message: types.Message):
         source_id = message.text.split()[1]
         removed = False
 
-        # Try to remove from VK sources
-        if storage.remove_source('vk', source_id):
-            removed = True
-
-        # Try to remove from Twitter sources
-        if storage.remove_source('twitter', source_id):
-            removed = True
+        for source_type in registry.types():
+            if storage.unsubscribe(message.chat.id, source_type, source_id):
+                removed = True
+                # Nobody reads the source anymore, stop polling it
+                if not storage.has_subscribers(source_type, source_id):
+                    storage.remove_source(source_type, source_id)
+                    post_cache.discard((source_type, source_id))
+                    source_breakers.discard(source_key(source_type, source_id))
 
         if removed:
             await message.answer("✅ Источник успешно удален!")
@@ -197,57 +355,678 @@ async def cmd_remove_source(message: types.Message):
     except IndexError:
         await message.answer("❌ Укажите ID источника. Пример: /remove_source 123456")
 
-async def check_new_posts():
-    """Check for new posts from all sources"""
+FILTER_COMMANDS = {
+    'include': (INCLUDE, KEYWORD),
+    'exclude': (EXCLUDE, KEYWORD),
+    'include_re': (INCLUDE, REGEX),
+    'exclude_re': (EXCLUDE, REGEX)
+}
+FILTER_RULE_NAMES = {
+    (INCLUDE, KEYWORD): 'только со словом',
+    (EXCLUDE, KEYWORD): 'без слова',
+    (INCLUDE, REGEX): 'только по выражению',
+    (EXCLUDE, REGEX): 'без выражения'
+}
+FILTER_USAGE = (
+    "/filter include <слово> - Получать только посты с этим словом или фразой\n"
+    "/filter exclude <слово> - Не получать посты с этим словом или фразой\n"
+    "/filter include_re <выражение> - Получать только посты, подходящие под регулярное выражение\n"
+    "/filter exclude_re <выражение> - Не получать посты, подходящие под регулярное выражение\n"
+    "/filter remove <номер> - Удалить правило\n"
+    "/filter clear - Удалить все правила\n\n"
+    "Слова ищутся целиком и без учёта регистра. Пост приходит, если не подходит ни под одно "
+    "исключающее правило и подходит хотя бы под одно включающее, когда они есть."
+)
+
+@dp.message_handler(commands=['filter'])
+async def cmd_filter(message: types.Message):
+    chat_id = message.chat.id
+    args = message.get_args().split(maxsplit=1)
+    if not args:
+        rules = storage.get_filters(chat_id)
+        if rules:
+            response = "🔎 Фильтры этого чата:\n"
+            for number, (action, kind, pattern) in enumerate(rules, 1):
+                response += f"{number}. {FILTER_RULE_NAMES[(action, kind)]} «{pattern}»\n"
+        else:
+            response = "🔎 Фильтров нет, приходят все посты.\n"
+        await message.answer(f"{response}\n{FILTER_USAGE}")
+        return
+
+    command = args[0].lower()
+    argument = args[1] if len(args) > 1 else ''
+    if command in FILTER_COMMANDS:
+        action, kind = FILTER_COMMANDS[command]
+        try:
+            pattern = check_rule(kind, argument)
+        except FilterRuleError as e:
+            await message.answer(f"❌ {e}")
+            return
+        if len(storage.get_filters(chat_id)) >= FILTER_MAX_RULES:
+            await message.answer(f"❌ Не больше {FILTER_MAX_RULES} правил на чат. Удалите ненужные: /filter remove <номер>")
+            return
+        if not storage.add_filter(chat_id, action, kind, pattern):
+            await message.answer("❌ Такое правило уже есть.")
+            return
+        await message.answer(f"✅ Правило добавлено: {FILTER_RULE_NAMES[(action, kind)]} «{pattern}»")
+    elif command == 'remove':
+        rules = storage.get_filters(chat_id)
+        if not argument.isdigit() or not 1 <= int(argument) <= len(rules):
+            await message.answer("❌ Укажите номер правила из списка /filter. Пример: /filter remove 1")
+            return
+        storage.remove_filters(chat_id, [rules[int(argument) - 1]])
+        await message.answer("✅ Правило удалено.")
+    elif command == 'clear':
+        storage.remove_filters(chat_id, storage.get_filters(chat_id))
+        await message.answer("✅ Все фильтры удалены, приходят все посты.")
+    else:
+        await message.answer(FILTER_USAGE)
+        return
+    filter_engine.set_rules(chat_id, storage.get_filters(chat_id))
+
+DIGEST_USAGE = (
+    "/digest on - Включить сводку с настройками по умолчанию\n"
+    "/digest <минуты> [постов] - Присылать сводку раз в указанное время или как только наберётся "
+    "указанное число постов\n"
+    "/digest off - Снова получать посты по одному\n\n"
+    "В сводке текст постов сокращается, ссылки на них сохраняются, фото не прикладываются."
+)
+
+@dp.message_handler(commands=['digest'])
+async def cmd_digest(message: types.Message):
+    chat_id = message.chat.id
+    args = message.get_args().split()
+    if not args:
+        settings = storage.get_digest(chat_id)
+        if settings is None:
+            response = "🗞 Посты приходят по одному.\n"
+        else:
+            interval, max_posts = settings
+            response = (f"🗞 Посты приходят сводкой раз в {interval / 60:g} мин. "
+                        f"или по {max_posts} постов.\n")
+        await message.answer(f"{response}\n{DIGEST_USAGE}")
+        return
+
+    if args[0].lower() == 'off':
+        if not storage.remove_digest(chat_id):
+            await message.answer("Сводка и так выключена, посты приходят по одному.")
+            return
+        # Posts already collected go out now rather than wait for the digest time; in an extra
+        # webhook process the primary one sends them once it sees the change
+        if outbox.delivery is not None:
+            digests.flush(chat_id)
+        await message.answer("✅ Сводка выключена, посты снова будут приходить по одному.")
+        return
+
+    if args[0].lower() == 'on':
+        interval, max_posts = DIGEST_INTERVAL, DIGEST_MAX_POSTS
+    else:
+        try:
+            interval = float(args[0].replace(',', '.')) * 60
+            max_posts = int(args[1]) if len(args) > 1 else DIGEST_MAX_POSTS
+        except ValueError:
+            await message.answer(f"❌ Не понял параметры.\n\n{DIGEST_USAGE}")
+            return
+        if not DIGEST_MIN_INTERVAL <= interval <= DIGEST_MAX_INTERVAL:
+            await message.answer(f"❌ Интервал сводки должен быть от {DIGEST_MIN_INTERVAL / 60:g} "
+                                 f"до {DIGEST_MAX_INTERVAL / 60:g} мин.")
+            return
+        if not 1 <= max_posts <= DIGEST_POSTS_LIMIT:
+            await message.answer(f"❌ Число постов в сводке должно быть от 1 до {DIGEST_POSTS_LIMIT}.")
+            return
+    storage.set_digest(chat_id, interval, max_posts)
+    await message.answer(f"✅ Посты будут приходить сводкой раз в {interval / 60:g} мин. "
+                         f"или по {max_posts} постов.")
+
+SEARCH_HEADER = "🔎 Поиск: "
+
+async def search_page(chat_id: int, query: str, page: int):
+    """Text and paging keyboard of a page of search results among the chat's sources"""
+    sources = [(source.source_type, source.id) for source in storage.get_subscriptions(chat_id)]
+    if not sources:
+        return "У этого чата нет источников, искать не в чем. Добавьте их командами /add_...", None
+    # One extra hit tells whether there is a next page
+    hits = await archive.search(query, sources, page * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE + 1)
+    if not hits and page == 0:
+        return f"{SEARCH_HEADER}{query}\n\nНичего не найдено.", None
+
+    # The query is read back from the first line when paging, so callback data stays short
+    text = f"{SEARCH_HEADER}{query}\nСтраница {page + 1}\n"
+    for number, hit in enumerate(hits[:SEARCH_PAGE_SIZE], page * SEARCH_PAGE_SIZE + 1):
+        source = storage.get_source(hit.source_type, hit.source_id)
+        name = source.name if source is not None and source.name else hit.source_id
+        text += f"\n{number}. {name} · {datetime.fromtimestamp(hit.date):%d.%m.%Y %H:%M}\n{hit.snippet}\n"
+        if hit.link:
+            text += f"🔗 {hit.link}\n"
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=f"search:{page - 1}"))
+    if len(hits) > SEARCH_PAGE_SIZE:
+        buttons.append(InlineKeyboardButton("Дальше ▶️", callback_data=f"search:{page + 1}"))
+    keyboard = InlineKeyboardMarkup().row(*buttons) if buttons else None
+    return text, keyboard
+
+@dp.message_handler(commands=['search'])
+async def cmd_search(message: types.Message):
+    query = ' '.join(message.get_args().split())
+    if not query:
+        await message.answer("❌ Укажите, что искать. Пример: /search курс рубля")
+        return
+    try:
+        text, keyboard = await search_page(message.chat.id, query, 0)
+    except Exception as e:
+        logger.error(f"Error searching the archive for {query!r}: {e}")
+        await message.answer("❌ Не удалось выполнить поиск, попробуйте позже.")
+        return
+    await message.answer(text, reply_markup=keyboard, disable_web_page_preview=True)
+
+@dp.callback_query_handler(lambda c: c.data.startswith('search:'))
+async def process_search_page(callback_query: types.CallbackQuery):
+    """Handle the paging buttons of search results"""
     try:
-        # Get all chat IDs that should receive messages
-        chat_ids = storage.get_chats()
+        page = int(callback_query.data.split(':', 1)[1])
+        query = callback_query.message.text.split('\n', 1)[0][len(SEARCH_HEADER):]
+        text, keyboard = await search_page(callback_query.message.chat.id, query, page)
+        await callback_query.message.edit_text(text, reply_markup=keyboard, disable_web_page_preview=True)
+        await callback_query.answer()
+    except Exception as e:
+        logger.error(f"Error paging search results: {e}")
+        await callback_query.answer("Произошла ошибка при поиске")
+
+@dp.message_handler(commands=['health'])
+async def cmd_health(message: types.Message):
+    response = "🩺 Состояние платформ:\n"
+    for platform in registry.types():
+        response += f"{platform}: {PLATFORM_STATUS_NAMES[platform_health.state(platform).status]}"
+        breaker = platform_breakers.get(platform)
+        if breaker.state != CLOSED:
+            response += (f", {BREAKER_STATE_NAMES[breaker.state]} после {breaker.failures} ошибок подряд "
+                         f"до {time.strftime('%H:%M', time.localtime(breaker.retry_at))}")
+        response += "\n"
+
+    # The admin sees every source, other chats only their own
+    problems = source_breakers.problems()
+    if ADMIN_CHAT_ID is None or message.chat.id != ADMIN_CHAT_ID:
+        own = {source_key(source.source_type, source.id) for source in storage.get_subscriptions(message.chat.id)}
+        problems = [breaker for breaker in problems if breaker.key in own]
+
+    if not problems:
+        response += "\n✅ Все источники работают."
+    else:
+        response += "\nИсточники с ошибками:\n"
+        for breaker in problems[:30]:
+            response += f"- {breaker.key}: {BREAKER_STATE_NAMES[breaker.state]}, ошибок подряд: {breaker.failures}"
+            if breaker.state == OPEN:
+                response += f", повтор {time.strftime('%d.%m %H:%M', time.localtime(breaker.retry_at))}"
+            response += f"\n  {(breaker.last_error or '')[:150]}\n"
+        if len(problems) > 30:
+            response += f"...и ещё {len(problems) - 30}\n"
+        if any(breaker.state == DISABLED for breaker in problems):
+            response += "\nОтключённый источник можно включить, добавив его снова."
+    await message.answer(response)
+
+@dp.message_handler(commands=['quota'])
+async def cmd_quota(message: types.Message):
+    quotas = rate_limiter.snapshot()
+    if not quotas:
+        await message.answer("📊 Запросов к API ещё не было.")
+        return
+
+    response = "📊 Квоты API:\n\n"
+    for endpoint, quota in quotas.items():
+        response += f"{endpoint}: {quota['calls']} запросов, лимит {quota['rate']:g}/с"
+        if quota['remaining'] is not None:
+            response += f", осталось {quota['remaining']}/{quota['limit']}"
+        if quota['reset_in'] is not None:
+            response += f", сброс через {quota['reset_in']} с"
+        if quota['blocked_for']:
+            response += f"\n  ⏸ приостановлено на {quota['blocked_for']} с"
+        response += "\n"
+    await message.answer(response)
+
+@dp.message_handler(commands=['stats'])
+async def cmd_stats(message: types.Message):
+    # Internal numbers are only shown to the configured admin chat
+    if ADMIN_CHAT_ID is None or message.chat.id != ADMIN_CHAT_ID:
+        return
+
+    response = "📈 Статистика:\n\n"
+    histograms = [
+        ('Загрузка источника', metrics.FETCH_SECONDS),
+        ('Запрос к API', metrics.API_REQUEST_SECONDS),
+        ('Цикл опроса', metrics.POLL_CYCLE_SECONDS),
+        ('Доставка', metrics.DELIVERY_SECONDS),
+        ('Отправка в Telegram', metrics.SEND_SECONDS),
+        ('Запись в БД', metrics.STORAGE_WRITE_SECONDS),
+        ('Фильтрация поста', metrics.FILTER_SECONDS),
+        ('Поиск в архиве', metrics.SEARCH_SECONDS),
+        ('Задержка event loop', metrics.EVENT_LOOP_LAG)
+    ]
+    for title, histogram in histograms:
+        for labels, stats in histogram.stats().items():
+            name = f"{title} ({', '.join(labels)})" if labels else title
+            response += (f"{name}: {stats['count']} шт., среднее {stats['mean']:.3f} с, "
+                         f"p95 ≤ {stats['p95']:g} с\n")
+
+    errors = [metrics.API_ERRORS, metrics.POLL_ERRORS, metrics.SEND_ERRORS]
+    for counter in errors:
+        for line in counter.samples():
+            response += f"{line}\n"
+
+    response += (f"\nВ очереди доставки: {delivery.pending()}, отправлено {delivery.sent}, "
+                 f"не доставлено {delivery.failed}, просрочено в outbox {outbox.expired}\n"
+                 f"Кэш постов: {post_cache.hits} попаданий, {post_cache.misses} промахов\n"
+                 f"Фото: {media_sender.uploads} загрузок, {media_sender.reuses} повторов\n"
+                 f"Дубликатов пропущено: {dedup_index.duplicates}\n"
+                 f"Отсеяно фильтрами: {filter_engine.filtered}, перестроений автомата: {filter_engine.rebuilds}\n"
+                 f"Сводки: ждут {digests.pending()} постов, отправлено {metrics.DIGEST_POSTS.value():g} постов "
+                 f"в {metrics.DIGEST_MESSAGES.value():g} сообщениях\n"
+                 f"Архив: записано {archive.archived} постов, ждут записи {archive.pending()}")
+    await message.answer(response)
+
+def deliver_posts(source_type: str, source, posts, fingerprints):
+    """Return what new posts of a source, oldest first, bring to the chats subscribed to it.
+
+    That is (chat_id, key, message) deliveries for chats that get posts one by one and
+    (chat_id, key, DigestItem, due_at) posts for chats in digest mode. Fingerprints remembered for
+    deduplication are appended to `fingerprints`, to be forgotten if the deliveries can't be stored.
+    """
+    deliveries = []
+    digest_items = []
+    adapter = registry.get(source_type)
+    if adapter is None:
+        return deliveries, digest_items
+    for post in reversed(posts):
+        # One pass over the text decides for all subscribed chats
+        subscribers = storage.get_subscribers(source_type, source.id)
+        with metrics.FILTER_SECONDS.time():
+            chat_ids = filter_engine.allowed_chats(post.text, subscribers)
+        if len(chat_ids) < len(subscribers):
+            metrics.FILTERED_DELIVERIES.inc(amount=len(subscribers) - len(chat_ids))
+        # A post nobody gets isn't remembered, so a copy from another source can still pass the filters
         if not chat_ids:
-            logger.info("No chats registered to receive messages")
-            return
+            continue
+
+        # The same story often arrives from several sources within minutes; each chat gets it once
+        fingerprint = dedup_index.fingerprint(post.text)
+        duplicates = [] if fingerprint is None else dedup_index.duplicates_for(fingerprint, chat_ids)
+        if duplicates:
+            metrics.DUPLICATES_SKIPPED.inc(amount=len(duplicates))
+            logger.info(f"Skipping duplicate post {post.id} from {source_type}:{source.id} for {len(duplicates)} chats")
+            chat_ids = [chat_id for chat_id in chat_ids if chat_id not in duplicates]
+            if not chat_ids:
+                continue
+
+        # Chats in digest mode collect the post for their next digest, due an interval after it at the latest
+        single_chats = []
+        item = None
+        for chat_id in chat_ids:
+            settings = storage.get_digest(chat_id)
+            if settings is None:
+                single_chats.append(chat_id)
+                continue
+            item = item or DigestItem(source.name or source.id, post.text, post.link)
+            key = f"{source_type}:{source.id}:{post.id}:digest"
+            digest_items.append((chat_id, key, item, time.time() + settings[0]))
+
+        if single_chats:
+            message = adapter.format_post(source, post)
+            # Photos go out as albums; start downloading them before the first send
+            parts = build_messages(message, post.attachments)
+            for part in parts:
+                if isinstance(part, Album):
+                    media_sender.prefetch(part.photos)
+
+            # The key lets the outbox skip a post that is queued again after a restart
+            for chat_id in single_chats:
+                for index, part in enumerate(parts):
+                    deliveries.append((chat_id, f"{source_type}:{source.id}:{post.id}:{index}", part))
+
+        # Remembered for the chats the post is queued for, once it is; the caller forgets
+        # them if storing the deliveries fails
+        if fingerprint is not None:
+            dedup_index.remember(fingerprint, chat_ids, fingerprints)
+    return deliveries, digest_items
+
+def queue_posts(deliveries, digest_items, **updates):
+    """Store deliveries and digest posts with the source updates they result from, then schedule the digests.
+
+    Nothing is scheduled if the write fails: the cursors stay put and the posts are
+    delivered again later.
+    """
+    for _, chat_id, due_at in outbox.queue(deliveries, digest_items=digest_items, **updates):
+        settings = storage.get_digest(chat_id)
+        digests.add(chat_id, due_at, settings[1] if settings else 1)
+
+async def check_new_posts(keys):
+    """Check for new posts from the given (source_type, source_id) sources"""
+    results = []
+    fingerprints = []
+    try:
+        sources = {}
+        postponed = []
+        for source_type, source_id in keys:
+            source = storage.get_source(source_type, source_id)
+            if source is None:
+                continue
+            # Paused sources and platforms wait for their breaker; once it's due, one probe goes out
+            key = source_key(source_type, source_id)
+            if not source_breakers.allow(key):
+                postponed.append(PollResult(source_type, source, [], retry_at=source_breakers.retry_at(key)))
+            elif not platform_breakers.allow(source_type):
+                source_breakers.release(key)
+                postponed.append(PollResult(source_type, source, [], retry_at=platform_breakers.retry_at(source_type)))
+            else:
+                sources.setdefault(source_type, []).append(source)
+
+        # Fetch due sources concurrently, off the event loop
+        results = await poller.fetch_all(sources)
+        metrics.POSTS_FOUND.observe(sum(len(result.posts) for result in results))
+        record_breakers(results)
+        results.extend(postponed)
+
+        if shard_lease is not None:
+            # Poll workers hand their posts to the bot process through the database
+            publish_results(results)
+            return results
+
+        # Messages, cursor moves and source states of the whole cycle are written in one transaction
+        deliveries = []
+        digest_items = []
+        cursor_updates = []
+        state_updates = []
+        for result in results:
+            source = result.source
+            adapter = registry.get(result.source_type)
+            if adapter is None:
+                continue
+            if result.error is None and result.retry_at is None:
+                post_cache.add_new((result.source_type, source.id), result.posts)
+                archive.add(result.source_type, source.id, result.posts)
+            source_deliveries, source_digest_items = deliver_posts(result.source_type, source, result.posts,
+                                                                   fingerprints)
+            deliveries.extend(source_deliveries)
+            digest_items.extend(source_digest_items)
+            if result.posts:
+                cursor = adapter.cursor(source, result.posts)
+                if cursor is not None:
+                    cursor_updates.append((result.source_type, source.id, cursor))
+            state = adapter.pop_state(source)
+            if state is not None:
+                state_updates.append((result.source_type, source.id, state))
 
-        # Check VK sources
-        for source in storage.get_sources('vk'):
-            posts = vk_parser.get_new_posts(source['id'], source['last_post_id'])
-            for post in reversed(posts):
-                message = (
-                    f"📢 Новый пост из группы VK '{source['name']}':\n\n"
-                    f"{post['text']}\n\n"
-                    f"🔗 {post['link']}"
-                )
-                # Send message to all registered chats
-                for chat_id in chat_ids:
-                    try:
-                        await bot.send_message(chat_id=chat_id, text=message)
-                    except Exception as e:
-                        logger.error(f"Error sending message to chat {chat_id}: {e}")
-                storage.update_last_post_id('vk', source['id'], post['id'])
-
-        # Check Twitter sources
-        for source in storage.get_sources('twitter'):
-            tweets = twitter_parser.get_tweets(source['id'], source['last_post_id'])
-            for tweet in reversed(tweets):
-                message = (
-                    f"🐦 Новый твит от {source['name']}:\n\n"
-                    f"{tweet['text']}\n\n"
-                    f"🔗 {tweet['link']}"
-                )
-                # Send message to all registered chats
-                for chat_id in chat_ids:
-                    try:
-                        await bot.send_message(chat_id=chat_id, text=message)
-                    except Exception as e:
-                        logger.error(f"Error sending message to chat {chat_id}: {e}")
-                storage.update_last_post_id('twitter', source['id'], tweet['id'])
+        queue_posts(deliveries, digest_items, cursors=cursor_updates, states=state_updates)
 
     except Exception as e:
         logger.error(f"Error checking new posts: {e}")
+        # The posts will be fetched again, don't let them look like duplicates of themselves
+        dedup_index.forget(fingerprints)
+    return results
+
+def publish_results(results):
+    """Publish the new posts of a poll worker's cycle together with the cursor moves, in one transaction"""
+    updates = []
+    for result in results:
+        adapter = registry.get(result.source_type)
+        if adapter is None:
+            continue
+        source = result.source
+        state = adapter.pop_state(source)
+        if not result.posts and state is None:
+            continue
+        cursor = adapter.cursor(source, result.posts) if result.posts else None
+        updates.append((
+            source,
+            source.last_post_id if cursor is None else cursor,
+            source.state if state is None else state,
+            [json.dumps(post.to_dict(), ensure_ascii=False) for post in reversed(result.posts)]
+        ))
+    # A source polled by two workers around a takeover is published only by the first to commit
+    for source in storage.publish_posts(updates):
+        logger.info(f"Worker {worker_id}: {source.source_type}:{source.id} was polled by another worker "
+                       f"meanwhile, dropping its posts")
+
+async def relay_published_posts():
+    """Deliver the posts poll workers publish, in the order they were published"""
+    while True:
+        rows = []
+        fingerprints = []
+        try:
+            refresh_shared_state()
+            rows = storage.get_published(RELAY_BATCH)
+            deliveries = []
+            digest_items = []
+            for row in rows:
+                payload = json.loads(row['payload'])
+                if row['source_type'] is None:
+                    if ADMIN_CHAT_ID is not None:
+                        deliveries.append((ADMIN_CHAT_ID, None, payload['text']))
+                    continue
+                # Skip posts of sources removed since they were published
+                source = storage.get_source(row['source_type'], row['source_id'])
+                if source is None:
+                    continue
+                post = Post.from_dict(payload)
+                post_cache.add_new((row['source_type'], source.id), [post])
+                archive.add(row['source_type'], source.id, [post])
+                post_deliveries, post_digest_items = deliver_posts(row['source_type'], source, [post], fingerprints)
+                deliveries.extend(post_deliveries)
+                digest_items.extend(post_digest_items)
+            if rows:
+                queue_posts(deliveries, digest_items, published=[row['id'] for row in rows])
+        except Exception as e:
+            logger.error(f"Error relaying published posts: {e}")
+            # The same rows are relayed again, don't let them look like duplicates of themselves
+            dedup_index.forget(fingerprints)
+        await asyncio.sleep(0 if len(rows) == RELAY_BATCH else RELAY_INTERVAL)
+
+def record_breakers(results):
+    """Feed poll outcomes to the circuit breakers and tell the admin about platform outages and disabled sources"""
+    for result in results:
+        # Running out of quota isn't a failure of the source
+        if result.retry_at is not None:
+            continue
+        platform = result.source_type
+        key = source_key(platform, result.source.id)
+        if result.error is None:
+            source_breakers.record_success(key)
+            if platform_breakers.record_success(platform) is not None:
+                notify_admin(f"✅ {platform}: запросы снова проходят")
+            continue
+
+        # Sources already known to be broken say nothing about the platform
+        if source_breakers.get(key).state == CLOSED:
+            if platform_breakers.record_failure(platform, result.error) == OPEN:
+                notify_admin(f"⚠️ {platform}: {platform_breakers.get(platform).failures} ошибок подряд, "
+                             f"опрос приостановлен. Последняя ошибка: {result.error}")
+        if source_breakers.record_failure(key, result.error) == DISABLED:
+            notify_admin(f"⛔ Источник {key} отключён: ошибки продолжаются с "
+                         f"{time.strftime('%d.%m %H:%M', time.localtime(source_breakers.get(key).first_failure_at))}. "
+                         f"Последняя ошибка: {result.error}")
+    save_breakers()
+
+async def check_platforms():
+    """Create the parsers and verify their credentials in the background, re-checking degraded platforms"""
+    async def check(adapter):
+        platform = adapter.source_type
+        try:
+            account = await adapter.verify()
+            platform_health.mark_healthy(platform, account)
+        except RateLimitExceeded as e:
+            platform_health.mark_degraded(platform, str(e), e.retry_at)
+        except Exception as e:
+            platform_health.mark_degraded(platform, f"{type(e).__name__}: {e}")
+
+    while True:
+        # Side by side, so a slow platform doesn't hold up the check of the others
+        await asyncio.gather(*(check(adapter) for adapter in registry
+                               if platform_health.needs_check(adapter.source_type)))
+        await asyncio.sleep(min(platform_health.check_interval, SCHEDULER_TICK))
+
+async def refresh_resolutions():
+    """Keep the cached numeric IDs of sources fresh in the background"""
+    while True:
+        try:
+            for source in storage.get_stale_resolutions(RESOLVE_TTL):
+                adapter = registry.get(source.source_type)
+                if adapter is None or not adapter.resolves_ids or not platform_health.is_healthy(source.source_type):
+                    continue
+                resolved = await adapter.resolve(source.id)
+                resolved_id = resolved[1] if resolved else None
+
+                if resolved_id is not None:
+                    storage.update_resolved_id(source.source_type, source.id, resolved_id)
+                else:
+                    logger.warning(f"Could not resolve {source.source_type} source {source.id}, keeping cached ID")
+        except Exception as e:
+            logger.error(f"Error refreshing source IDs: {e}")
+        await asyncio.sleep(RESOLVE_REFRESH_INTERVAL)
+
+async def save_dedup_index():
+    """Periodically persist the dedup index without blocking the event loop"""
+    while True:
+        await asyncio.sleep(DEDUP_SAVE_INTERVAL)
+        if dedup_index.dirty:
+            snapshot = dedup_index.snapshot()
+            await asyncio.get_running_loop().run_in_executor(None, dedup_index.save, snapshot)
+
+async def poll_sources(keys):
+    """Poll a group of due sources and schedule their next check"""
+    results = []
+    try:
+        with metrics.POLL_CYCLE_SECONDS.time():
+            results = await check_new_posts(keys)
+    finally:
+        polled = {(result.source_type, result.source.id): result for result in results}
+        for source_type, source_id in keys:
+            result = polled.get((source_type, source_id))
+            if result is None:
+                source_schedule.complete(source_type, source_id)
+            else:
+                # A source whose breaker opened waits for the breaker rather than the usual backoff
+                retry_at = result.retry_at or source_breakers.paused_until(source_key(source_type, source_id)) or None
+                source_schedule.complete(source_type, source_id, len(result.posts), result.error, retry_at)
+
+def is_scheduled(source_type: str, source) -> bool:
+    """Whether this process polls a source: poll workers only take their shard"""
+    key = source_key(source_type, source.id)
+    # Disabled sources stay out of the schedule until they are added again
+    if source_breakers.is_disabled(key):
+        return False
+    return shard_lease is None or shard_lease.owns(key)
 
 async def scheduler():
-    """Run the scheduler"""
+    """Poll every source with active subscribers when it is due"""
     while True:
-        await check_new_posts()
-        await asyncio.sleep(600)  # 10 minutes
+        try:
+            # Webhook worker processes may have changed sources, subscriptions or breakers
+            refresh_shared_state()
+            source_schedule.sync({
+                source_type: [source for source in items if is_scheduled(source_type, source)]
+                for source_type, items in storage.get_polled_sources().items()
+            })
+            due = source_schedule.pop_due()
+            if due:
+                asyncio.create_task(poll_sources(due))
+        except Exception as e:
+            logger.error(f"Error scheduling sources: {e}")
+        await asyncio.sleep(min(source_schedule.seconds_until_next(), SCHEDULER_TICK))
+
+async def start_scheduler():
+    """Start polling, or delivering what the poll workers publish, once the dedup index is loaded"""
+    # Loading a large dedup index takes a moment, keep it off the event loop
+    await asyncio.get_running_loop().run_in_executor(None, dedup_index.load)
+    if POLL_WORKERS:
+        await relay_published_posts()
+    else:
+        await scheduler()
+
+async def supervise_poll_workers():
+    """Keep POLL_WORKERS poll worker processes running, restarting any that exit"""
+    context = multiprocessing.get_context('spawn')
+    workers = {}
+    try:
+        while True:
+            for number in range(1, POLL_WORKERS + 1):
+                process = workers.get(number)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    logger.error(f"Poll worker {number} exited with code {process.exitcode}, restarting it")
+                process = workers[number] = context.Process(target=poll_worker, args=(number,), daemon=True)
+                process.start()
+            await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+    finally:
+        for process in workers.values():
+            process.terminate()
+
+def poll_worker(number: int):
+    """Entry point of a poll worker process"""
+    # Ctrl+C reaches the whole process group; the bot process stops its workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(run_poll_worker(number))
+    except asyncio.CancelledError:
+        pass
+
+async def run_poll_worker(number: int):
+    """Poll this worker's shard of the sources and publish new posts to the database until terminated"""
+    global worker_id, shard_lease
+    worker_id = number
+    shard_lease = ShardLease(storage, number)
+    shard_lease.renew()
+    # Give up the lease on terminate, so the other workers take the shard over right away
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    metrics_runner = await metrics.start_server(port=METRICS_PORT + number if METRICS_PORT else 0)
+    tasks = [
+        asyncio.create_task(shard_lease.run()),
+        asyncio.create_task(metrics.monitor_event_loop()),
+        asyncio.create_task(check_platforms()),
+        asyncio.create_task(scheduler())
+    ]
+    logger.info(f"Poll worker {number} started, live workers: {shard_lease.workers}")
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await rss_parser.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+async def run_webhook(primary: bool = True):
+    """Take updates over HTTP until cancelled; the primary process also registers the webhook"""
+    server = WebhookServer(dp, urlparse(WEBHOOK_URL).path or '/', WEBHOOK_SECRET, on_update=refresh_shared_state)
+    await server.start(WEBAPP_HOST, WEBAPP_PORT, reuse_port=WEBHOOK_WORKERS > 1)
+
+    workers = []
+    if primary:
+        # Extra processes only handle commands; polling and delivery stay in this one
+        context = multiprocessing.get_context('spawn')
+        workers = [context.Process(target=webhook_worker, daemon=True) for _ in range(WEBHOOK_WORKERS - 1)]
+        for worker in workers:
+            worker.start()
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=min(WEBHOOK_MAX_HANDLERS * WEBHOOK_WORKERS, 100)
+        )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        for worker in workers:
+            worker.terminate()
+
+def webhook_worker():
+    """Entry point of an extra webhook process, sharing the database with the primary one"""
+    # Messages queued here are sent by the primary process
+    outbox.delivery = None
+    asyncio.run(run_webhook(primary=False))
 
 async def main():
     # Check configuration
@@ -255,12 +1034,43 @@ async def main():
         logger.error("Missing required environment variables. Please check your .env file.")
         return
 
-    # Start the scheduler
-    asyncio.create_task(scheduler())
+    metrics_runner = await metrics.start_server()
+
+    # Start the delivery workers and the background tasks; nothing here waits for the network
+    delivery.start()
+    outbox.restore()
+    digests.restore()
+    digests.start()
+    asyncio.create_task(metrics.monitor_event_loop())
+    asyncio.create_task(check_platforms())
+    asyncio.create_task(refresh_resolutions())
+    asyncio.create_task(save_dedup_index())
+    asyncio.create_task(archive.run())
+    asyncio.create_task(outbox.run())
+    asyncio.create_task(start_scheduler())
+    if POLL_WORKERS:
+        # Worker processes poll the sources, this one delivers what they publish
+        asyncio.create_task(supervise_poll_workers())
 
     # Start the bot
-    logger.info("Starting bot...")
-    await dp.start_polling()
+    startup_seconds = time.monotonic() - started_at
+    metrics.STARTUP_SECONDS.set(startup_seconds)
+    logger.info(f"Starting bot in {BOT_MODE} mode after {startup_seconds:.2f}s...")
+    try:
+        if BOT_MODE == 'webhook':
+            await run_webhook()
+        else:
+            await dp.start_polling()
+    finally:
+        # Not dirty if the index is still loading, so a partial index never overwrites the file
+        if dedup_index.dirty:
+            dedup_index.save()
+        outbox.flush_acks()
+        await media_sender.close()
+        await rss_parser.close()
+        archive.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,188 @@
+import asyncio
+import io
+import json
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+import aiohttp
+from aiogram import Bot, types
+
+from config import (
+    MEDIA_CACHE_SIZE,
+    MEDIA_DOWNLOAD_WORKERS,
+    MEDIA_PREFETCH_LIMIT,
+    MEDIA_MAX_BYTES,
+    HTTP_TIMEOUT,
+    logger
+)
+
+CAPTION_LIMIT = 1024  # Telegram caption length limit
+ALBUM_LIMIT = 10  # Telegram media group size limit
+
+class Album:
+    """Photos sent as one Telegram media group, with an optional caption."""
+    __slots__ = ('photos', 'caption')
+
+    def __init__(self, photos: List[str], caption: Optional[str] = None):
+        self.photos = photos
+        self.caption = caption
+
+def build_messages(text: str, attachments: List[Dict[str, Any]]) -> List[Union[str, Album]]:
+    """Turn a post into the messages to send: albums of its photos and its text.
+
+    Video attachments are VK page links, so they are appended to the text. The text
+    becomes the album caption when it fits, otherwise it follows as its own message.
+    Each message is a separate delivery, so a retry never resends an album.
+    """
+    photos = [att['url'] for att in attachments if att['type'] == 'photo']
+    videos = [att['url'] for att in attachments if att['type'] == 'video']
+    if videos:
+        text += '\n' + '\n'.join(f"🎬 {url}" for url in videos)
+    if not photos:
+        return [text]
+
+    albums = [Album(photos[i:i + ALBUM_LIMIT]) for i in range(0, len(photos), ALBUM_LIMIT)]
+    if len(text) <= CAPTION_LIMIT:
+        albums[0].caption = text
+        return albums
+    return albums + [text]
+
+def encode_message(message: Union[str, Album]) -> str:
+    """Serialize a message for the outbox."""
+    if isinstance(message, Album):
+        return json.dumps({'photos': message.photos, 'caption': message.caption}, ensure_ascii=False)
+    return json.dumps({'text': message}, ensure_ascii=False)
+
+def decode_message(data: str) -> Union[str, Album]:
+    """Turn a message serialized by encode_message back into text or an album."""
+    fields = json.loads(data)
+    if 'photos' in fields:
+        return Album(fields['photos'], fields.get('caption'))
+    return fields['text']
+
+class MediaSender:
+    """Sends text and albums, uploading each photo to Telegram only once.
+
+    Photos are downloaded by at most MEDIA_DOWNLOAD_WORKERS concurrent requests. After
+    the first upload the returned file_ids are cached, and every other chat gets the
+    album by file_id. Downloaded bytes are dropped once the upload is attempted, and at
+    most `max_downloads` photos downloaded ahead of sending are kept.
+    """
+
+    def __init__(self, bot: Bot, max_items: int = MEDIA_CACHE_SIZE, max_downloads: int = MEDIA_PREFETCH_LIMIT):
+        self.bot = bot
+        self.max_items = max_items
+        self.max_downloads = max_downloads
+        self._file_ids: 'OrderedDict[str, str]' = OrderedDict()  # photo URL -> Telegram file_id
+        self._downloads: 'OrderedDict[str, asyncio.Task]' = OrderedDict()  # photo URL -> download, oldest first
+        self._album_locks: Dict[tuple, asyncio.Lock] = {}
+        self._album_waiters: Dict[tuple, int] = {}  # album -> sends holding or waiting for its lock
+        self._semaphore = None
+        self._session = None
+        self.uploads = 0
+        self.reuses = 0
+
+    async def close(self):
+        """Close the download session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _remember(self, url: str, file_id: str):
+        self._file_ids[url] = file_id
+        self._file_ids.move_to_end(url)
+        while len(self._file_ids) > self.max_items:
+            self._file_ids.popitem(last=False)
+
+    async def _download(self, url: str) -> Optional[bytes]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(MEDIA_DOWNLOAD_WORKERS)
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+        async with self._semaphore:
+            try:
+                async with self._session.get(url) as response:
+                    response.raise_for_status()
+                    data = await response.content.read(MEDIA_MAX_BYTES + 1)
+                    if len(data) > MEDIA_MAX_BYTES:
+                        logger.warning(f"Photo {url} is larger than {MEDIA_MAX_BYTES} bytes, sending by URL")
+                        return None
+                    return data
+            except Exception as e:
+                logger.warning(f"Error downloading photo {url}, sending by URL: {e}")
+                return None
+
+    def prefetch(self, photos: List[str]):
+        """Start downloading photos that have no file_id yet, ahead of the first send."""
+        for url in photos:
+            if url not in self._file_ids and url not in self._downloads:
+                self._downloads[url] = asyncio.create_task(self._download(url))
+        # Photos of messages that are never sent, e.g. skipped by the outbox, must not pile up;
+        # a send that finds its download dropped starts it again
+        while len(self._downloads) > self.max_downloads:
+            self._downloads.popitem(last=False)
+
+    async def _input_media(self, url: str) -> Union[str, types.InputFile]:
+        """The cached file_id of a photo, or its downloaded bytes (or URL) for a first upload."""
+        file_id = self._file_ids.get(url)
+        if file_id is not None:
+            self._file_ids.move_to_end(url)
+            return file_id
+        self.prefetch([url])
+        data = await self._downloads[url]
+        if data is None:
+            return url
+        return types.InputFile(io.BytesIO(data), filename='photo.jpg')
+
+    async def send(self, chat_id: int, message: Union[str, Album]):
+        """Send a text message or an album to a chat."""
+        if isinstance(message, Album):
+            await self.send_album(chat_id, message)
+        else:
+            await self.bot.send_message(chat_id=chat_id, text=message)
+
+    async def send_album(self, chat_id: int, album: Album):
+        """Send photos as an album, uploading only those Telegram hasn't seen yet."""
+        key = tuple(album.photos)
+        if all(url in self._file_ids for url in album.photos):
+            self.reuses += 1
+            await self._send_album(chat_id, album)
+            return
+
+        # One chat uploads while the others wait for the file_ids
+        lock = self._album_locks.setdefault(key, asyncio.Lock())
+        self._album_waiters[key] = self._album_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                uploading = not all(url in self._file_ids for url in album.photos)
+                try:
+                    await self._send_album(chat_id, album)
+                finally:
+                    if uploading:
+                        # Uploaded photos go by file_id from now on; after a failed send a retry downloads them again
+                        for url in album.photos:
+                            self._downloads.pop(url, None)
+                if uploading:
+                    self.uploads += 1
+                else:
+                    self.reuses += 1
+        finally:
+            # A released lock isn't taken by the next waiter right away, so only the last one drops it
+            self._album_waiters[key] -= 1
+            if not self._album_waiters[key]:
+                del self._album_waiters[key]
+                del self._album_locks[key]
+
+    async def _send_album(self, chat_id: int, album: Album):
+        media = await asyncio.gather(*(self._input_media(url) for url in album.photos))
+        if len(media) == 1:
+            sent = [await self.bot.send_photo(chat_id=chat_id, photo=media[0], caption=album.caption)]
+        else:
+            group = types.MediaGroup()
+            for i, item in enumerate(media):
+                group.attach_photo(item, caption=album.caption if i == 0 else None)
+            sent = await self.bot.send_media_group(chat_id=chat_id, media=group)
+
+        for url, message in zip(album.photos, sent):
+            if message.photo:
+                self._remember(url, message.photo[-1].file_id)
@@ -0,0 +1,249 @@
+import asyncio
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from config import METRICS_HOST, METRICS_PORT, LOOP_LAG_INTERVAL, logger
+
+# Bucket upper bounds in seconds, from a fast cache hit to a stuck API call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+class Metric:
+    """Base of the metric types: a value per combination of label values, safe to update from any thread."""
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Sequence) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(label) for label in labels)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> List[str]:
+        """Sample lines of the metric in the Prometheus text format."""
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{self._format_labels(key)} {_number(value)}" for key, value in sorted(values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+class Gauge(Metric):
+    """Value that goes up and down, either set directly or read from a function at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable] = None
+
+    def set(self, value: float, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable):
+        """Read the value on every scrape; with labels the function returns {label values: value}."""
+        self._function = function
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                values = self._function()
+            except Exception as e:
+                logger.warning(f"Error collecting metric {self.name}: {e}")
+                return []
+            if not self.labelnames:
+                values = {(): values}
+            with self._lock:
+                self._values = {self._key(key if isinstance(key, tuple) else (key,)): value
+                                for key, value in values.items()}
+        return super().samples()
+
+class HistogramValue:
+    """Bucket counts, sum and count of one label combination."""
+    __slots__ = ('buckets', 'sum', 'count')
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = HistogramValue(len(self.bounds) + 1)
+            data.buckets[index] += 1
+            data.sum += value
+            data.count += 1
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of a block in seconds."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, *labels)
+
+    def stats(self) -> Dict[Tuple[str, ...], Dict[str, float]]:
+        """Count, mean and approximate p50/p95 (bucket upper bounds) of every label combination."""
+        with self._lock:
+            values = {key: (list(data.buckets), data.sum, data.count) for key, data in self._values.items()}
+        stats = {}
+        for key, (buckets, total, count) in sorted(values.items()):
+            stats[key] = {
+                'count': count,
+                'mean': total / count if count else 0.0,
+                'p50': self._quantile(buckets, count, 0.5),
+                'p95': self._quantile(buckets, count, 0.95)
+            }
+        return stats
+
+    def _quantile(self, buckets: List[int], count: int, q: float) -> float:
+        seen = 0
+        for bound, bucket in zip(self.bounds + (float('inf'),), buckets):
+            seen += bucket
+            if seen >= q * count:
+                return bound
+        return float('inf')
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = {key: (list(data.buckets), data.sum, data.count) for key, data in self._values.items()}
+        lines = []
+        for key, (buckets, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.bounds + (float('inf'),), buckets):
+                cumulative += bucket
+                le = self._format_labels(key, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+class Registry:
+    """All metrics of the process, rendered together for /metrics."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+REGISTRY = Registry()
+
+# Polling
+FETCH_SECONDS = Histogram('bot_fetch_seconds', 'Time to fetch new posts of a source or a VK batch', ['platform'])
+API_REQUEST_SECONDS = Histogram('bot_api_request_seconds', 'Duration of single VK/Twitter API requests', ['endpoint'])
+API_ERRORS = Counter('bot_api_errors_total', 'Failed VK/Twitter API requests', ['endpoint', 'cause'])
+API_QUOTA_REMAINING = Gauge('bot_api_quota_remaining', 'Requests left in the current quota window', ['endpoint'])
+POLL_CYCLE_SECONDS = Histogram('bot_poll_cycle_seconds', 'Duration of a poll cycle, fetching through queueing')
+POSTS_FOUND = Histogram('bot_posts_found', 'New posts found per poll cycle', buckets=COUNT_BUCKETS)
+POLL_ERRORS = Counter('bot_poll_errors_total', 'Sources that failed or were postponed in a poll', ['platform', 'cause'])
+DUPLICATES_SKIPPED = Counter('bot_duplicates_skipped_total', 'Posts skipped as near-duplicates')
+FILTER_SECONDS = Histogram('bot_filter_seconds', 'Time to match a post against the filters of its subscribers',
+                           buckets=FAST_BUCKETS)
+FILTERED_DELIVERIES = Counter('bot_filtered_deliveries_total', 'Deliveries skipped by chat filters')
+
+# Delivery
+DELIVERY_SECONDS = Histogram('bot_delivery_seconds', 'Time from queueing a message to sending it')
+SEND_SECONDS = Histogram('bot_send_seconds', 'Duration of a single Telegram send')
+SEND_ERRORS = Counter('bot_send_errors_total', 'Failed Telegram sends', ['cause'])
+DELIVERY_PENDING = Gauge('bot_delivery_pending', 'Messages waiting in the delivery queue')
+DIGEST_PENDING = Gauge('bot_digest_pending', 'Posts waiting for their chat digest')
+DIGEST_POSTS = Counter('bot_digest_posts_total', 'Posts sent in digests')
+DIGEST_MESSAGES = Counter('bot_digest_messages_total', 'Messages digests were sent in')
+
+# Storage
+STORAGE_WRITE_SECONDS = Histogram('bot_storage_write_seconds', 'Duration of SQLite write transactions', ['operation'])
+ARCHIVE_PENDING = Gauge('bot_archive_pending', 'Fetched posts waiting to be written to the archive')
+SEARCH_SECONDS = Histogram('bot_search_seconds', 'Duration of full-text searches in the archive')
+
+# Bot updates
+UPDATE_SECONDS = Histogram('bot_update_seconds', 'Time to handle a Telegram update received by webhook')
+
+# Process
+PLATFORM_HEALTHY = Gauge('bot_platform_healthy', 'Whether the credentials of a platform work (1) or not (0)', ['platform'])
+STARTUP_SECONDS = Gauge('bot_startup_seconds', 'Time from process start until the bot began taking updates')
+EVENT_LOOP_LAG = Histogram('bot_event_loop_lag_seconds', 'How late the event loop wakes up a sleeping task')
+
+async def monitor_event_loop(interval: float = LOOP_LAG_INTERVAL):
+    """Measure how much later than requested a sleep returns; anything blocking the loop shows up here."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Prometheus-Format': '0.0.4'})
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """Serve /metrics over HTTP; a port of 0 disables the endpoint."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+from typing import Any, Iterable, List, Optional, Set, Tuple
+
+from config import OUTBOX_RETRY_INTERVAL, OUTBOX_KEY_TTL, OUTBOX_MAX_AGE, OUTBOX_ACK_INTERVAL, OUTBOX_ACK_BATCH, logger
+from delivery import DeliveryQueue, SENT, CHAT_UNAVAILABLE
+from media import encode_message, decode_message
+
+class Outbox:
+    """Messages written to the database before they are handed to the delivery queue.
+
+    Deliveries are stored in the same transaction that moves the cursors of the sources
+    they come from, so a crash either loses both or neither: on restart the pending
+    messages are queued again and the posts are not fetched twice. Each message may carry
+    an idempotency key, unique per chat, so a post queued again after a restart is skipped.
+    Posts of chats in digest mode wait in the outbox too, with the time their digest is
+    due, until DigestBuffer renders them into messages and marks them sent.
+    Sent messages are marked in batches, every OUTBOX_ACK_INTERVAL or OUTBOX_ACK_BATCH
+    messages, and keep their key for OUTBOX_KEY_TTL before the outbox is compacted.
+    Delivery is at least once: a message sent just before a crash, or before its batch
+    was written, is sent again.
+
+    A process that doesn't send, such as an extra webhook process, has no `delivery`: it
+    leaves its messages in the outbox and the process that sends queues them with `pick_up`.
+    """
+
+    def __init__(self, storage, delivery: Optional[DeliveryQueue]):
+        self.storage = storage
+        self.delivery = delivery
+        self._in_flight: Set[int] = set()  # Outbox IDs handed to the delivery queue and not marked yet
+        self._acks: List[int] = []  # Outbox IDs sent, waiting to be marked
+        self.expired = 0
+
+    def _enqueue(self, rows: Iterable[Tuple[int, int, str]]):
+        if self.delivery is None:
+            return
+        for outbox_id, chat_id, payload in rows:
+            if outbox_id in self._in_flight:
+                continue
+            self._in_flight.add(outbox_id)
+            self.delivery.enqueue(chat_id, decode_message(payload), outbox_id)
+
+    def queue(self, deliveries: Iterable[Tuple[int, Any, Any]], cursors=(), states=(), published=(),
+              digest_items=(), acks=()) -> List[Tuple[int, int, float]]:
+        """Store (chat_id, key, message) deliveries with the source updates they result from, then send them.
+
+        `digest_items` are (chat_id, key, item, due_at) posts kept for a digest; returns
+        (id, chat_id, due_at) of those added. `acks` are outbox IDs to mark sent.
+        """
+        rows = [(chat_id, key, encode_message(message), None) for chat_id, key, message in deliveries]
+        rows.extend((chat_id, key, json.dumps(item.to_dict(), ensure_ascii=False), due_at)
+                    for chat_id, key, item, due_at in digest_items)
+        queued = self.storage.queue_deliveries(rows, cursors, states, published, acks,
+                                               hand_off=self.delivery is None)
+        self._enqueue((outbox_id, chat_id, payload) for outbox_id, chat_id, payload, due_at in queued if due_at is None)
+        return [(outbox_id, chat_id, due_at) for outbox_id, chat_id, _, due_at in queued if due_at is not None]
+
+    def send(self, chat_id: int, message: Any):
+        """Store and send a single message that has no idempotency key."""
+        self.queue([(chat_id, None, message)])
+
+    def restore(self):
+        """Queue the messages left unsent by the previous run."""
+        rows = self.storage.get_pending_deliveries()
+        if rows:
+            logger.info(f"Resending {len(rows)} messages from the outbox")
+        self._enqueue(rows)
+
+    def pick_up(self):
+        """Queue the messages other processes left in the outbox for this one to send."""
+        self._enqueue(self.storage.get_pending_deliveries())
+
+    def done(self, outbox_id: int, outcome: str):
+        """Called by the delivery queue once a message is sent or given up."""
+        # A chat that blocked the bot or was deleted won't take the message later either
+        if outcome not in (SENT, CHAT_UNAVAILABLE):
+            self._in_flight.discard(outbox_id)
+            return
+        # Marked messages stay in flight until written, so a resend doesn't pick them up
+        self._acks.append(outbox_id)
+        if len(self._acks) >= OUTBOX_ACK_BATCH:
+            self.flush_acks()
+
+    def flush_acks(self):
+        """Mark the messages sent since the last flush in one transaction."""
+        if not self._acks:
+            return
+        acks = self._acks
+        try:
+            self.storage.ack_deliveries(acks)
+        except Exception as e:
+            # Kept for the next flush; if the process dies first they are sent again
+            logger.error(f"Error marking {len(acks)} messages as sent: {e}")
+            return
+        self._acks = []
+        self._in_flight.difference_update(acks)
+
+    async def run(self):
+        """Mark sent messages every OUTBOX_ACK_INTERVAL; resend failed messages and compact the outbox less often."""
+        maintain_at = time.monotonic() + OUTBOX_RETRY_INTERVAL
+        while True:
+            await asyncio.sleep(OUTBOX_ACK_INTERVAL)
+            self.flush_acks()
+            if time.monotonic() < maintain_at:
+                continue
+            maintain_at = time.monotonic() + OUTBOX_RETRY_INTERVAL
+            try:
+                now = time.time()
+                compacted, expired = self.storage.compact_outbox(now - OUTBOX_KEY_TTL, now - OUTBOX_MAX_AGE)
+                if expired:
+                    self.expired += expired
+                    logger.warning(f"Gave up {expired} messages unsent for {OUTBOX_MAX_AGE:.0f}s")
+                if compacted:
+                    logger.debug(f"Compacted {compacted} sent messages from the outbox")
+                self._enqueue(self.storage.get_pending_deliveries())
+            except Exception as e:
+                logger.error(f"Error maintaining outbox: {e}")
@@ -1,232 +1,477 @@
-import vk_api
-import tweepy
-import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
-import os
-from dotenv import load_dotenv
-from config import (
-    VK_ACCESS_TOKEN,
-    TWITTER_API_KEY,
-    TWITTER_API_SECRET,
-    TWITTER_ACCESS_TOKEN,
-    TWITTER_ACCESS_TOKEN_SECRET,
-    TWITTER_BEARER_TOKEN,
-    logger
-)
-
-# Load environment variables
-load_dotenv()
-
-class VKParser:
-    def __init__(self):
-        """Initialize VK parser with API token."""
-        self.vk = vk_api.VkApi(token=VK_ACCESS_TOKEN)
-        self.api = self.vk.get_api()
-
-    def get_group_id_by_short_name(self, short_name: str) -> int:
-        """Get group ID by its short name."""
-        try:
-            # Get group info by screen name
-            group_info = self.api.groups.getById(group_id=short_name)
-            if group_info:
-                return group_info[0]['id']
-            return None
-        except Exception as e:
-            logger.error(f"Error getting group ID for {short_name}: {str(e)}")
-            return None
-
-    def get_group_info(self, group_id):
-        """Get VK group information"""
-        try:
-            group_info = self.api.groups.getById(group_id=group_id)
-            return group_info[0] if group_info else None
-        except Exception as e:
-            logger.error(f"Error getting VK group info: {e}")
-            return None
-
-    def get_posts(self, group_id: str, count: int = 10) -> List[Dict[str, Any]]:
-        """Get recent posts from a VK group."""
-        try:
-            # If group_id is a short name, get the actual ID
-            if not group_id.isdigit():
-                group_id = self.get_group_id_by_short_name(group_id)
-                if not group_id:
-                    logger.error(f"Could not find group ID for {group_id}")
-                    return []
-
-            # Get posts from the group
-            posts = self.api.wall.get(
-                owner_id=f"-{group_id}",
-                count=count,
-                filter="owner"
-            )
-
-            # Process and format posts
-            formatted_posts = []
-            for post in posts['items']:
-                # Skip ads and suggested posts
-                if post.get('marked_as_ads') or post.get('is_pinned'):
-                    continue
-
-                # Get post text
-                text = post.get('text', '')
-
-                # Get post attachments (photos, videos, etc.)
-                attachments = []
-                if 'attachments' in post:
-                    for att in post['attachments']:
-                        if att['type'] == 'photo':
-                            # Get the largest photo
-                            photo = att['photo']
-                            sizes = photo['sizes']
-                            largest_photo = max(sizes, key=lambda x: x['width'] * x['height'])
-                            attachments.append({
-                                'type': 'photo',
-                                'url': largest_photo['url']
-                            })
-                        elif att['type'] == 'video':
-                            attachments.append({
-                                'type': 'video',
-                                'url': f"https://vk.com/video{att['video']['owner_id']}_{att['video']['id']}"
-                            })
-
-                # Format post data
-                formatted_post = {
-                    'id': post['id'],
-                    'text': text,
-                    'date': datetime.fromtimestamp(post['date']),
-                    'attachments': attachments,
-                    'likes': post['likes']['count'],
-                    'reposts': post['reposts']['count'],
-                    'comments': post['comments']['count'],
-                    'link': f"https://vk.com/wall-{group_id}_{post['id']}"
-                }
-                formatted_posts.append(formatted_post)
-
-            return formatted_posts
-
-        except Exception as e:
-            logger.error(f"Error getting posts from VK group {group_id}: {str(e)}")
-            return []
-
-    def get_new_posts(self, group_id: str, last_post_id: int) -> List[Dict[str, Any]]:
-        """Get only new posts since the last post ID."""
-        try:
-            posts = self.get_posts(group_id)
-            return [post for post in posts if post['id'] > last_post_id]
-        except Exception as e:
-            logger.error(f"Error getting new posts from VK group {group_id}: {str(e)}")
-            return []
-
-class TwitterParser:
-    def __init__(self):
-        try:
-            logger.info("Initializing Twitter API v2 client...")
-
-            # Initialize v2 client with bearer token
-            self.client = tweepy.Client(
-                bearer_token=TWITTER_BEARER_TOKEN,  # Bearer token for v2 API
-                consumer_key=TWITTER_API_KEY,
-                consumer_secret=TWITTER_API_SECRET,
-                access_token=TWITTER_ACCESS_TOKEN,
-                access_token_secret=TWITTER_ACCESS_TOKEN_SECRET,
-                wait_on_rate_limit=True
-            )
-
-            # Test the connection
-            logger.info("Testing Twitter API v2 connection...")
-            test_user = self.client.get_me()
-            if test_user.data:
-                logger.info(f"Twitter API v2 client initialized successfully. Connected as: @{test_user.data.username}")
-            else:
-                logger.error("Failed to verify Twitter API credentials")
-                raise Exception("Could not verify Twitter API credentials")
-        except tweepy.TweepyException as e:
-            logger.error(f"Twitter API error during initialization: {str(e)}")
-            if hasattr(e, 'response'):
-                logger.error(f"Response status code: {e.response.status_code}")
-                logger.error(f"Response text: {e.response.text}")
-            raise
-        except Exception as e:
-            logger.error(f"Unexpected error initializing Twitter API: {str(e)}")
-            raise
-
-    def get_user_info(self, username):
-        """Get Twitter user information"""
-        try:
-            # Remove @ if present
-            username = username.lstrip('@')
-            logger.info(f"Fetching Twitter user info for: {username}")
-
-            # Get user by username using v2 API
-            logger.debug(f"Making API v2 call to get user info for: {username}")
-            user = self.client.get_user(
-                username=username,
-                user_fields=['id', 'name', 'username', 'created_at']
-            )
-
-            if not user.data:
-                logger.error(f"User not found: {username}")
-                return None
-
-            logger.info(f"Successfully found user: {user.data.name} (@{user.data.username})")
-            return user.data
-        except tweepy.TweepyException as e:
-            logger.error(f"Twitter API error getting user info: {str(e)}")
-            if hasattr(e, 'response'):
-                logger.error(f"Response status code: {e.response.status_code}")
-                logger.error(f"Response text: {e.response.text}")
-            return None
-        except Exception as e:
-            logger.error(f"Unexpected error getting Twitter user info: {str(e)}")
-            return None
-
-    def get_tweets(self, username, last_tweet_id=None):
-        """Get new tweets from Twitter user"""
-        try:
-            # Remove @ if present
-            username = username.lstrip('@')
-            logger.info(f"Fetching tweets for user: {username}")
-
-            # Get user ID first
-            user = self.client.get_user(username=username)
-            if not user.data:
-                logger.error(f"User not found: {username}")
-                return []
-
-            # Get user's tweets using v2 API
-            tweets = self.client.get_users_tweets(
-                user.data.id,
-                max_results=10,
-                tweet_fields=['created_at', 'text', 'id'],
-                exclude=['retweets', 'replies']
-            )
-
-            if not tweets.data:
-                logger.info(f"No tweets found for user: {username}")
-                return []
-
-            new_tweets = []
-            for tweet in tweets.data:
-                if last_tweet_id and tweet.id <= last_tweet_id:
-                    break
-
-                new_tweets.append({
-                    'id': tweet.id,
-                    'text': tweet.text,
-                    'date': tweet.created_at,
-                    'link': f"https://twitter.com/{username}/status/{tweet.id}"
-                })
-
-            logger.info(f"Successfully fetched {len(new_tweets)} tweets")
-            return new_tweets
-        except tweepy.TweepyException as e:
-            logger.error(f"Twitter API error getting tweets: {str(e)}")
-            if hasattr(e, 'response'):
-                logger.error(f"Response status code: {e.response.status_code}")
-                logger.error(f"Response text: {e.response.text}")
-            return []
-        except Exception as e:
-            logger.error(f"Unexpected error getting tweets: {str(e)}")
-            return []
+import vk_api
+import tweepy
+import json
+import logging
+import time
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Iterator, Optional
+import os
+from dotenv import load_dotenv
+from config import (
+    VK_ACCESS_TOKEN,
+    TWITTER_API_KEY,
+    TWITTER_API_SECRET,
+    TWITTER_ACCESS_TOKEN,
+    TWITTER_ACCESS_TOKEN_SECRET,
+    TWITTER_BEARER_TOKEN,
+    HTTP_TIMEOUT,
+    VK_API_URL,
+    TWITTER_API_URL,
+    VK_EXECUTE_BATCH,
+    VK_PAGE_SIZE,
+    TWITTER_PAGE_SIZE,
+    CATCHUP_MAX_POSTS,
+    logger
+)
+from ratelimit import rate_limiter, RateLimitExceeded
+from metrics import API_REQUEST_SECONDS, API_ERRORS
+from adapters import Post
+
+# Load environment variables
+load_dotenv()
+
+# Hosts vk_api and tweepy have built in, and where their requests actually go
+API_HOSTS = {'https://api.vk.com': VK_API_URL, 'https://api.twitter.com': TWITTER_API_URL}
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter that applies a default timeout so a hanging API can't hold a worker forever.
+
+    It also sends API requests to the hosts set in VK_API_URL and TWITTER_API_URL.
+    """
+
+    def __init__(self, *args, timeout=HTTP_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        for host, url in API_HOSTS.items():
+            if url != host and request.url.startswith(host + '/'):
+                request.url = url.rstrip('/') + request.url[len(host):]
+                break
+        return super().send(request, **kwargs)
+
+class FetchError(Exception):
+    """Raised when posts could not be fetched from a source."""
+
+def mount_timeouts(session):
+    """Install the default-timeout adapter on a requests session."""
+    adapter = TimeoutHTTPAdapter()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+# VK errors meaning "slow down": too many requests per second, flood control, method quota reached
+VK_RATE_LIMIT_ERRORS = {6: 1, 9: 60, 29: 3600}
+
+class RateLimitedVkApi(vk_api.VkApi):
+    """VkApi that takes tokens from the shared rate limiter and reports throttling errors."""
+
+    def method(self, method, values=None, *args, **kwargs):
+        rate_limiter.acquire('vk')
+        endpoint = f"vk:{method}"
+        try:
+            with API_REQUEST_SECONDS.time(endpoint):
+                return super().method(method, values, *args, **kwargs)
+        except vk_api.exceptions.ApiError as e:
+            if e.code in VK_RATE_LIMIT_ERRORS:
+                API_ERRORS.inc(endpoint, 'rate_limit')
+                retry_at = time.time() + VK_RATE_LIMIT_ERRORS[e.code]
+                rate_limiter.block('vk', retry_at)
+                raise RateLimitExceeded('vk', retry_at) from e
+            API_ERRORS.inc(endpoint, f"api_{e.code}")
+            raise
+        except Exception as e:
+            API_ERRORS.inc(endpoint, type(e).__name__)
+            raise
+
+class RateLimitedTwitterClient(tweepy.Client):
+    """tweepy client that reports quota headers to the shared rate limiter instead of sleeping."""
+
+    @staticmethod
+    def endpoint_for(route: str) -> str:
+        if route.startswith('/2/users/by/username/'):
+            return 'twitter:user_lookup'
+        if route == '/2/users/me':
+            return 'twitter:me'
+        if route.startswith('/2/users/') and route.endswith('/tweets'):
+            return 'twitter:users_tweets'
+        return 'twitter:other'
+
+    def request(self, method, route, params=None, json=None, user_auth=False):
+        endpoint = self.endpoint_for(route)
+        rate_limiter.acquire(endpoint)
+        try:
+            with API_REQUEST_SECONDS.time(endpoint):
+                response = super().request(method, route, params=params, json=json, user_auth=user_auth)
+        except tweepy.TooManyRequests as e:
+            API_ERRORS.inc(endpoint, 'rate_limit')
+            reset_at = float(e.response.headers.get('x-rate-limit-reset', time.time() + 900))
+            rate_limiter.block(endpoint, reset_at)
+            raise RateLimitExceeded(endpoint, reset_at) from e
+        except tweepy.HTTPException as e:
+            API_ERRORS.inc(endpoint, f"http_{e.response.status_code}")
+            raise
+        except Exception as e:
+            API_ERRORS.inc(endpoint, type(e).__name__)
+            raise
+        rate_limiter.update_from_headers(endpoint, response.headers)
+        return response
+
+class VKParser:
+    def __init__(self, token: str = VK_ACCESS_TOKEN):
+        """Initialize VK parser with API token."""
+        self.vk = RateLimitedVkApi(token=token)
+        mount_timeouts(self.vk.http)
+        self.api = self.vk.get_api()
+
+    def verify(self) -> str:
+        """Check the access token with a cheap request and return what it resolved; raises if it doesn't work."""
+        group = self.api.groups.getById(group_id='apiclub')
+        logger.info("VK API credentials verified")
+        return group[0]['name'] if group else 'VK'
+
+    def get_group_id_by_short_name(self, short_name: str) -> int:
+        """Get group ID by its short name."""
+        try:
+            # Get group info by screen name
+            group_info = self.api.groups.getById(group_id=short_name)
+            if group_info:
+                return group_info[0]['id']
+            return None
+        except Exception as e:
+            logger.error(f"Error getting group ID for {short_name}: {str(e)}")
+            return None
+
+    def get_group_info(self, group_id):
+        """Get VK group information"""
+        try:
+            group_info = self.api.groups.getById(group_id=group_id)
+            return group_info[0] if group_info else None
+        except Exception as e:
+            logger.error(f"Error getting VK group info: {e}")
+            return None
+
+    def _wall_get_params(self, group_id: str, count: int, resolved_id: int = None) -> Dict[str, Any]:
+        """Build wall.get parameters for a numeric group ID or a short name."""
+        params = {'count': count, 'filter': 'owner'}
+        if resolved_id is not None:
+            params['owner_id'] = -int(resolved_id)
+        elif group_id.isdigit():
+            params['owner_id'] = -int(group_id)
+        else:
+            params['domain'] = group_id
+        return params
+
+    def _format_posts(self, items: List[Dict[str, Any]], group_id) -> List[Post]:
+        """Filter out ads/pinned posts and format raw wall items."""
+        formatted_posts = []
+        for post in items:
+            # Skip ads and suggested posts
+            if post.get('marked_as_ads') or post.get('is_pinned'):
+                continue
+
+            # Get post text
+            text = post.get('text', '')
+
+            # Get post attachments (photos, videos, etc.)
+            attachments = []
+            if 'attachments' in post:
+                for att in post['attachments']:
+                    if att['type'] == 'photo':
+                        # Get the largest photo
+                        photo = att['photo']
+                        sizes = photo['sizes']
+                        largest_photo = max(sizes, key=lambda x: x['width'] * x['height'])
+                        attachments.append({
+                            'type': 'photo',
+                            'url': largest_photo['url']
+                        })
+                    elif att['type'] == 'video':
+                        attachments.append({
+                            'type': 'video',
+                            'url': f"https://vk.com/video{att['video']['owner_id']}_{att['video']['id']}"
+                        })
+
+            formatted_posts.append(Post(
+                post['id'],
+                text,
+                f"https://vk.com/wall{post.get('owner_id', f'-{group_id}')}_{post['id']}",
+                datetime.fromtimestamp(post['date']),
+                attachments
+            ))
+
+        return formatted_posts
+
+    def get_posts(self, group_id: str, count: int = 10, resolved_id: int = None) -> List[Post]:
+        """Get recent posts from a VK group."""
+        try:
+            # Unresolved short names are passed as `domain`, so no groups.getById lookup is needed
+            posts = self.api.wall.get(**self._wall_get_params(group_id, count, resolved_id))
+            return self._format_posts(posts['items'], group_id)
+
+        except Exception as e:
+            logger.error(f"Error getting posts from VK group {group_id}: {str(e)}")
+            return []
+
+    def _wall_get_batch(self, group_ids: List[str], count: int,
+                        resolved_ids: Dict[str, int]) -> Dict[str, Optional[List[Dict[str, Any]]]]:
+        """Get raw wall items of many groups, up to VK_EXECUTE_BATCH wall.get calls per request."""
+        results = {}
+        for start in range(0, len(group_ids), VK_EXECUTE_BATCH):
+            chunk = group_ids[start:start + VK_EXECUTE_BATCH]
+            calls = ', '.join(
+                f"API.wall.get({json.dumps(self._wall_get_params(group_id, count, resolved_ids.get(group_id)))})"
+                for group_id in chunk
+            )
+            try:
+                response = self.vk.method('execute', {'code': f"return [{calls}];"}, raw=True)
+            except RateLimitExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"Error executing VK batch of {len(chunk)} groups: {str(e)}")
+                for group_id in chunk:
+                    results[group_id] = None
+                continue
+
+            for error in response.get('execute_errors', []):
+                logger.error(f"VK execute error in {error.get('method')}: {error.get('error_msg')}")
+
+            # Failed calls come back as `false` in place of the wall.get response
+            for group_id, posts in zip(chunk, response.get('response') or []):
+                if not posts:
+                    logger.error(f"Error getting posts from VK group {group_id} in batch")
+                    results[group_id] = None
+                    continue
+                results[group_id] = posts['items']
+        return results
+
+    def get_posts_batch(self, group_ids: List[str], count: int = 10,
+                        resolved_ids: Dict[str, int] = None) -> Dict[str, List[Post]]:
+        """Get recent posts from many VK groups, up to VK_EXECUTE_BATCH wall.get calls per request.
+
+        Groups whose posts could not be fetched map to None.
+        """
+        items_by_group = self._wall_get_batch(group_ids, count, resolved_ids or {})
+        return {
+            group_id: None if items is None else self._format_posts(items, group_id)
+            for group_id, items in items_by_group.items()
+        }
+
+    def _iter_wall(self, group_id: str, last_post_id: Optional[int], resolved_id: int = None,
+                   first_items: List[Dict[str, Any]] = None, count: int = 10) -> Iterator[Dict[str, Any]]:
+        """Yield raw wall items newest first, paging back with `offset` until last_post_id is reached.
+
+        Sources without a cursor only get the first page. At most CATCHUP_MAX_POSTS items are
+        yielded; `first_items` is an already fetched first page of `count` items.
+        """
+        items = first_items
+        offset = 0
+        yielded = 0
+        oldest_id = None
+        while True:
+            if items is None:
+                params = self._wall_get_params(group_id, count, resolved_id)
+                params['offset'] = offset
+                items = self.api.wall.get(**params)['items']
+
+            for item in items:
+                # The pinned post sits on top of the wall regardless of its age
+                if item.get('is_pinned'):
+                    continue
+                if last_post_id is not None and item['id'] <= last_post_id:
+                    return
+                # New posts shift offsets while paging, so skip anything already yielded
+                if oldest_id is not None and item['id'] >= oldest_id:
+                    continue
+                oldest_id = item['id']
+                yield item
+                yielded += 1
+                if yielded >= CATCHUP_MAX_POSTS:
+                    logger.warning(f"VK group {group_id} has more than {CATCHUP_MAX_POSTS} new posts, "
+                                   f"older ones are skipped")
+                    return
+
+            if last_post_id is None or len(items) < count:
+                return
+            offset += len(items)
+            count = VK_PAGE_SIZE
+            items = None
+
+    def collect_new_posts(self, group_id: str, last_post_id: Optional[int], resolved_id: int = None,
+                          first_items: List[Dict[str, Any]] = None) -> List[Post]:
+        """New formatted posts newest first, catching up on everything since last_post_id.
+
+        The catch-up is returned whole: pages come newest first, and the cursor may only move
+        to the newest post once every older one down to last_post_id is delivered. _iter_wall
+        stops paging at CATCHUP_MAX_POSTS, so the list holds at most that many posts.
+        """
+        return self._format_posts(list(self._iter_wall(group_id, last_post_id, resolved_id, first_items)), group_id)
+
+    def get_new_posts(self, group_id: str, last_post_id: int, resolved_id: int = None) -> List[Post]:
+        """Get only new posts since the last post ID, raising FetchError on failure."""
+        try:
+            return self.collect_new_posts(group_id, last_post_id, resolved_id)
+        except RateLimitExceeded:
+            raise
+        except Exception as e:
+            raise FetchError(f"Error getting posts from VK group {group_id}: {str(e)}") from e
+
+    def get_new_posts_batch(self, sources: List[Any]) -> Dict[str, Optional[List[Post]]]:
+        """Get new posts for many VK sources using batched execute calls; failed sources map to None.
+
+        Only groups that posted more than a page since the last poll need extra wall.get calls;
+        each group's catch-up is collected whole (see collect_new_posts), so a batch holds at most
+        CATCHUP_MAX_POSTS posts per group. Running out of quota while paging raises
+        RateLimitExceeded for the whole batch, which is then polled again once the quota resets.
+        """
+        items_by_group = self._wall_get_batch(
+            [source.id for source in sources],
+            10,
+            {source.id: source.resolved_id for source in sources}
+        )
+        results = {}
+        for source in sources:
+            items = items_by_group.get(source.id)
+            if items is None:
+                results[source.id] = None
+                continue
+            try:
+                results[source.id] = self.collect_new_posts(
+                    source.id, source.last_post_id, source.resolved_id, first_items=items
+                )
+            except RateLimitExceeded:
+                # Not a failure of the group: no result is better than one that would trip its breaker
+                raise
+            except Exception as e:
+                logger.error(f"Error catching up on VK group {source.id}: {str(e)}")
+                results[source.id] = None
+        return results
+
+class TwitterParser:
+    def __init__(self, bearer_token: str = TWITTER_BEARER_TOKEN, consumer_key: str = TWITTER_API_KEY,
+                 consumer_secret: str = TWITTER_API_SECRET, access_token: str = TWITTER_ACCESS_TOKEN,
+                 access_token_secret: str = TWITTER_ACCESS_TOKEN_SECRET):
+        """Initialize Twitter API v2 client; no request is made until the first call."""
+        self.client = RateLimitedTwitterClient(
+            bearer_token=bearer_token,  # Bearer token for v2 API
+            consumer_key=consumer_key,
+            consumer_secret=consumer_secret,
+            access_token=access_token,
+            access_token_secret=access_token_secret,
+            wait_on_rate_limit=False  # Throttling is handled by rate_limiter without blocking
+        )
+        mount_timeouts(self.client.session)
+
+    def verify(self) -> str:
+        """Check the credentials and return the account name; raises if they don't work."""
+        try:
+            test_user = self.client.get_me()
+        except tweepy.TweepyException as e:
+            if getattr(e, 'response', None) is not None:
+                logger.error(f"Twitter credential check failed with status {e.response.status_code}: "
+                             f"{e.response.text}")
+            raise
+        if not test_user.data:
+            raise Exception("Could not verify Twitter API credentials")
+        logger.info(f"Twitter API v2 credentials verified. Connected as: @{test_user.data.username}")
+        return f"@{test_user.data.username}"
+
+    def get_user_info(self, username):
+        """Get Twitter user information"""
+        try:
+            # Remove @ if present
+            username = username.lstrip('@')
+            logger.info(f"Fetching Twitter user info for: {username}")
+
+            # Get user by username using v2 API
+            logger.debug(f"Making API v2 call to get user info for: {username}")
+            user = self.client.get_user(
+                username=username,
+                user_fields=['id', 'name', 'username', 'created_at']
+            )
+
+            if not user.data:
+                logger.error(f"User not found: {username}")
+                return None
+
+            logger.info(f"Successfully found user: {user.data.name} (@{user.data.username})")
+            return user.data
+        except tweepy.TweepyException as e:
+            logger.error(f"Twitter API error getting user info: {str(e)}")
+            if hasattr(e, 'response'):
+                logger.error(f"Response status code: {e.response.status_code}")
+                logger.error(f"Response text: {e.response.text}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error getting Twitter user info: {str(e)}")
+            return None
+
+    def iter_tweets(self, username, user_id, since_id=None, count=10):
+        """Yield tweets newest first, following pagination tokens until since_id is reached.
+
+        The since_id filter is applied server-side. Without a cursor only the latest `count`
+        tweets are returned, and at most CATCHUP_MAX_POSTS tweets are yielded.
+        """
+        pagination_token = None
+        yielded = 0
+        while True:
+            # Get user's tweets using v2 API; it returns 5 to 100 per page
+            tweets = self.client.get_users_tweets(
+                user_id,
+                max_results=TWITTER_PAGE_SIZE if since_id else min(max(count, 5), TWITTER_PAGE_SIZE),
+                since_id=since_id,
+                pagination_token=pagination_token,
+                tweet_fields=['created_at', 'text', 'id'],
+                exclude=['retweets', 'replies']
+            )
+
+            for tweet in tweets.data or []:
+                if not since_id and yielded >= count:
+                    return
+                yield Post(tweet.id, tweet.text, f"https://twitter.com/{username}/status/{tweet.id}", tweet.created_at)
+                yielded += 1
+                if yielded >= CATCHUP_MAX_POSTS:
+                    logger.warning(f"Twitter user {username} has more than {CATCHUP_MAX_POSTS} new tweets, "
+                                   f"older ones are skipped")
+                    return
+
+            pagination_token = (tweets.meta or {}).get('next_token')
+            if not since_id or not pagination_token:
+                return
+
+    def fetch_tweets(self, username, last_tweet_id=None, user_id=None, count=10):
+        """Get new tweets from Twitter user, or the latest `count` without a cursor; raises FetchError on failure"""
+        try:
+            # Remove @ if present
+            username = username.lstrip('@')
+            logger.info(f"Fetching tweets for user: {username}")
+
+            # Look up the user ID only when the caller has no cached one
+            if user_id is None:
+                user = self.client.get_user(username=username)
+                if not user.data:
+                    raise FetchError(f"User not found: {username}")
+                user_id = user.data.id
+
+            new_tweets = list(self.iter_tweets(username, user_id, last_tweet_id, count))
+            logger.info(f"Successfully fetched {len(new_tweets)} tweets")
+            return new_tweets
+        except (FetchError, RateLimitExceeded):
+            raise
+        except tweepy.TweepyException as e:
+            if getattr(e, 'response', None) is not None:
+                logger.error(f"Response status code: {e.response.status_code}")
+                logger.error(f"Response text: {e.response.text}")
+            raise FetchError(f"Twitter API error getting tweets for {username}: {str(e)}") from e
+        except Exception as e:
+            raise FetchError(f"Unexpected error getting tweets for {username}: {str(e)}") from e
+
+    def get_tweets(self, username, last_tweet_id=None, user_id=None):
+        """Get new tweets from Twitter user"""
+        try:
+            return self.fetch_tweets(username, last_tweet_id, user_id)
+        except (FetchError, RateLimitExceeded) as e:
+            logger.error(str(e))
+            return []
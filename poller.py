@@ -0,0 +1,309 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import (
+    POLL_CONCURRENCY,
+    FETCH_TIMEOUT,
+    POLL_INTERVAL,
+    POLL_MIN_INTERVAL,
+    POLL_MAX_INTERVAL,
+    POLL_JITTER,
+    POLL_ERROR_BACKOFF_MAX,
+    SCHEDULER_TICK,
+    BATCH_FILL_WINDOW,
+    logger
+)
+from storage import Source
+from ratelimit import rate_limiter, RateLimitExceeded
+from metrics import FETCH_SECONDS, POLL_ERRORS
+from health import platform_health
+from adapters import AdapterRegistry, BatchFetcher, Post, SourceAdapter
+
+class PollResult:
+    """Outcome of polling one source: new posts, or the error that prevented fetching them.
+
+    `retry_at` is set (as Unix time) when the platform quota ran out and the source
+    should simply be polled again once it resets.
+    """
+    __slots__ = ('source_type', 'source', 'posts', 'error', 'retry_at')
+
+    def __init__(self, source_type: str, source: Source, posts: List[Post],
+                 error: Optional[str] = None, retry_at: Optional[float] = None):
+        self.source_type = source_type
+        self.source = source
+        self.posts = posts
+        self.error = error
+        self.retry_at = retry_at
+
+class Poller:
+    """Poll sources through their adapters; blocking calls run in a worker pool with global and per-platform limits."""
+
+    def __init__(self, adapters: AdapterRegistry):
+        self.adapters = adapters
+        # Extra threads so abandoned (timed out) calls don't starve the pool
+        self.executor = ThreadPoolExecutor(
+            max_workers=POLL_CONCURRENCY * 2,
+            thread_name_prefix='poller'
+        )
+        # Semaphores are created lazily so they bind to the running event loop
+        self._global_semaphore = None
+        self._platform_semaphores = {}
+
+    def _semaphores(self, platform: str) -> Tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        """Get the global and platform semaphores, creating them on first use."""
+        if self._global_semaphore is None:
+            self._global_semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+        if platform not in self._platform_semaphores:
+            # Adapters register after the poller is created, since they call its `run`
+            adapter = self.adapters.get(platform)
+            limit = adapter.concurrency if adapter is not None else POLL_CONCURRENCY
+            self._platform_semaphores[platform] = asyncio.Semaphore(limit)
+        return self._global_semaphore, self._platform_semaphores[platform]
+
+    async def run(self, platform: str, func: Callable, *args, timeout: float = FETCH_TIMEOUT) -> Any:
+        """Run a parser call within the concurrency limits; blocking calls go to the worker pool."""
+        global_semaphore, platform_semaphore = self._semaphores(platform)
+        async with platform_semaphore:
+            async with global_semaphore:
+                if asyncio.iscoroutinefunction(func):
+                    return await asyncio.wait_for(func(*args), timeout)
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self.executor, lambda: func(*args))
+                return await asyncio.wait_for(future, timeout)
+
+    def _blocked_until(self, adapter: SourceAdapter) -> float:
+        # Until its first credential check is over, leave the platform's workers to it: fetches queued
+        # behind the quota would hold the check up for as long as they wait
+        if platform_health.is_checking(adapter.source_type):
+            return time.time() + SCHEDULER_TICK
+        # Don't occupy a worker for a platform that is out of quota or whose credentials failed
+        return (rate_limiter.blocked_until(adapter.endpoint or adapter.source_type)
+                or platform_health.unavailable_until(adapter.source_type))
+
+    async def fetch(self, source_type: str, source: Source) -> PollResult:
+        """Fetch new posts for a single source, never raising."""
+        started = time.monotonic()
+        adapter = self.adapters.get(source_type)
+        if adapter is None:
+            return PollResult(source_type, source, [], f"Unknown source type: {source_type}")
+        blocked_until = self._blocked_until(adapter)
+        if blocked_until:
+            return PollResult(source_type, source, [], retry_at=blocked_until)
+        try:
+            posts = await adapter.fetch_new(source)
+            elapsed = time.monotonic() - started
+            FETCH_SECONDS.observe(elapsed, source_type)
+            logger.debug(f"Fetched {len(posts)} posts from {source_type}:{source.id} in {elapsed:.2f}s")
+            return PollResult(source_type, source, posts)
+        except RateLimitExceeded as e:
+            POLL_ERRORS.inc(source_type, 'rate_limit')
+            logger.warning(f"Postponing {source_type} source {source.id}: {e}")
+            return PollResult(source_type, source, [], retry_at=e.retry_at)
+        except asyncio.TimeoutError:
+            POLL_ERRORS.inc(source_type, 'timeout')
+            error = f"Timed out fetching {source_type} source {source.id} after {FETCH_TIMEOUT}s"
+        except Exception as e:
+            POLL_ERRORS.inc(source_type, 'error')
+            error = f"Error fetching {source_type} source {source.id}: {e}"
+        logger.error(error)
+        return PollResult(source_type, source, [], error)
+
+    async def fetch_batch(self, adapter: SourceAdapter, sources: List[Source]) -> List[PollResult]:
+        """Fetch new posts for a chunk of sources with one batched call, never raising."""
+        started = time.monotonic()
+        source_type = adapter.source_type
+        blocked_until = self._blocked_until(adapter)
+        if blocked_until:
+            return [PollResult(source_type, source, [], retry_at=blocked_until) for source in sources]
+        try:
+            posts_by_id = await adapter.fetch_new_batch(sources)
+            elapsed = time.monotonic() - started
+            FETCH_SECONDS.observe(elapsed, source_type)
+            logger.debug(f"Fetched {source_type} batch of {len(sources)} sources in {elapsed:.2f}s")
+        except RateLimitExceeded as e:
+            POLL_ERRORS.inc(source_type, 'rate_limit', amount=len(sources))
+            logger.warning(f"Postponing {source_type} batch of {len(sources)} sources: {e}")
+            return [PollResult(source_type, source, [], retry_at=e.retry_at) for source in sources]
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out fetching {source_type} batch of {len(sources)} sources after {FETCH_TIMEOUT}s")
+            posts_by_id = {}
+        except Exception as e:
+            logger.error(f"Error fetching {source_type} batch of {len(sources)} sources: {e}")
+            posts_by_id = {}
+
+        results = []
+        for source in sources:
+            posts = posts_by_id.get(source.id)
+            if posts is None:
+                POLL_ERRORS.inc(source_type, 'error')
+                results.append(PollResult(source_type, source, [], f"Error fetching {source_type} source {source.id}"))
+            else:
+                results.append(PollResult(source_type, source, posts))
+        return results
+
+    async def fetch_all(self, sources: Dict[str, List[Source]]) -> List[PollResult]:
+        """Fetch all given sources concurrently."""
+        started = time.monotonic()
+
+        # Adapters that support batching get their sources in chunks, everything else one by one
+        chunks = []
+        jobs = []
+        for source_type, items in sources.items():
+            adapter = self.adapters.get(source_type)
+            items = list(items)
+            if isinstance(adapter, BatchFetcher) and adapter.batch_size > 1:
+                chunks.extend(
+                    (adapter, items[i:i + adapter.batch_size])
+                    for i in range(0, len(items), adapter.batch_size)
+                )
+            else:
+                jobs.extend((source_type, source) for source in items)
+
+        batch_results, results = await asyncio.gather(
+            asyncio.gather(*(self.fetch_batch(adapter, chunk) for adapter, chunk in chunks)),
+            asyncio.gather(*(self.fetch(source_type, source) for source_type, source in jobs))
+        )
+
+        polled = [result for chunk_results in batch_results for result in chunk_results]
+        polled.extend(results)
+
+        logger.info(f"Polled {len(polled)} sources in {time.monotonic() - started:.2f}s "
+                    f"({len(chunks)} batch requests)")
+        return polled
+
+class SourceState:
+    """Adaptive polling state of one source."""
+    __slots__ = ('interval', 'due_at', 'rate', 'errors', 'last_polled_at')
+
+    def __init__(self, due_at: float):
+        self.interval = POLL_INTERVAL
+        self.due_at = due_at
+        self.rate = None  # Smoothed posts per second
+        self.errors = 0
+        self.last_polled_at = None
+
+class SourceSchedule:
+    """Priority queue of per-source due times with intervals adapted to posting frequency.
+
+    A source that posts often is polled close to POLL_MIN_INTERVAL, a dormant one drifts
+    towards POLL_MAX_INTERVAL, and failing sources back off exponentially up to
+    POLL_ERROR_BACKOFF_MAX. Due times are jittered by POLL_JITTER so requests spread out.
+    `batch_sizes` maps source types fetched in batches to their batch size.
+    """
+
+    def __init__(self, batch_sizes: Optional[Dict[str, int]] = None):
+        self.batch_sizes = {source_type: size for source_type, size in (batch_sizes or {}).items() if size > 1}
+        self._states: Dict[Tuple[str, str], SourceState] = {}
+        self._heap: List[Tuple[float, int, Tuple[str, str]]] = []
+        self._seq = itertools.count()
+        self._in_flight = set()
+
+    def _push(self, key: Tuple[str, str], state: SourceState):
+        heapq.heappush(self._heap, (state.due_at, next(self._seq), key))
+
+    def _jitter(self, interval: float) -> float:
+        return interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+    def sync(self, sources: Dict[str, List[Source]]):
+        """Schedule newly added sources right away and forget removed ones."""
+        now = time.monotonic()
+        current = set()
+        for source_type, items in sources.items():
+            for source in items:
+                key = (source_type, source.id)
+                current.add(key)
+                if key not in self._states:
+                    state = SourceState(now)
+                    self._states[key] = state
+                    self._push(key, state)
+        for key in set(self._states) - current:
+            del self._states[key]
+
+    def pop_due(self) -> List[Tuple[str, str]]:
+        """Take every source that is due now.
+
+        The last batch of a batched source type is filled up with sources of that type due
+        within the next SCHEDULER_TICK or BATCH_FILL_WINDOW of their interval, which would
+        otherwise take a request of their own moments later.
+        """
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, _, key = heapq.heappop(self._heap)
+            state = self._states.get(key)
+            # Skip entries of removed sources and stale heap entries
+            if state is None or state.due_at != due_at or key in self._in_flight:
+                continue
+            self._in_flight.add(key)
+            due.append(key)
+        if due and self.batch_sizes:
+            self._fill_batches(due, now)
+        return due
+
+    def _fill_batches(self, due: List[Tuple[str, str]], now: float):
+        counts = Counter(source_type for source_type, _ in due)
+        missing = {source_type: -count % self.batch_sizes[source_type]
+                   for source_type, count in counts.items() if source_type in self.batch_sizes}
+        if not any(missing.values()):
+            return
+        # Their heap entries go stale once they are rescheduled after this poll
+        candidates = sorted(
+            (state.due_at, key) for key, state in self._states.items()
+            if missing.get(key[0]) and key not in self._in_flight
+            and state.due_at - now <= max(SCHEDULER_TICK, BATCH_FILL_WINDOW * state.interval)
+        )
+        for _, key in candidates:
+            if missing[key[0]]:
+                missing[key[0]] -= 1
+                self._in_flight.add(key)
+                due.append(key)
+
+    def seconds_until_next(self) -> float:
+        """Seconds until the earliest source is due."""
+        if not self._heap:
+            return POLL_MAX_INTERVAL
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def complete(self, source_type: str, source_id: str, new_posts: Optional[int] = None,
+                 error: Optional[str] = None, retry_at: Optional[float] = None):
+        """Reschedule a source after polling it.
+
+        `new_posts` is the number of new posts found, or None if the source was skipped.
+        `retry_at` postpones a rate-limited source until its quota resets (Unix time).
+        """
+        key = (source_type, source_id)
+        self._in_flight.discard(key)
+        state = self._states.get(key)
+        if state is None:
+            return
+
+        now = time.monotonic()
+        if retry_at is not None:
+            # Not the source's fault: keep its interval and error count, just wait for the quota
+            state.due_at = now + max(0.0, retry_at - time.time()) + random.uniform(0, POLL_MIN_INTERVAL * POLL_JITTER)
+            self._push(key, state)
+            return
+        if error is not None:
+            state.errors += 1
+            delay = min(POLL_ERROR_BACKOFF_MAX, state.interval * 2 ** state.errors)
+        else:
+            state.errors = 0
+            if new_posts is not None:
+                if state.last_polled_at is not None:
+                    elapsed = max(now - state.last_polled_at, 1.0)
+                    observed = new_posts / elapsed
+                    state.rate = observed if state.rate is None else 0.3 * observed + 0.7 * state.rate
+                    # Aim for roughly one new post per poll
+                    interval = 1 / state.rate if state.rate > 0 else POLL_MAX_INTERVAL
+                    state.interval = min(POLL_MAX_INTERVAL, max(POLL_MIN_INTERVAL, interval))
+                state.last_polled_at = now
+            delay = state.interval
+
+        state.due_at = now + self._jitter(delay)
+        self._push(key, state)
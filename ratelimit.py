@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config import RATE_LIMIT_MAX_WAIT, VK_REQUESTS_PER_SECOND, logger
+
+class RateLimitExceeded(Exception):
+    """Raised instead of sleeping when an endpoint has no quota left."""
+
+    def __init__(self, endpoint: str, retry_at: float):
+        super().__init__(f"Rate limit exceeded for {endpoint}, retry at {time.ctime(retry_at)}")
+        self.endpoint = endpoint
+        self.retry_at = retry_at  # Unix time
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursting up to `capacity`.
+
+    Callers reserve a token and then wait the returned delay, so concurrent callers
+    are spaced out without holding a lock while they wait.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float = None) -> Optional[float]:
+        """Take a token and return the seconds to wait before using it.
+
+        Returns None without taking a token if the wait would exceed max_wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    async def acquire(self):
+        """Wait on the event loop until a token is available and take it."""
+        await asyncio.sleep(self.reserve())
+
+class EndpointQuota:
+    """Local token bucket of one endpoint plus the quota the server last reported."""
+    __slots__ = ('bucket', 'limit', 'remaining', 'reset_at', 'blocked_until', 'calls')
+
+    def __init__(self, rate: float, capacity: float):
+        self.bucket = TokenBucket(rate, capacity)
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.blocked_until = 0.0
+        self.calls = 0
+
+class RateLimiter:
+    """Per-endpoint rate limiting shared by the VK and Twitter parsers.
+
+    Parser calls run in worker threads: `acquire` waits at most RATE_LIMIT_MAX_WAIT
+    for a token and otherwise raises RateLimitExceeded, so the caller can postpone
+    the source instead of sleeping until the quota window resets.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, EndpointQuota] = {}
+        self._defaults: Dict[str, tuple] = {}
+
+    def configure(self, endpoint: str, rate: float, capacity: float = None):
+        """Set the request rate (per second) of an endpoint or endpoint prefix."""
+        self._defaults[endpoint] = (rate, capacity)
+
+    def _quota(self, endpoint: str) -> EndpointQuota:
+        with self._lock:
+            quota = self._endpoints.get(endpoint)
+            if quota is None:
+                prefix = max((p for p in self._defaults if endpoint.startswith(p)), key=len, default=None)
+                rate, capacity = self._defaults.get(prefix, (1.0, None))
+                quota = self._endpoints[endpoint] = EndpointQuota(rate, capacity)
+            return quota
+
+    def blocked_until(self, endpoint: str) -> float:
+        """Unix time until which the endpoint has no quota, or 0."""
+        quota = self._quota(endpoint)
+        return quota.blocked_until if quota.blocked_until > time.time() else 0.0
+
+    def acquire(self, endpoint: str, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        """Take a token for a call, waiting briefly; raise RateLimitExceeded if quota is out."""
+        quota = self._quota(endpoint)
+        now = time.time()
+        if quota.blocked_until > now:
+            raise RateLimitExceeded(endpoint, quota.blocked_until)
+        wait = quota.bucket.reserve(max_wait)
+        if wait is None:
+            raise RateLimitExceeded(endpoint, now + max_wait)
+        if wait:
+            time.sleep(wait)
+        quota.calls += 1
+
+    def update(self, endpoint: str, limit: int = None, remaining: int = None, reset_at: float = None):
+        """Record the quota reported by the server; block the endpoint when it is used up."""
+        quota = self._quota(endpoint)
+        quota.limit = limit
+        quota.remaining = remaining
+        quota.reset_at = reset_at
+        if remaining is not None and remaining <= 0 and reset_at:
+            self.block(endpoint, reset_at)
+
+    def update_from_headers(self, endpoint: str, headers: Any):
+        """Record quota from Twitter-style x-rate-limit-* response headers."""
+        try:
+            limit = headers.get('x-rate-limit-limit')
+            remaining = headers.get('x-rate-limit-remaining')
+            reset_at = headers.get('x-rate-limit-reset')
+            if remaining is None:
+                return
+            self.update(
+                endpoint,
+                int(limit) if limit is not None else None,
+                int(remaining),
+                float(reset_at) if reset_at is not None else None
+            )
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Could not parse rate limit headers for {endpoint}: {e}")
+
+    def block(self, endpoint: str, until: float):
+        """Refuse calls to an endpoint until the given Unix time."""
+        quota = self._quota(endpoint)
+        if until > quota.blocked_until:
+            quota.blocked_until = until
+            logger.warning(f"Quota of {endpoint} is exhausted until {time.ctime(until)}")
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Current quota state of every endpoint seen so far."""
+        now = time.time()
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        return {
+            endpoint: {
+                'rate': quota.bucket.rate,
+                'calls': quota.calls,
+                'limit': quota.limit,
+                'remaining': quota.remaining,
+                'reset_in': max(0, int(quota.reset_at - now)) if quota.reset_at else None,
+                'blocked_for': max(0, int(quota.blocked_until - now))
+            }
+            for endpoint, quota in sorted(endpoints.items())
+        }
+
+rate_limiter = RateLimiter()
+# VK allows 3 requests per second per user token; execute counts as one request
+rate_limiter.configure('vk', VK_REQUESTS_PER_SECOND, 1)
+# Twitter v2 user-context limits per 15-minute window
+rate_limiter.configure('twitter:users_tweets', 900 / 900, 5)
+rate_limiter.configure('twitter:user_lookup', 900 / 900, 5)
+rate_limiter.configure('twitter:me', 75 / 900, 1)
@@ -0,0 +1,344 @@
+import hashlib
+import html
+import json
+import re
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import aiohttp
+
+from config import (
+    CATCHUP_MAX_POSTS,
+    HTTP_TIMEOUT,
+    RSS_CONCURRENCY,
+    RSS_CONNECTIONS_PER_HOST,
+    RSS_KEEPALIVE_TIMEOUT,
+    RSS_MAX_FEED_BYTES,
+    RSS_SEEN_GUIDS,
+    RSS_FIRST_POSTS,
+    RSS_TEXT_LIMIT,
+    RSS_USER_AGENT,
+    logger
+)
+from ratelimit import RateLimitExceeded
+from metrics import API_REQUEST_SECONDS, API_ERRORS
+from adapters import Post
+
+CHUNK_SIZE = 64 * 1024
+FEED_ROOTS = {'rss', 'feed', 'RDF'}  # RSS 2.0, Atom, RSS 1.0
+ITEM_TAGS = {'item', 'entry'}
+CHANNEL_TAGS = {'channel', 'feed'}
+RDF_ABOUT = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about'
+ACCEPT = 'application/rss+xml, application/atom+xml, application/xml;q=0.9, text/xml;q=0.8, */*;q=0.1'
+
+TAG_RE = re.compile(r'<[^>]*>')
+BREAK_RE = re.compile(r'<br\s*/?>|</p>|</div>|</li>', re.IGNORECASE)
+SPACE_RE = re.compile(r'[ \t\r\f\v\xa0]+')
+
+class FeedError(Exception):
+    """Raised when a feed could not be fetched or isn't RSS or Atom."""
+
+class FeedState:
+    """What is remembered about a feed between polls, saved as JSON with the source.
+
+    `etag` and `last_modified` make the next request conditional; `guids` are hashes
+    of the item GUIDs already seen, newest first.
+    """
+    __slots__ = ('etag', 'last_modified', 'guids')
+
+    def __init__(self, etag: Optional[str] = None, last_modified: Optional[str] = None, guids: List[str] = ()):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.guids = list(guids)
+
+    @classmethod
+    def load(cls, data: Optional[str]) -> 'FeedState':
+        if not data:
+            return cls()
+        try:
+            values = json.loads(data)
+        except ValueError:
+            logger.warning("Discarding unreadable feed state")
+            return cls()
+        return cls(values.get('etag'), values.get('last_modified'), values.get('guids', []))
+
+    def dump(self) -> str:
+        return json.dumps({'etag': self.etag, 'last_modified': self.last_modified, 'guids': self.guids})
+
+def guid_hash(guid: str) -> str:
+    return hashlib.blake2b(guid.encode('utf-8'), digest_size=8).hexdigest()
+
+def _local(tag) -> str:
+    # Comments and processing instructions have non-string tags
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+def html_to_text(value: str) -> str:
+    """Plain text of an HTML fragment, keeping paragraph breaks."""
+    text = html.unescape(TAG_RE.sub('', BREAK_RE.sub('\n', value)))
+    lines = (SPACE_RE.sub(' ', line).strip() for line in text.split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+def _parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return parsedate_to_datetime(value)  # RSS: RFC 822
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(value)  # Atom and dc:date: RFC 3339
+    except ValueError:
+        return None
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit].rstrip() + '…'
+
+def item_to_post(item: ET.Element) -> Optional[Post]:
+    """Turn an RSS item or Atom entry into a Post whose id is the item's GUID."""
+    fields: Dict[str, str] = {}
+    link = None
+    photos = []
+    for child in item:
+        name = _local(child.tag)
+        url = child.get('url')
+        if url and (child.get('type', '').startswith('image/') or child.get('medium') == 'image'):
+            # enclosure and media:content images
+            photos.append(url)
+        elif name == 'link':
+            href = child.get('href')
+            if href is None:
+                link = link or (child.text or '').strip()
+            elif child.get('rel', 'alternate') == 'alternate' and not link:
+                link = href
+        elif name not in fields:
+            fields[name] = ''.join(child.itertext()).strip()
+
+    title = html_to_text(fields.get('title', ''))
+    body = html_to_text(fields.get('description') or fields.get('summary')
+                        or fields.get('encoded') or fields.get('content') or '')
+    date = fields.get('pubDate') or fields.get('published') or fields.get('updated') or fields.get('date')
+    guid = fields.get('guid') or fields.get('id') or item.get(RDF_ABOUT) or link
+    if not guid:
+        if not title:
+            return None
+        guid = f"{title}|{date or ''}"
+
+    text = title
+    if body and body != title:
+        text = f"{title}\n\n{body}" if title else body
+    return Post(
+        guid,
+        _truncate(text, RSS_TEXT_LIMIT),
+        link or '',
+        _parse_date(date),
+        [{'type': 'photo', 'url': url} for url in dict.fromkeys(photos)]
+    )
+
+class FeedParser:
+    """Incremental RSS/Atom parser fed with raw chunks as they arrive.
+
+    Every item is returned as soon as its closing tag is read and then detached from
+    the tree, so memory is bounded by the largest item rather than by the feed.
+    """
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._stack: List[ET.Element] = []
+        self.title = None
+
+    def feed(self, data: bytes) -> List[Post]:
+        try:
+            self._parser.feed(data)
+        except ET.ParseError as e:
+            raise FeedError(f"Invalid XML: {e}") from e
+        return self._read_events()
+
+    def close(self) -> List[Post]:
+        try:
+            self._parser.close()
+        except ET.ParseError as e:
+            raise FeedError(f"Invalid XML: {e}") from e
+        return self._read_events()
+
+    def _read_events(self) -> List[Post]:
+        posts = []
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                if not self._stack and _local(element.tag) not in FEED_ROOTS:
+                    raise FeedError(f"Not an RSS or Atom feed: <{_local(element.tag)}>")
+                self._stack.append(element)
+                continue
+
+            self._stack.pop()
+            name = _local(element.tag)
+            if name in ITEM_TAGS:
+                post = item_to_post(element)
+                if post is not None:
+                    posts.append(post)
+                if self._stack:
+                    self._stack[-1].remove(element)
+            elif name == 'title' and self.title is None and self._stack \
+                    and _local(self._stack[-1].tag) in CHANNEL_TAGS:
+                self.title = html_to_text(element.text or '') or None
+        return posts
+
+class FeedUpdate:
+    """Result of fetching a feed: its title, items not seen before and the state to save."""
+    __slots__ = ('title', 'posts', 'state')
+
+    def __init__(self, title: Optional[str], posts: List[Post], state: FeedState):
+        self.title = title
+        self.posts = posts
+        self.state = state
+
+def _retry_at(value: Optional[str]) -> float:
+    """Unix time from a Retry-After header given in seconds or as an HTTP date."""
+    if value:
+        if value.strip().isdigit():
+            return time.time() + int(value)
+        date = _parse_date(value)
+        if date is not None:
+            return date.timestamp()
+    return time.time() + 600
+
+class RSSParser:
+    """Fetches RSS and Atom feeds over one keep-alive connection pool.
+
+    Requests carry the ETag and Last-Modified the feed sent last time, so an unchanged
+    feed costs a 304 without a body. Responses are parsed while they stream in, and
+    items already seen are dropped as soon as they are read.
+    """
+
+    def __init__(self):
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Created on first use so it binds to the running event loop
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit=RSS_CONCURRENCY,
+                limit_per_host=RSS_CONNECTIONS_PER_HOST,
+                keepalive_timeout=RSS_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(sock_connect=HTTP_TIMEOUT, sock_read=HTTP_TIMEOUT),
+                headers={'User-Agent': RSS_USER_AGENT, 'Accept': ACCEPT}
+            )
+        return self._session
+
+    async def close(self):
+        """Close the connection pool."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def fetch(self, url: str, state: Optional[FeedState] = None,
+                    limit: int = CATCHUP_MAX_POSTS) -> Optional[FeedUpdate]:
+        """Fetch a feed; None if it didn't change since `state` was saved.
+
+        With a state, up to `limit` items whose GUIDs it hasn't seen are returned and the
+        whole feed is read to update the GUIDs. Without one, the first `limit` items are
+        returned and the download stops there.
+        """
+        headers = {}
+        if state is not None:
+            if state.etag:
+                headers['If-None-Match'] = state.etag
+            if state.last_modified:
+                headers['If-Modified-Since'] = state.last_modified
+        seen = set(state.guids) if state is not None else set()
+
+        endpoint = 'rss'
+        try:
+            with API_REQUEST_SECONDS.time(endpoint):
+                async with self._get_session().get(url, headers=headers) as response:
+                    if response.status == 304:
+                        return None
+                    if response.status in (429, 503) and 'Retry-After' in response.headers:
+                        API_ERRORS.inc(endpoint, 'rate_limit')
+                        raise RateLimitExceeded(f"rss:{urlparse(url).hostname}",
+                                                _retry_at(response.headers['Retry-After']))
+                    if response.status >= 400:
+                        API_ERRORS.inc(endpoint, f"http_{response.status}")
+                        raise FeedError(f"HTTP {response.status} from {url}")
+
+                    parser = FeedParser()
+                    posts = []
+                    guids = []
+                    current = set()
+                    size = 0
+                    done = False
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > RSS_MAX_FEED_BYTES:
+                            API_ERRORS.inc(endpoint, 'too_large')
+                            raise FeedError(f"Feed {url} is larger than {RSS_MAX_FEED_BYTES} bytes")
+                        done = self._collect(parser.feed(chunk), seen, state is not None, limit, posts, guids, current)
+                        if done:
+                            break
+                    if not done:
+                        self._collect(parser.close(), seen, state is not None, limit, posts, guids, current)
+                    etag = response.headers.get('ETag')
+                    last_modified = response.headers.get('Last-Modified')
+        except (RateLimitExceeded, FeedError):
+            raise
+        except Exception as e:
+            API_ERRORS.inc(endpoint, type(e).__name__)
+            raise
+
+        if state is None:
+            return FeedUpdate(parser.title, posts, FeedState(etag, last_modified))
+        # Items still in the feed first, then older ones it dropped, in case they come back
+        guids.extend(guid for guid in state.guids if guid not in current)
+        return FeedUpdate(parser.title, posts, FeedState(etag, last_modified, guids[:RSS_SEEN_GUIDS]))
+
+    @staticmethod
+    def _collect(items: List[Post], seen: set, tracking: bool, limit: int,
+                 posts: List[Post], guids: List[str], current: set) -> bool:
+        """Keep the new items of a parsed chunk; returns True once the rest of the feed isn't needed."""
+        for post in items:
+            guid = guid_hash(post.id)
+            if tracking:
+                if guid in current:
+                    continue
+                current.add(guid)
+                guids.append(guid)
+            if guid not in seen and len(posts) < limit:
+                posts.append(post)
+        return not tracking and len(posts) >= limit
+
+    async def get_feed_title(self, url: str) -> Optional[str]:
+        """Check that a URL serves a feed and return its title; None if it doesn't."""
+        if urlparse(url).scheme not in ('http', 'https'):
+            return None
+        try:
+            update = await self.fetch(url, limit=1)
+        except FeedError as e:
+            logger.error(f"Error reading feed {url}: {e}")
+            return None
+        return update.title or url
+
+    async def get_posts(self, url: str, count: int = 10) -> List[Post]:
+        """Get the latest items of a feed regardless of what was seen."""
+        return (await self.fetch(url, limit=count)).posts
+
+    async def get_new_posts(self, url: str, state: Optional[str]) -> Tuple[List[Post], str]:
+        """Get items not delivered yet and the feed state to save once they are.
+
+        A feed polled for the first time only yields its RSS_FIRST_POSTS latest items.
+        """
+        feed_state = FeedState.load(state)
+        first_poll = not feed_state.guids
+        update = await self.fetch(url, feed_state, RSS_FIRST_POSTS if first_poll else CATCHUP_MAX_POSTS)
+        if update is None:
+            return [], state
+        if len(update.posts) >= CATCHUP_MAX_POSTS:
+            logger.warning(f"Feed {url} has more than {CATCHUP_MAX_POSTS} new items, the rest are skipped")
+        return update.posts, update.state.dump()
@@ -0,0 +1,69 @@
+import asyncio
+import bisect
+import hashlib
+from typing import Iterable, List, Optional
+
+from config import SHARD_VNODES, WORKER_HEARTBEAT_INTERVAL, WORKER_LEASE_TTL, logger
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class HashRing:
+    """Consistent hash ring assigning keys to workers.
+
+    Every worker owns `vnodes` points on the ring and a key belongs to the worker of the
+    next point clockwise, so when a worker joins or leaves only its share of keys moves.
+    """
+
+    def __init__(self, workers: Iterable[int] = (), vnodes: int = SHARD_VNODES):
+        points = sorted((_hash(f"{worker}#{i}"), worker) for worker in workers for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._workers = [worker for _, worker in points]
+
+    def worker_for(self, key: str) -> Optional[int]:
+        if not self._workers:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._workers[index]
+
+class ShardLease:
+    """A poll worker's lease on its shard of sources.
+
+    The worker renews its heartbeat in the shared database every `interval` seconds and
+    builds the ring from the workers heard from within `ttl`, so the shard of a worker
+    that died is taken over by the others once its lease runs out.
+    """
+
+    def __init__(self, storage, worker_id: int, ttl: float = WORKER_LEASE_TTL,
+                 interval: float = WORKER_HEARTBEAT_INTERVAL):
+        self.storage = storage
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.interval = interval
+        self.workers: List[int] = []
+        self.ring = HashRing()
+
+    def renew(self):
+        self.storage.heartbeat(self.worker_id)
+        workers = self.storage.get_live_workers(self.ttl)
+        if workers != self.workers:
+            logger.info(f"Worker {self.worker_id}: live workers changed from {self.workers} to {workers}")
+            self.workers = workers
+            self.ring = HashRing(workers)
+            # Sources taken over continue from the cursors their previous worker committed
+            self.storage.reload_cursors()
+
+    def owns(self, key: str) -> bool:
+        return self.ring.worker_for(key) == self.worker_id
+
+    async def run(self):
+        """Keep the lease renewed until cancelled, then give it up."""
+        try:
+            while True:
+                try:
+                    self.renew()
+                except Exception as e:
+                    logger.error(f"Worker {self.worker_id}: error renewing lease: {e}")
+                await asyncio.sleep(self.interval)
+        finally:
+            self.storage.remove_worker(self.worker_id)
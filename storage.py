@@ -1,90 +1,781 @@
 import json
 import os
-from config import SOURCES_FILE, logger
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+from config import SOURCES_FILE, DATABASE_FILE, logger
+from metrics import STORAGE_WRITE_SECONDS
+
+SCHEMA_VERSION = 10
+
+# Tables refresh() reloads, each with a revision that triggers bump on every change
+SHARED_TABLES = ('sources', 'chats', 'subscriptions', 'filters', 'digests', 'breakers')
+# Bumped by queue_deliveries for messages left to the process that sends them
+OUTBOX_REVISION = 'outbox'
+
+@dataclass
+class Source:
+    """A news source and its polling cursor"""
+    __slots__ = ('source_type', 'id', 'name', 'last_post_id', 'resolved_id', 'resolved_at', 'state')
+    source_type: str
+    id: str
+    name: Optional[str]
+    last_post_id: Optional[int]
+    resolved_id: Optional[int]
+    resolved_at: Optional[float]
+    state: Optional[str]  # Adapter-specific polling state, e.g. a feed's ETag and seen GUIDs
 
 class Storage:
-    def __init__(self):
+    def __init__(self, path=DATABASE_FILE, source_types=()):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # WAL keeps readers unblocked and makes every commit atomic and crash-safe
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._migrate()
+        # Read before loading, so changes made meanwhile are picked up by the next refresh
+        self._data_version = self._get_data_version()
+        self._revisions = self._get_revisions()
+
+        # Sources indexed by type and then by ID; dicts keep insertion order
+        self.source_types = tuple(source_types)  # Types of the registered adapters, present even without sources
         self.sources = self._load_sources()
-        self.chat_ids = set()  # Store chat IDs where bot should send messages
+        self.chat_ids = self._load_chats()  # Store chat IDs where bot should send messages
+        # Inverted index: (source_type, source_id) -> subscribed chat IDs, and the reverse
+        self.subscribers, self.subscriptions = self._load_subscriptions()
+        self.filters = self._load_filters()  # Chat ID -> (action, kind, pattern) rules
+        self.digests = self._load_digests()  # Chat ID -> (interval, max_posts) of chats in digest mode
+
+    def _migrate(self):
+        """Bring the schema up to SCHEMA_VERSION, importing the legacy sources.json on first start"""
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            self._migrate_v1()
+        if version < 2:
+            self._migrate_v2()
+        if version < 3:
+            self._migrate_v3()
+        if version < 4:
+            self._migrate_v4()
+        if version < 5:
+            self._migrate_v5()
+        if version < 6:
+            self._migrate_v6()
+        if version < 7:
+            self._migrate_v7()
+        if version < 8:
+            self._migrate_v8()
+        if version < 9:
+            self._migrate_v9()
+        if version < 10:
+            self._migrate_v10()
+
+    def _migrate_v1(self):
+        """Sources and chats tables, filled from sources.json"""
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sources (
+                    source_type TEXT NOT NULL,
+                    source_id TEXT NOT NULL,
+                    name TEXT,
+                    last_post_id INTEGER,
+                    resolved_id INTEGER,
+                    resolved_at REAL,
+                    PRIMARY KEY (source_type, source_id)
+                )
+            """)
+            self.conn.execute('CREATE TABLE IF NOT EXISTS chats (chat_id INTEGER PRIMARY KEY)')
+            self._import_json()
+            self.conn.execute('PRAGMA user_version = 1')
 
-    def _load_sources(self):
-        """Load sources from JSON file"""
         if os.path.exists(SOURCES_FILE):
-            try:
-                with open(SOURCES_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # Initialize chat_ids from saved data
-                    self.chat_ids = set(data.get('chat_ids', []))
-                    return data.get('sources', {"vk": [], "twitter": []})
-            except json.JSONDecodeError:
-                logger.error("Error decoding sources file")
-                return {"vk": [], "twitter": []}
-        return {"vk": [], "twitter": []}
-
-    def _save_sources(self):
-        """Save sources to JSON file"""
+            os.replace(SOURCES_FILE, SOURCES_FILE + '.migrated')
+            logger.info(f"Migrated {SOURCES_FILE} into {DATABASE_FILE}")
+
+    def _migrate_v2(self):
+        """Per-chat subscriptions; existing chats keep receiving every existing source"""
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS subscriptions (
+                    chat_id INTEGER NOT NULL,
+                    source_type TEXT NOT NULL,
+                    source_id TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, source_type, source_id)
+                )
+            """)
+            self.conn.execute("""
+                INSERT OR IGNORE INTO subscriptions
+                SELECT chats.chat_id, sources.source_type, sources.source_id FROM chats, sources ORDER BY sources.rowid
+            """)
+            self.conn.execute('PRAGMA user_version = 2')
+
+    def _migrate_v3(self):
+        """Circuit breaker state of sources and platforms"""
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS breakers (
+                    scope TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    failures INTEGER NOT NULL,
+                    first_failure_at REAL,
+                    retry_at REAL,
+                    last_error TEXT,
+                    PRIMARY KEY (scope, key)
+                )
+            """)
+            self.conn.execute('PRAGMA user_version = 3')
+
+    def _migrate_v4(self):
+        """Per-source polling state kept by the source's adapter"""
+        with self.conn:
+            self.conn.execute('ALTER TABLE sources ADD COLUMN state TEXT')
+            self.conn.execute('PRAGMA user_version = 4')
+
+    def _migrate_v5(self):
+        """Poll worker leases and the posts they publish for the bot process to deliver"""
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id INTEGER PRIMARY KEY,
+                    pid INTEGER,
+                    heartbeat_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS published_posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source_type TEXT,
+                    source_id TEXT,
+                    payload TEXT NOT NULL,
+                    published_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute('PRAGMA user_version = 5')
+
+    def _migrate_v6(self):
+        """Per-chat filter rules"""
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS filters (
+                    chat_id INTEGER NOT NULL,
+                    action TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    pattern TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, action, kind, pattern)
+                )
+            """)
+            self.conn.execute('PRAGMA user_version = 6')
+
+    def _migrate_v7(self):
+        """Digest settings of chats"""
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS digests (
+                    chat_id INTEGER PRIMARY KEY,
+                    interval REAL NOT NULL,
+                    max_posts INTEGER NOT NULL
+                )
+            """)
+            self.conn.execute('PRAGMA user_version = 7')
+
+    def _migrate_v8(self):
+        """Outbox of messages to deliver, kept until Telegram accepts them"""
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY,
+                    chat_id INTEGER NOT NULL,
+                    key TEXT,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    sent_at REAL
+                )
+            """)
+            # Idempotency keys; messages without one (NULL) never conflict
+            self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS outbox_key ON outbox (chat_id, key)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (id) WHERE sent_at IS NULL')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS outbox_sent ON outbox (sent_at) WHERE sent_at IS NOT NULL')
+            self.conn.execute('PRAGMA user_version = 8')
+
+    def _migrate_v9(self):
+        """Posts waiting for a chat's digest, kept in the outbox with the time the digest is due"""
+        with self.conn:
+            self.conn.execute('ALTER TABLE outbox ADD COLUMN due_at REAL')
+            self.conn.execute('DROP INDEX IF EXISTS outbox_pending')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (id) WHERE sent_at IS NULL AND due_at IS NULL'
+            )
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS outbox_digest ON outbox (chat_id, id) '
+                'WHERE sent_at IS NULL AND due_at IS NOT NULL'
+            )
+            self.conn.execute('PRAGMA user_version = 9')
+
+    def _migrate_v10(self):
+        """Revisions of the shared tables, so other processes reload only the tables that changed"""
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS revisions (name TEXT PRIMARY KEY, revision INTEGER NOT NULL)')
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO revisions VALUES (?, 0)',
+                [(name,) for name in SHARED_TABLES + (OUTBOX_REVISION,)]
+            )
+            for table in SHARED_TABLES:
+                # Cursors and states move on every poll and are kept by the process polling the source
+                events = ('INSERT', 'DELETE', 'UPDATE OF name, resolved_id, resolved_at') if table == 'sources' \
+                    else ('INSERT', 'DELETE', 'UPDATE')
+                for event in events:
+                    self.conn.execute(
+                        f"CREATE TRIGGER IF NOT EXISTS {table}_{event.split()[0].lower()}_revision "
+                        f"AFTER {event} ON {table} "
+                        f"BEGIN UPDATE revisions SET revision = revision + 1 WHERE name = '{table}'; END"
+                    )
+            self.conn.execute('PRAGMA user_version = 10')
+
+    def _import_json(self):
+        """Copy sources and chats from the legacy JSON file into the database"""
+        if not os.path.exists(SOURCES_FILE):
+            return
         try:
-            data = {
-                'sources': self.sources,
-                'chat_ids': list(self.chat_ids)
-            }
-            with open(SOURCES_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            logger.error(f"Error saving sources: {e}")
+            with open(SOURCES_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            logger.error("Error decoding sources file, starting with empty storage")
+            return
+
+        for source_type, sources in data.get('sources', {}).items():
+            for source in sources:
+                self.conn.execute(
+                    'INSERT OR IGNORE INTO sources VALUES (?, ?, ?, ?, ?, ?)',
+                    (source_type, source['id'], source.get('name'), source.get('last_post_id'),
+                     source.get('resolved_id'), source.get('resolved_at'))
+                )
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO chats VALUES (?)',
+            [(chat_id,) for chat_id in data.get('chat_ids', [])]
+        )
+
+    def _load_sources(self):
+        """Load sources from the database"""
+        sources = {source_type: {} for source_type in self.source_types}
+        for row in self.conn.execute('SELECT * FROM sources ORDER BY rowid'):
+            sources.setdefault(row['source_type'], {})[row['source_id']] = Source(
+                row['source_type'],
+                row['source_id'],
+                row['name'],
+                row['last_post_id'],
+                row['resolved_id'],
+                row['resolved_at'],
+                row['state']
+            )
+        return sources
+
+    def _load_chats(self):
+        """Load chat IDs from the database"""
+        return {row['chat_id'] for row in self.conn.execute('SELECT chat_id FROM chats')}
+
+    def _load_subscriptions(self):
+        """Load per-chat subscriptions from the database"""
+        subscribers = {}
+        subscriptions = {}
+        for row in self.conn.execute('SELECT * FROM subscriptions ORDER BY rowid'):
+            key = (row['source_type'], row['source_id'])
+            subscribers.setdefault(key, set()).add(row['chat_id'])
+            subscriptions.setdefault(row['chat_id'], {})[key] = None
+        return subscribers, subscriptions
+
+    def _load_filters(self):
+        """Load per-chat filter rules from the database"""
+        filters = {}
+        for row in self.conn.execute('SELECT * FROM filters ORDER BY rowid'):
+            filters.setdefault(row['chat_id'], []).append((row['action'], row['kind'], row['pattern']))
+        return filters
+
+    def _load_digests(self):
+        """Load the digest settings of chats from the database"""
+        return {
+            row['chat_id']: (row['interval'], row['max_posts'])
+            for row in self.conn.execute('SELECT * FROM digests')
+        }
+
+    def _get_data_version(self):
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _get_revisions(self):
+        return {row['name']: row['revision'] for row in self.conn.execute('SELECT name, revision FROM revisions')}
+
+    def refresh(self):
+        """Reload the tables another process changed; returns the names of the revisions that moved.
+
+        Besides SHARED_TABLES, 'outbox' means another process left messages to send. Cursor
+        moves don't change the sources revision.
+        """
+        data_version = self._get_data_version()
+        if data_version == self._data_version:
+            return set()
+        self._data_version = data_version
+        revisions = self._get_revisions()
+        changed = {name for name, revision in revisions.items() if revision != self._revisions.get(name)}
+        self._revisions = revisions
+        if 'sources' in changed:
+            self.sources = self._load_sources()
+        if 'chats' in changed:
+            self.chat_ids = self._load_chats()
+        if 'subscriptions' in changed:
+            self.subscribers, self.subscriptions = self._load_subscriptions()
+        if 'filters' in changed:
+            self.filters = self._load_filters()
+        if 'digests' in changed:
+            self.digests = self._load_digests()
+        return changed
+
+    def reload_cursors(self):
+        """Take the cursors and states committed by other processes, e.g. for sources taken over from a poll worker"""
+        for row in self.conn.execute('SELECT source_type, source_id, last_post_id, state FROM sources'):
+            source = self.get_source(row['source_type'], row['source_id'])
+            if source is not None:
+                source.last_post_id = row['last_post_id']
+                source.state = row['state']
+
+    @contextmanager
+    def _write(self, operation):
+        """Write transaction, timed for the storage metrics"""
+        with STORAGE_WRITE_SECONDS.time(operation):
+            with self.conn:
+                yield
+        # This process's own changes need no reload, unless another process committed since the
+        # last refresh: then its changes may be among the revisions and are left to the refresh
+        revisions = self._get_revisions()
+        if self._get_data_version() == self._data_version:
+            self._revisions = revisions
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
 
     def add_chat(self, chat_id):
         """Add a chat ID to receive messages"""
         self.chat_ids.add(chat_id)
-        self._save_sources()
+        with self._write('add_chat'):
+            self.conn.execute('INSERT OR IGNORE INTO chats VALUES (?)', (chat_id,))
 
     def remove_chat(self, chat_id):
         """Remove a chat ID from receiving messages"""
         self.chat_ids.discard(chat_id)
-        self._save_sources()
+        with self._write('remove_chat'):
+            self.conn.execute('DELETE FROM chats WHERE chat_id = ?', (chat_id,))
 
     def get_chats(self):
         """Get all chat IDs"""
         return list(self.chat_ids)
 
-    def add_source(self, source_type, source_id, name):
+    def add_source(self, source_type, source_id, name, resolved_id=None):
         """Add a new source"""
-        if source_type not in self.sources:
-            self.sources[source_type] = []
+        sources = self.sources.setdefault(source_type, {})
 
         # Check if source already exists
-        if any(s['id'] == source_id for s in self.sources[source_type]):
+        if source_id in sources:
             return False
 
-        self.sources[source_type].append({
-            'id': source_id,
-            'name': name,
-            'last_post_id': None
-        })
-        self._save_sources()
+        source = Source(
+            source_type,
+            source_id,
+            name,
+            None,
+            resolved_id,
+            time.time() if resolved_id is not None else None,
+            None
+        )
+        with self._write('add_source'):
+            self.conn.execute(
+                'INSERT OR IGNORE INTO sources (source_type, source_id, name, last_post_id, resolved_id, resolved_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (source_type, source_id, name, None, source.resolved_id, source.resolved_at)
+            )
+        sources[source_id] = source
         return True
 
     def remove_source(self, source_type, source_id):
-        """Remove a source"""
-        if source_type in self.sources:
-            self.sources[source_type] = [
-                s for s in self.sources[source_type] if s['id'] != source_id
+        """Remove a source and its subscriptions, skipping the write when it doesn't exist"""
+        if self.sources.get(source_type, {}).pop(source_id, None) is None:
+            return False
+        key = (source_type, source_id)
+        for chat_id in self.subscribers.pop(key, ()):
+            self.subscriptions.get(chat_id, {}).pop(key, None)
+        with self._write('remove_source'):
+            self.conn.execute(
+                'DELETE FROM sources WHERE source_type = ? AND source_id = ?',
+                (source_type, source_id)
+            )
+            self.conn.execute(
+                'DELETE FROM subscriptions WHERE source_type = ? AND source_id = ?',
+                (source_type, source_id)
+            )
+            self.conn.execute(
+                "DELETE FROM breakers WHERE scope = 'source' AND key = ?",
+                (f"{source_type}:{source_id}",)
+            )
+        return True
+
+    def subscribe(self, chat_id, source_type, source_id):
+        """Subscribe a chat to a source; returns False if it already was"""
+        key = (source_type, source_id)
+        chats = self.subscribers.setdefault(key, set())
+        if chat_id in chats:
+            return False
+        chats.add(chat_id)
+        self.subscriptions.setdefault(chat_id, {})[key] = None
+        with self._write('subscribe'):
+            self.conn.execute('INSERT OR IGNORE INTO subscriptions VALUES (?, ?, ?)', (chat_id, source_type, source_id))
+        return True
+
+    def unsubscribe(self, chat_id, source_type, source_id):
+        """Unsubscribe a chat from a source; returns False if it wasn't subscribed"""
+        key = (source_type, source_id)
+        chats = self.subscribers.get(key)
+        if not chats or chat_id not in chats:
+            return False
+        chats.discard(chat_id)
+        if not chats:
+            del self.subscribers[key]
+        self.subscriptions.get(chat_id, {}).pop(key, None)
+        with self._write('unsubscribe'):
+            self.conn.execute(
+                'DELETE FROM subscriptions WHERE chat_id = ? AND source_type = ? AND source_id = ?',
+                (chat_id, source_type, source_id)
+            )
+        return True
+
+    def has_subscribers(self, source_type, source_id):
+        """Check if anyone is subscribed to a source, active or not"""
+        return bool(self.subscribers.get((source_type, source_id)))
+
+    def get_subscribers(self, source_type, source_id):
+        """Get the active chats subscribed to a source"""
+        return [
+            chat_id for chat_id in self.subscribers.get((source_type, source_id), ())
+            if chat_id in self.chat_ids
+        ]
+
+    def get_subscriptions(self, chat_id):
+        """Get the sources a chat is subscribed to, in subscription order"""
+        return [
+            self.sources[source_type][source_id]
+            for source_type, source_id in self.subscriptions.get(chat_id, {})
+        ]
+
+    def get_filters(self, chat_id):
+        """Get a chat's filter rules as (action, kind, pattern) tuples, in the order they were added"""
+        return list(self.filters.get(chat_id, ()))
+
+    def add_filter(self, chat_id, action, kind, pattern):
+        """Add a filter rule to a chat; returns False if it already has it"""
+        rule = (action, kind, pattern)
+        rules = self.filters.setdefault(chat_id, [])
+        if rule in rules:
+            return False
+        with self._write('add_filter'):
+            self.conn.execute('INSERT OR IGNORE INTO filters VALUES (?, ?, ?, ?)', (chat_id,) + rule)
+        rules.append(rule)
+        return True
+
+    def remove_filters(self, chat_id, rules):
+        """Remove filter rules of a chat; returns the number removed"""
+        current = self.filters.get(chat_id, [])
+        rules = [rule for rule in rules if rule in current]
+        if not rules:
+            return 0
+        with self._write('remove_filters'):
+            self.conn.executemany(
+                'DELETE FROM filters WHERE chat_id = ? AND action = ? AND kind = ? AND pattern = ?',
+                [(chat_id,) + rule for rule in rules]
+            )
+        self.filters[chat_id] = [rule for rule in current if rule not in rules]
+        if not self.filters[chat_id]:
+            del self.filters[chat_id]
+        return len(rules)
+
+    def get_digest(self, chat_id):
+        """Get a chat's (interval, max_posts) digest settings, or None if it gets posts one by one"""
+        return self.digests.get(chat_id)
+
+    def set_digest(self, chat_id, interval, max_posts):
+        """Switch a chat to digest mode, or change its digest settings"""
+        with self._write('set_digest'):
+            self.conn.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?)', (chat_id, interval, max_posts))
+        self.digests[chat_id] = (interval, max_posts)
+
+    def remove_digest(self, chat_id):
+        """Switch a chat back to getting posts one by one; returns False if it wasn't in digest mode"""
+        if chat_id not in self.digests:
+            return False
+        with self._write('remove_digest'):
+            self.conn.execute('DELETE FROM digests WHERE chat_id = ?', (chat_id,))
+        del self.digests[chat_id]
+        return True
+
+    def get_polled_sources(self):
+        """Get sources, by type, that have at least one active subscriber"""
+        polled = {}
+        for source_type, sources in self.sources.items():
+            polled[source_type] = [
+                source for source in sources.values()
+                if any(chat_id in self.chat_ids for chat_id in self.subscribers.get((source_type, source.id), ()))
             ]
-            self._save_sources()
-            return True
-        return False
+        return polled
+
+    def get_source(self, source_type, source_id) -> Optional[Source]:
+        """Get a single source by type and ID"""
+        return self.sources.get(source_type, {}).get(source_id)
 
     def get_sources(self, source_type=None):
         """Get all sources or sources of specific type"""
         if source_type:
-            return self.sources.get(source_type, [])
-        return self.sources
+            return list(self.sources.get(source_type, {}).values())
+        return {source_type: list(sources.values()) for source_type, sources in self.sources.items()}
 
     def update_last_post_id(self, source_type, source_id, post_id):
         """Update the last post ID for a source"""
-        for source in self.sources[source_type]:
-            if source['id'] == source_id:
-                source['last_post_id'] = post_id
-                self._save_sources()
-                return True
-        return False
+        return self.update_last_post_ids([(source_type, source_id, post_id)]) > 0
+
+    def update_last_post_ids(self, updates):
+        """Update the last post IDs of many sources in one transaction.
+
+        `updates` is an iterable of (source_type, source_id, post_id) tuples.
+        Returns the number of sources updated.
+        """
+        rows = []
+        for source_type, source_id, post_id in updates:
+            source = self.get_source(source_type, source_id)
+            if source is not None:
+                source.last_post_id = post_id
+                rows.append((post_id, source_type, source_id))
+        if rows:
+            with self._write('update_last_post_ids'):
+                self.conn.executemany(
+                    'UPDATE sources SET last_post_id = ? WHERE source_type = ? AND source_id = ?',
+                    rows
+                )
+        return len(rows)
+
+    def update_states(self, updates):
+        """Save the polling state of many sources in one transaction.
+
+        `updates` is an iterable of (source_type, source_id, state) tuples.
+        """
+        rows = []
+        for source_type, source_id, state in updates:
+            source = self.get_source(source_type, source_id)
+            if source is not None:
+                source.state = state
+                rows.append((state, source_type, source_id))
+        if rows:
+            with self._write('update_states'):
+                self.conn.executemany(
+                    'UPDATE sources SET state = ? WHERE source_type = ? AND source_id = ?',
+                    rows
+                )
+        return len(rows)
+
+    def update_resolved_id(self, source_type, source_id, resolved_id):
+        """Store the numeric platform ID a source name resolves to"""
+        source = self.get_source(source_type, source_id)
+        if source is None:
+            return False
+        source.resolved_id = resolved_id
+        source.resolved_at = time.time()
+        with self._write('update_resolved_id'):
+            self.conn.execute(
+                'UPDATE sources SET resolved_id = ?, resolved_at = ? WHERE source_type = ? AND source_id = ?',
+                (resolved_id, source.resolved_at, source_type, source_id)
+            )
+        return True
+
+    def get_stale_resolutions(self, ttl):
+        """Get sources whose resolved ID is missing or older than ttl seconds"""
+        now = time.time()
+        return [
+            source
+            for sources in self.sources.values()
+            for source in sources.values()
+            if source.resolved_id is None or now - (source.resolved_at or 0) > ttl
+        ]
+
+    def get_breakers(self, scope):
+        """Get the saved circuit breaker rows of a scope ('source' or 'platform')"""
+        return self.conn.execute(
+            'SELECT key, state, failures, first_failure_at, retry_at, last_error FROM breakers WHERE scope = ?',
+            (scope,)
+        ).fetchall()
+
+    def save_breakers(self, scope, rows, deleted=()):
+        """Save changed circuit breakers and delete closed ones in one transaction"""
+        if not rows and not deleted:
+            return
+        with self._write('save_breakers'):
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO breakers VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(scope,) + tuple(row) for row in rows]
+            )
+            self.conn.executemany(
+                'DELETE FROM breakers WHERE scope = ? AND key = ?',
+                [(scope, key) for key in deleted]
+            )
+
+    def heartbeat(self, worker_id):
+        """Renew a poll worker's lease"""
+        with self._write('heartbeat'):
+            self.conn.execute(
+                'INSERT OR REPLACE INTO workers VALUES (?, ?, ?)',
+                (worker_id, os.getpid(), time.time())
+            )
+
+    def remove_worker(self, worker_id):
+        """Give up a poll worker's lease so its shard is taken over right away"""
+        with self._write('remove_worker'):
+            self.conn.execute('DELETE FROM workers WHERE worker_id = ?', (worker_id,))
+
+    def get_live_workers(self, ttl):
+        """Get the IDs of poll workers whose lease was renewed within ttl seconds"""
+        return [
+            row['worker_id']
+            for row in self.conn.execute(
+                'SELECT worker_id FROM workers WHERE heartbeat_at > ? ORDER BY worker_id',
+                (time.time() - ttl,)
+            )
+        ]
+
+    def publish_posts(self, updates):
+        """Move source cursors and queue their new posts for delivery in one transaction.
+
+        `updates` is an iterable of (source, cursor, state, payloads) tuples, where the
+        source is the one the posts were fetched with. A source whose cursor or state
+        changed since then was polled by another worker meanwhile, so its posts are
+        dropped rather than published twice and it takes the cursor and state that worker
+        committed. Returns the sources that were dropped.
+        """
+        now = time.time()
+        dropped = []
+        applied = []
+        with self._write('publish_posts'):
+            for source, cursor, state, payloads in updates:
+                updated = self.conn.execute(
+                    'UPDATE sources SET last_post_id = ?, state = ? '
+                    'WHERE source_type = ? AND source_id = ? AND last_post_id IS ? AND state IS ?',
+                    (cursor, state, source.source_type, source.id, source.last_post_id, source.state)
+                ).rowcount
+                if not updated:
+                    dropped.append(source)
+                    continue
+                self.conn.executemany(
+                    'INSERT INTO published_posts (source_type, source_id, payload, published_at) VALUES (?, ?, ?, ?)',
+                    [(source.source_type, source.id, payload, now) for payload in payloads]
+                )
+                applied.append((source, cursor, state))
+        for source in dropped:
+            row = self.conn.execute(
+                'SELECT last_post_id, state FROM sources WHERE source_type = ? AND source_id = ?',
+                (source.source_type, source.id)
+            ).fetchone()
+            if row is not None:
+                applied.append((source, row['last_post_id'], row['state']))
+        for source, cursor, state in applied:
+            current = self.get_source(source.source_type, source.id)
+            if current is not None:
+                current.last_post_id = cursor
+                current.state = state
+        return dropped
+
+    def publish_notice(self, text):
+        """Queue a service message for the admin chat"""
+        with self._write('publish_notice'):
+            self.conn.execute(
+                'INSERT INTO published_posts (source_type, source_id, payload, published_at) VALUES (NULL, NULL, ?, ?)',
+                (json.dumps({'text': text}, ensure_ascii=False), time.time())
+            )
+
+    def get_published(self, limit):
+        """Get the oldest posts published by poll workers"""
+        return self.conn.execute(
+            'SELECT id, source_type, source_id, payload FROM published_posts ORDER BY id LIMIT ?',
+            (limit,)
+        ).fetchall()
+
+    def queue_deliveries(self, deliveries, cursors=(), states=(), published=(), acks=(), hand_off=False):
+        """Add messages to the outbox in one transaction with the cursor and state moves they result from.
+
+        `deliveries` is an iterable of (chat_id, key, payload, due_at) tuples, where due_at is
+        None for a message to send and a Unix time for a post waiting for the chat's digest;
+        a row whose key the chat already has in the outbox is skipped. `published` are IDs of
+        published posts handed over with them, `acks` IDs of outbox rows, such as the posts
+        of a digest, to mark delivered. `hand_off` leaves the messages to the process that
+        sends them, which finds the outbox revision changed on its next refresh. Returns
+        (id, chat_id, payload, due_at) of the rows added.
+        """
+        now = time.time()
+        cursor_rows = [(post_id, source_type, source_id) for source_type, source_id, post_id in cursors
+                       if self.get_source(source_type, source_id) is not None]
+        state_rows = [(state, source_type, source_id) for source_type, source_id, state in states
+                      if self.get_source(source_type, source_id) is not None]
+        queued = []
+        with self._write('queue_deliveries'):
+            for chat_id, key, payload, due_at in deliveries:
+                cursor = self.conn.execute(
+                    'INSERT OR IGNORE INTO outbox (chat_id, key, payload, created_at, due_at) VALUES (?, ?, ?, ?, ?)',
+                    (chat_id, key, payload, now, due_at)
+                )
+                if cursor.rowcount:
+                    queued.append((cursor.lastrowid, chat_id, payload, due_at))
+            self.conn.executemany(
+                'UPDATE sources SET last_post_id = ? WHERE source_type = ? AND source_id = ?', cursor_rows
+            )
+            self.conn.executemany('UPDATE sources SET state = ? WHERE source_type = ? AND source_id = ?', state_rows)
+            self.conn.executemany('DELETE FROM published_posts WHERE id = ?', [(post_id,) for post_id in published])
+            self.conn.executemany('UPDATE outbox SET sent_at = ? WHERE id = ?', [(now, i) for i in acks])
+            if hand_off and queued:
+                self.conn.execute('UPDATE revisions SET revision = revision + 1 WHERE name = ?', (OUTBOX_REVISION,))
+        for post_id, source_type, source_id in cursor_rows:
+            self.get_source(source_type, source_id).last_post_id = post_id
+        for state, source_type, source_id in state_rows:
+            self.get_source(source_type, source_id).state = state
+        return queued
+
+    def get_pending_deliveries(self, limit=None):
+        """Get (id, chat_id, payload) of the messages not delivered yet, oldest first"""
+        return self.conn.execute(
+            'SELECT id, chat_id, payload FROM outbox WHERE sent_at IS NULL AND due_at IS NULL ORDER BY id LIMIT ?',
+            (-1 if limit is None else limit,)
+        ).fetchall()
+
+    def get_digest_items(self, chat_id):
+        """Get (id, payload) of the posts waiting for a chat's digest, oldest first"""
+        return self.conn.execute(
+            'SELECT id, payload FROM outbox WHERE chat_id = ? AND sent_at IS NULL AND due_at IS NOT NULL ORDER BY id',
+            (chat_id,)
+        ).fetchall()
+
+    def get_digest_backlog(self):
+        """Get (chat_id, posts, due_at) of every chat with posts waiting for its digest, due_at of the earliest"""
+        return self.conn.execute(
+            'SELECT chat_id, COUNT(*), MIN(due_at) FROM outbox WHERE sent_at IS NULL AND due_at IS NOT NULL '
+            'GROUP BY chat_id'
+        ).fetchall()
+
+    def ack_deliveries(self, ids):
+        """Mark messages as delivered; their keys stay until the outbox is compacted"""
+        with self._write('ack_deliveries'):
+            self.conn.executemany('UPDATE outbox SET sent_at = ? WHERE id = ?', [(time.time(), i) for i in ids])
+
+    def compact_outbox(self, sent_before, created_before):
+        """Delete messages delivered before `sent_before` and pending ones queued before `created_before`.
+
+        Posts waiting for a digest count from the time the digest was due. Returns both counts.
+        """
+        with self._write('compact_outbox'):
+            compacted = self.conn.execute('DELETE FROM outbox WHERE sent_at < ?', (sent_before,)).rowcount
+            expired = self.conn.execute(
+                'DELETE FROM outbox WHERE sent_at IS NULL AND COALESCE(due_at, created_at) < ?', (created_before,)
+            ).rowcount
+        return compacted, expired
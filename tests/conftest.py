@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# Settings are read from the environment when config is imported, so they are set before any test module imports it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORKDIR = tempfile.mkdtemp(prefix='bot-tests-')
+os.chdir(WORKDIR)  # bot.log, bot.db and the other files the modules create go here
+os.environ.update({
+    'TELEGRAM_BOT_TOKEN': '123456:test',
+    'METRICS_PORT': '0',
+    'DATABASE_FILE': os.path.join(WORKDIR, 'bot.db'),
+    'ARCHIVE_FILE': os.path.join(WORKDIR, 'archive.db'),
+    'DEDUP_FILE': os.path.join(WORKDIR, 'dedup.bin'),
+})
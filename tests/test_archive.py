@@ -0,0 +1,47 @@
+import asyncio
+import time
+from datetime import datetime
+
+from adapters import Post
+from archive import Archive
+
+def post(post_id, text, age_days=0):
+    date = datetime.fromtimestamp(time.time() - age_days * 86400)
+    return Post(post_id, text, f"https://vk.com/wall-1_{post_id}", date)
+
+def test_search_ranks_matches_of_the_chat_sources_by_relevance(tmp_path):
+    async def run():
+        archive = Archive(str(tmp_path / 'archive.db'))
+        try:
+            archive.add('vk', 'news', [
+                post(1, 'Выборы мэра: на выборах победил действующий мэр, выборы признаны состоявшимися'),
+                post(2, 'Погода на выходные: солнечно, без осадков'),
+                post(3, 'Обзор недели: ремонт дорог, новый парк, концерт в филармонии и итоги выборов в совет'),
+            ])
+            archive.add('vk', 'other', [post(4, 'Выборы выборы выборы')])
+            await archive.flush()
+            hits = await archive.search('выборов', [('vk', 'news')])
+            assert [hit.link for hit in hits] == ['https://vk.com/wall-1_1', 'https://vk.com/wall-1_3']
+            assert 'выборах' in hits[0].snippet
+            assert await archive.search('выборы', []) == []
+        finally:
+            archive.close()
+
+    asyncio.run(run())
+
+def test_prune_drops_old_posts_from_the_index(tmp_path):
+    async def run():
+        archive = Archive(str(tmp_path / 'archive.db'))
+        try:
+            archive.add('vk', 'news', [post(1, 'Старая новость про бюджет', age_days=400),
+                                       post(2, 'Свежая новость про бюджет')])
+            await archive.flush()
+            assert archive.prune(time.time() - 365 * 86400) == 1
+            archive.compact()
+            hits = await archive.search('бюджет', [('vk', 'news')])
+            assert [hit.link for hit in hits] == ['https://vk.com/wall-1_2']
+            assert archive.prune(time.time() - 365 * 86400) == 0
+        finally:
+            archive.close()
+
+    asyncio.run(run())
@@ -0,0 +1,40 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from adapters import Post
+from cache import PostCache
+
+def posts(*ids):
+    return [Post(post_id, f"Пост {post_id}", f"https://vk.com/wall-1_{post_id}", datetime.now()) for post_id in ids]
+
+def test_cancelled_fetch_releases_its_waiters():
+    cache = PostCache()
+
+    async def fetch():
+        await asyncio.sleep(3600)
+
+    async def run():
+        first = asyncio.create_task(cache.get_or_fetch('vk:1', fetch))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_fetch('vk:1', fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(second, 1)
+        # The next click fetches again instead of waiting on the cancelled fetch
+        fetched = await cache.get_or_fetch('vk:1', lambda: asyncio.sleep(0, posts(1)))
+        assert [post.id for post in fetched] == [1]
+
+    asyncio.run(run())
+
+def test_polls_fill_an_uncached_source():
+    cache = PostCache(posts_per_source=3)
+    cache.add_new('vk:1', posts(2, 1))
+    assert cache.get('vk:1') is None
+    cache.add_new('vk:1', [])
+    cache.add_new('vk:1', posts(3))
+    assert [post.id for post in cache.get('vk:1')] == [3, 2, 1]
+    cache.add_new('vk:1', posts(4))
+    assert [post.id for post in cache.get('vk:1')] == [4, 3, 2]
@@ -0,0 +1,82 @@
+import asyncio
+import random
+import re
+import shutil
+import sqlite3
+import time
+from collections import Counter
+
+import bench
+import fakeapi
+
+FEEDS = 10
+CHATS = 5
+KILLS = 3
+ACK_BATCH = 20
+DELIVERY_WORKERS = 8
+
+ENV = dict(bench.DEFAULT_ENV, POLL_INTERVAL='0.5', POLL_MIN_INTERVAL='0.5', POLL_MAX_INTERVAL='1',
+           POLL_JITTER='0', SCHEDULER_TICK='0.1', TELEGRAM_CHAT_INTERVAL='0', DEDUP_MIN_TOKENS='1000',
+           OUTBOX_RETRY_INTERVAL='1', OUTBOX_ACK_INTERVAL='0.5', OUTBOX_ACK_BATCH=str(ACK_BATCH),
+           DELIVERY_WORKERS=str(DELIVERY_WORKERS),
+           # The bot's own working directory rather than the one conftest.py set up for this process
+           DATABASE_FILE='bot.db', ARCHIVE_FILE='archive.db', DEDUP_FILE='dedup.bin')
+
+# Synthetic posts start with "<feed title>: новость <number>."
+POST = re.compile(r'(Лента \d+): новость (\d+)\.')
+
+def delivered(sent: Counter) -> Counter:
+    """Times each (chat_id, feed, post number) was sent."""
+    posts = Counter()
+    for (chat_id, text), times in sent.items():
+        match = POST.search(text)
+        if match:
+            posts[(chat_id, match.group(1), int(match.group(2)))] += times
+    return posts
+
+async def run_with_kills(rng: random.Random):
+    fake = fakeapi.FakeAPI(rss=FEEDS, rate=2, backlog=5)
+    # Slow sends keep messages between queued, sent and marked when the process is killed
+    fake.faults['telegram'] = fakeapi.Faults(latency=0.01, jitter=0.03)
+    await fake.start(port=0)
+    run = bench.BotRun(fake, ENV)
+    sent = Counter()
+    try:
+        run.setup(CHATS, FEEDS)
+        for _ in range(KILLS):
+            await run.start()
+            await asyncio.sleep(rng.uniform(1, 2.5))
+            run.process.kill()
+            run.process.wait()
+            run.output.close()
+            sent.update(fake.sent)
+
+        # No new posts from here on, so the last run has a known set to deliver
+        for feed in fake.rss.values():
+            feed.backlog, feed.rate = feed.count(), 0
+        expected = {(chat_id, feed.title, number) for chat_id in range(1, CHATS + 1)
+                    for feed in fake.rss.values() for number in range(1, feed.count() + 1)}
+        await run.start()
+        deadline = time.monotonic() + 60
+        while not expected <= set(delivered(sent + fake.sent)) and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        await asyncio.sleep(1)
+        run.stop(keep=True)
+        sent.update(fake.sent)
+        with sqlite3.connect(f"{run.workdir}/bot.db") as conn:
+            unsent = conn.execute('SELECT COUNT(*) FROM outbox WHERE sent_at IS NULL').fetchone()[0]
+    finally:
+        run.stop()
+        shutil.rmtree(run.workdir, ignore_errors=True)
+        await fake.stop()
+    return expected, delivered(sent), unsent
+
+def test_killed_bot_delivers_every_post_at_least_once():
+    expected, posts, unsent = asyncio.run(run_with_kills(random.Random(0)))
+    assert expected - set(posts) == set()
+    assert set(posts) == expected
+    assert unsent == 0
+    # Only messages sent since the last written batch of acks, or still in a worker, may be sent again
+    repeats = sum(times - 1 for times in posts.values())
+    assert repeats <= KILLS * (ACK_BATCH + DELIVERY_WORKERS)
+    assert max(posts.values()) <= KILLS + 1
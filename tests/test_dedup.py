@@ -0,0 +1,58 @@
+import random
+
+from dedup import DedupIndex, _hash64, normalize, simhash
+
+def bitwise_simhash(tokens):
+    """SimHash as defined, one bit at a time; saved indexes hold fingerprints computed this way."""
+    weights = [0] * 64
+    for i in range(max(1, len(tokens) - 1)):
+        h = _hash64(' '.join(tokens[i:i + 2]))
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+def test_simhash_matches_the_bitwise_definition():
+    rng = random.Random(0)
+    words = ['новости', 'город', 'выборы', 'бюджет', 'data', 'release', 'https://example.com/a?utm_source=x']
+    # Even shingle counts have ties, which leave the bit unset
+    for length in list(range(1, 12)) + [rng.randint(12, 300) for _ in range(50)]:
+        tokens = normalize(' '.join(rng.choice(words) for _ in range(length)))
+        assert simhash(tokens) == bitwise_simhash(tokens)
+
+def test_copy_from_another_source_is_a_duplicate(tmp_path):
+    index = DedupIndex(str(tmp_path / 'dedup.bin'))
+    text = ('Центробанк сохранил ключевую ставку на прежнем уровне, сообщила пресс-служба регулятора. '
+            'Решение совпало с ожиданиями аналитиков, опрошенных накануне заседания. '
+            'Подробности: https://example.com/news/1?utm_source=vk')
+    index.remember(index.fingerprint(text), [1])
+    copy = text.replace('https://', 'https://www.').replace('utm_source=vk', 'utm_source=tw').upper()
+    assert index.duplicates_for(index.fingerprint(copy), [1]) == [1]
+    other = index.fingerprint('Сборная выиграла товарищеский матч со счётом 2:1, голы забили в первом тайме.')
+    assert index.duplicates_for(other, [1]) == []
+
+def test_copy_still_goes_to_chats_that_missed_the_story(tmp_path):
+    index = DedupIndex(str(tmp_path / 'dedup.bin'))
+    text = ('Центробанк сохранил ключевую ставку на прежнем уровне, сообщила пресс-служба регулятора. '
+            'Решение совпало с ожиданиями аналитиков, опрошенных накануне заседания.')
+    fingerprint = index.fingerprint(text)
+    index.remember(fingerprint, [1])
+    assert index.duplicates_for(fingerprint, [1, 2]) == [1]
+    index.remember(fingerprint, [2])
+    assert index.duplicates_for(fingerprint, [1, 2]) == [1, 2]
+
+    index.save()
+    loaded = DedupIndex(index.path)
+    loaded.load()
+    assert loaded.duplicates_for(fingerprint, [1, 2, 3]) == [1, 2]
+
+def test_forgetting_a_failed_delivery_keeps_earlier_recipients(tmp_path):
+    index = DedupIndex(str(tmp_path / 'dedup.bin'))
+    fingerprint = index.fingerprint('Центробанк сохранил ключевую ставку на прежнем уровне, сообщила пресс-служба.')
+    index.remember(fingerprint, [1])
+    added = []
+    index.remember(fingerprint, [1, 2], added)
+    assert added == [(fingerprint, frozenset([2]))]
+    index.forget(added)
+    assert index.duplicates_for(fingerprint, [1, 2]) == [1]
+    index.forget([(fingerprint, frozenset([1]))])
+    assert len(index) == 0
@@ -0,0 +1,94 @@
+import sqlite3
+import time
+
+import pytest
+
+from digest import DigestBuffer, DigestItem
+from outbox import Outbox
+from storage import Storage
+
+class RecordingDelivery:
+    def __init__(self):
+        self.sent = []
+
+    def enqueue(self, chat_id, payload, outbox_id=None):
+        self.sent.append((chat_id, payload, outbox_id))
+
+def collect(outbox, digests, chat_id, count, interval=3600, max_posts=50):
+    """Store posts for a chat's digest the way main.queue_posts does."""
+    items = [
+        (chat_id, f"vk:1:{number}:digest",
+         DigestItem('Source', f"Post {number} " + 'text ' * 100, f"https://example.com/{number}"),
+         time.time() + interval)
+        for number in range(count)
+    ]
+    for _, item_chat_id, due_at in outbox.queue([], digest_items=items):
+        digests.add(item_chat_id, due_at, max_posts)
+
+def test_digest_posts_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    storage = Storage(path)
+    outbox = Outbox(storage, RecordingDelivery())
+    collect(outbox, DigestBuffer(storage, outbox.queue), 7, 30)
+    storage.set_digest(7, 3600, 50)
+    storage.close()
+
+    # A new process finds the posts and the time their digest is due
+    storage = Storage(path)
+    delivery = RecordingDelivery()
+    outbox = Outbox(storage, delivery)
+    digests = DigestBuffer(storage, outbox.queue)
+    digests.restore()
+    assert digests.pending() == 30
+    assert digests._due_at[7] > time.time() + 3500
+    assert storage.get_pending_deliveries() == []
+
+    # Posts queued again after the restart are skipped by their keys
+    collect(outbox, digests, 7, 30)
+    assert digests.pending() == 30
+
+    digests.flush(7)
+    assert digests.pending() == 0
+    assert storage.get_digest_items(7) == []
+    assert len(delivery.sent) > 1 and all(chat_id == 7 for chat_id, _, _ in delivery.sent)
+    assert 'Post 29' in delivery.sent[-1][1]
+
+def test_flush_queues_every_part_at_once_and_keeps_posts_until_it_succeeds(tmp_path):
+    storage = Storage(str(tmp_path / 'bot.db'))
+    delivery = RecordingDelivery()
+    outbox = Outbox(storage, delivery)
+    calls = []
+
+    def queue(deliveries, **kwargs):
+        calls.append(deliveries)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError('database is locked')
+        return outbox.queue(deliveries, **kwargs)
+
+    digests = DigestBuffer(storage, queue)
+    collect(outbox, digests, 7, 30)
+
+    with pytest.raises(sqlite3.OperationalError):
+        digests.flush(7)
+    assert digests.pending() == 30
+    assert len(storage.get_digest_items(7)) == 30
+
+    digests.flush(7)
+    assert digests.pending() == 0
+    assert storage.get_digest_items(7) == []
+    assert len(calls) == 2 and calls[0] == calls[1]
+    assert len(calls[1]) > 1  # One queue call with all the messages of a digest too long for one
+    assert len(delivery.sent) == len(calls[1])
+
+def test_chat_leaving_digest_mode_in_another_process_gets_its_digest_now(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    storage = Storage(path)
+    outbox = Outbox(storage, RecordingDelivery())
+    digests = DigestBuffer(storage, outbox.queue)
+    storage.set_digest(7, 3600, 50)
+    collect(outbox, digests, 7, 3)
+
+    Storage(path).remove_digest(7)
+    assert 'digests' in storage.refresh()
+    digests.sync()
+    assert digests._due_at[7] <= time.time()
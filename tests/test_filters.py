@@ -0,0 +1,20 @@
+from filters import FilterEngine, INCLUDE, EXCLUDE, KEYWORD
+
+def test_rule_changes_rebuild_the_automaton_only_for_new_keywords():
+    engine = FilterEngine()
+    engine.set_rules(1, [(INCLUDE, KEYWORD, 'выборы'), (EXCLUDE, KEYWORD, 'реклама')])
+    engine.set_rules(2, [(INCLUDE, KEYWORD, 'спорт')])
+    assert engine.allowed_chats('Итоги выборы', [1, 2]) == [1]
+    assert engine.rebuilds == 1
+
+    # Dropping a chat's last use of a keyword and adding back one the automaton has
+    engine.set_rules(1, [(INCLUDE, KEYWORD, 'выборы')])
+    engine.set_rules(2, [(INCLUDE, KEYWORD, 'спорт'), (EXCLUDE, KEYWORD, 'реклама')])
+    engine.set_rules(1, [(INCLUDE, KEYWORD, 'спорт')])
+    assert engine.allowed_chats('спорт и реклама', [1, 2]) == [1]
+    assert engine.allowed_chats('выборы', [1, 2]) == []
+    assert engine.rebuilds == 1
+
+    engine.set_rules(2, [(INCLUDE, KEYWORD, 'погода')])
+    assert engine.allowed_chats('погода', [1, 2]) == [2]
+    assert engine.rebuilds == 2
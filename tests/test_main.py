@@ -0,0 +1,87 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+
+import main
+from adapters import Post
+from filters import EXCLUDE, KEYWORD
+from poller import PollResult
+
+def test_failed_outbox_write_leaves_dedup_and_digests_untouched(monkeypatch):
+    storage = main.storage
+    storage.add_source('vk', 'rollback', 'Rollback')
+    storage.update_last_post_id('vk', 'rollback', 10)
+    for chat_id in (101, 102):
+        storage.add_chat(chat_id)
+        storage.subscribe(chat_id, 'vk', 'rollback')
+    storage.set_digest(102, 3600, 50)
+    source = storage.get_source('vk', 'rollback')
+    posts = [Post(12, 'Центробанк сохранил ключевую ставку на прежнем уровне', 'https://vk.com/wall-1_12',
+                  datetime.now())]
+
+    async def fetch_all(sources):
+        return [PollResult('vk', source, posts)]
+
+    queue_deliveries = storage.queue_deliveries
+    failures = [sqlite3.OperationalError('database is locked')]
+
+    def flaky_queue_deliveries(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return queue_deliveries(*args, **kwargs)
+
+    enqueued = []
+    monkeypatch.setattr(main.poller, 'fetch_all', fetch_all)
+    monkeypatch.setattr(storage, 'queue_deliveries', flaky_queue_deliveries)
+    monkeypatch.setattr(main.outbox, '_enqueue', enqueued.extend)
+    duplicates = main.dedup_index.duplicates
+    fingerprints = len(main.dedup_index)
+    digest_posts = main.digests.pending()
+
+    asyncio.run(main.check_new_posts([('vk', 'rollback')]))
+    assert source.last_post_id == 10
+    assert len(main.dedup_index) == fingerprints
+    assert main.digests.pending() == digest_posts
+    assert enqueued == []
+
+    # The same post fetched again is delivered, not skipped as a duplicate of itself
+    asyncio.run(main.check_new_posts([('vk', 'rollback')]))
+    assert source.last_post_id == 12
+    assert main.dedup_index.duplicates == duplicates
+    assert main.digests.pending() == digest_posts + 1
+    assert [chat_id for _, chat_id, _ in enqueued] == [101]
+
+def test_post_every_filter_rejects_leaves_copies_from_other_sources_alone():
+    storage = main.storage
+    for chat_id, source_id in ((201, 'filtered'), (202, 'copy')):
+        storage.add_source('vk', source_id, source_id)
+        storage.add_chat(chat_id)
+        storage.subscribe(chat_id, 'vk', source_id)
+    main.filter_engine.set_rules(201, [(EXCLUDE, KEYWORD, 'ставку')])
+    post = Post(1, 'Центробанк сохранил ключевую ставку на прежнем уровне, решение совпало с ожиданиями',
+                'https://vk.com/wall-1_1', datetime.now())
+    try:
+        fingerprints = []
+        assert main.deliver_posts('vk', storage.get_source('vk', 'filtered'), [post], fingerprints) == ([], [])
+        assert fingerprints == []
+        deliveries, _ = main.deliver_posts('vk', storage.get_source('vk', 'copy'), [post], fingerprints)
+        assert [chat_id for chat_id, _, _ in deliveries] == [202]
+    finally:
+        main.filter_engine.set_rules(201, [])
+
+def test_copy_from_another_source_reaches_chats_that_only_follow_it():
+    storage = main.storage
+    for chat_id, source_id in ((301, 'first'), (302, 'second')):
+        storage.add_source('vk', source_id, source_id)
+        storage.add_chat(chat_id)
+        storage.subscribe(chat_id, 'vk', source_id)
+    storage.subscribe(302, 'vk', 'first')
+    storage.add_chat(303)
+    storage.subscribe(303, 'vk', 'second')
+    post = Post(1, 'Сборная выиграла товарищеский матч со счётом 2:1, голы забили в первом тайме',
+                'https://vk.com/wall-1_1', datetime.now())
+    fingerprints = []
+    deliveries, _ = main.deliver_posts('vk', storage.get_source('vk', 'first'), [post], fingerprints)
+    assert sorted(chat_id for chat_id, _, _ in deliveries) == [301, 302]
+    deliveries, _ = main.deliver_posts('vk', storage.get_source('vk', 'second'), [post], fingerprints)
+    assert [chat_id for chat_id, _, _ in deliveries] == [303]
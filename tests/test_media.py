@@ -0,0 +1,97 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from media import Album, MediaSender
+
+class FailingBot:
+    """Bot whose photo sends always fail, like a chat that went away mid-upload."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def send_photo(self, **kwargs):
+        self.calls += 1
+        raise RuntimeError('Bad Gateway')
+
+    async def send_media_group(self, **kwargs):
+        self.calls += 1
+        raise RuntimeError('Bad Gateway')
+
+def test_failed_upload_releases_downloaded_photos(monkeypatch):
+    async def run():
+        sender = MediaSender(FailingBot())
+
+        async def download(url):
+            return b'x' * 1024
+
+        monkeypatch.setattr(sender, '_download', download)
+        albums = [Album(['https://example.com/1.jpg']),
+                  Album(['https://example.com/2.jpg', 'https://example.com/3.jpg'])]
+        for album in albums:
+            sender.prefetch(album.photos)
+            with pytest.raises(RuntimeError):
+                await sender.send(1, album)
+        assert sender.bot.calls == 2
+        assert not sender._downloads
+
+    asyncio.run(run())
+
+def test_prefetched_photos_that_are_never_sent_are_capped(monkeypatch):
+    async def run():
+        sender = MediaSender(FailingBot(), max_downloads=5)
+
+        async def download(url):
+            return b'x' * 1024
+
+        monkeypatch.setattr(sender, '_download', download)
+        sender.prefetch([f"https://example.com/{i}.jpg" for i in range(20)])
+        assert list(sender._downloads) == [f"https://example.com/{i}.jpg" for i in range(15, 20)]
+        await asyncio.gather(*sender._downloads.values())
+
+    asyncio.run(run())
+
+class SlowBot:
+    """Bot whose album sends take a moment and whose first one fails."""
+
+    def __init__(self):
+        self.calls = 0
+        self.sending = 0
+        self.most_sending = 0
+
+    async def send_media_group(self, chat_id, media):
+        self.calls += 1
+        self.sending += 1
+        self.most_sending = max(self.most_sending, self.sending)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.sending -= 1
+        if self.calls == 1:
+            raise RuntimeError('Bad Gateway')
+        return [SimpleNamespace(photo=[SimpleNamespace(file_id=f"file{i}")]) for i in range(len(media.media))]
+
+def test_album_is_uploaded_by_one_chat_at_a_time_and_its_lock_dropped_after(monkeypatch):
+    async def run():
+        sender = MediaSender(SlowBot())
+        downloading = []
+
+        async def download(url):
+            downloading.append(url)
+            await asyncio.sleep(0.01)
+            return b'x' * 1024
+
+        monkeypatch.setattr(sender, '_download', download)
+        album = Album(['https://example.com/1.jpg', 'https://example.com/2.jpg'])
+        first, second = (asyncio.create_task(sender.send(chat_id, album)) for chat_id in (1, 2))
+        with pytest.raises(RuntimeError):
+            await first
+        # A chat arriving while the second one uploads waits for its file_ids
+        await asyncio.gather(second, sender.send(3, album))
+        assert sender.bot.most_sending == 1
+        assert (sender.uploads, sender.reuses) == (1, 1)
+        assert not sender._album_locks and not sender._album_waiters
+        assert len(downloading) == 4
+
+    asyncio.run(run())
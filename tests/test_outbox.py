@@ -0,0 +1,49 @@
+from delivery import SENT, FAILED
+from outbox import Outbox
+from storage import Storage
+
+class RecordingDelivery:
+    def __init__(self):
+        self.sent = []
+
+    def enqueue(self, chat_id, payload, outbox_id=None):
+        self.sent.append((chat_id, payload, outbox_id))
+
+def test_sent_messages_are_marked_in_one_write_and_not_resent_before_it(tmp_path, monkeypatch):
+    storage = Storage(str(tmp_path / 'bot.db'))
+    delivery = RecordingDelivery()
+    outbox = Outbox(storage, delivery)
+    outbox.queue([(7, f"key:{number}", f"Message {number}") for number in range(5)])
+    ids = [outbox_id for _, _, outbox_id in delivery.sent]
+    writes = []
+    ack_deliveries = storage.ack_deliveries
+    monkeypatch.setattr(storage, 'ack_deliveries', lambda ids: (writes.append(list(ids)), ack_deliveries(ids)))
+
+    for outbox_id in ids[:4]:
+        outbox.done(outbox_id, SENT)
+    outbox.done(ids[4], FAILED)
+    assert writes == []
+    # A resend before the flush picks up only the failed message
+    delivery.sent.clear()
+    outbox.restore()
+    assert [outbox_id for _, _, outbox_id in delivery.sent] == [ids[4]]
+
+    outbox.flush_acks()
+    assert writes == [ids[:4]]
+    assert [row[0] for row in storage.get_pending_deliveries()] == [ids[4]]
+    outbox.flush_acks()
+    assert len(writes) == 1
+
+def test_messages_of_a_process_that_does_not_send_are_picked_up_by_the_one_that_does(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    primary_storage, worker_storage = Storage(path), Storage(path)
+    delivery = RecordingDelivery()
+    primary = Outbox(primary_storage, delivery)
+    worker = Outbox(worker_storage, None)
+
+    primary.queue([(7, 'own', 'Своё сообщение')])
+    worker.send(7, 'Ответ из другого процесса')
+    assert primary_storage.refresh() == {'outbox'}
+    primary.pick_up()
+    assert [payload for _, payload, _ in delivery.sent] == ['Своё сообщение', 'Ответ из другого процесса']
+    assert primary_storage.refresh() == set()
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+from aiohttp import web
+
+import main
+from adapters import VKAdapter
+from breaker import CLOSED
+from health import PlatformHealth
+from parsers import VKParser
+from poller import Poller
+from ratelimit import RateLimitExceeded
+from rss import RSSParser
+from storage import Source
+
+def wall(newest_id: int, count: int = 10):
+    return [{'id': newest_id - i, 'owner_id': -1, 'text': f"post {newest_id - i}", 'date': 0} for i in range(count)]
+
+def test_rate_limit_while_paging_postpones_batch_without_tripping_breakers(monkeypatch):
+    retry_at = time.time() + 60
+    parser = VKParser('test')
+
+    def method(name, values=None, raw=False):
+        if name == 'execute':
+            # Both groups posted a full first page; 'behind' needs a second one to reach its cursor
+            return {'response': [{'items': wall(100)}, {'items': wall(200)}]}
+        raise RateLimitExceeded('vk', retry_at)
+
+    monkeypatch.setattr(parser.vk, 'method', method)
+    health = PlatformHealth()
+    health.mark_healthy('vk')
+    monkeypatch.setattr('poller.platform_health', health)
+    poller = Poller(main.registry)
+    adapter = VKAdapter(parser, poller.run, batch_size=25)
+    sources = [
+        Source('vk', 'behind', 'Behind', 50, 1, time.time(), None),
+        Source('vk', 'current', 'Current', 195, 2, time.time(), None),
+    ]
+
+    results = asyncio.run(poller.fetch_batch(adapter, sources))
+
+    assert [(result.source.id, result.error, result.retry_at) for result in results] == [
+        ('behind', None, retry_at), ('current', None, retry_at)
+    ]
+    main.record_breakers(results)
+    for source in sources:
+        breaker = main.source_breakers.get(f"vk:{source.id}")
+        assert (breaker.state, breaker.failures) == (CLOSED, 0)
+    assert main.platform_breakers.get('vk').failures == 0
+    assert main.storage.get_breakers('source') == []
+    assert main.storage.get_breakers('platform') == []
+
+def test_catch_up_stops_paging_at_the_bound(monkeypatch):
+    parser = VKParser('test')
+    offsets = []
+
+    def method(name, values=None, raw=False):
+        if name == 'execute':
+            return {'response': [{'items': wall(1000)}]}
+        offsets.append(values['offset'])
+        return {'items': wall(1000 - values['offset'], values['count'])}
+
+    monkeypatch.setattr(parser.vk, 'method', method)
+    monkeypatch.setattr('parsers.CATCHUP_MAX_POSTS', 150)
+    results = parser.get_new_posts_batch([Source('vk', 'behind', 'Behind', 1, 1, time.time(), None)])
+
+    assert [post.id for post in results['behind']] == list(range(1000, 850, -1))
+    # The first page came with the batch, the next two are paged; nothing beyond the bound is requested
+    assert offsets == [10, 110]
+
+class Feed:
+    """A feed server that answers conditional requests and records the headers they carried."""
+
+    def __init__(self):
+        self.guids = ['a', 'b', 'c']  # Newest first
+        self.version = 1
+        self.requests = []
+
+    async def handle(self, request):
+        etag, last_modified = f'"{self.version}"', f"Mon, 0{self.version} Jan 2024 00:00:00 GMT"
+        self.requests.append((request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')))
+        if request.headers.get('If-None-Match') == etag or request.headers.get('If-Modified-Since') == last_modified:
+            return web.Response(status=304)
+        items = ''.join(f"<item><title>Item {guid}</title><guid>{guid}</guid></item>" for guid in self.guids)
+        return web.Response(text=f'<rss version="2.0"><channel><title>Feed</title>{items}</channel></rss>',
+                            content_type='application/rss+xml', headers={'ETag': etag, 'Last-Modified': last_modified})
+
+def test_feed_is_fetched_conditionally_and_items_are_tracked_by_guid():
+    async def run():
+        feed = Feed()
+        app = web.Application()
+        app.router.add_get('/feed.xml', feed.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}/feed.xml"
+        parser = RSSParser()
+        try:
+            posts, state = await parser.get_new_posts(url, None)
+            assert [post.id for post in posts] == ['a', 'b', 'c']
+            assert feed.requests[-1] == (None, None)
+
+            # Unchanged: a 304 with the state kept as it was
+            assert await parser.get_new_posts(url, state) == ([], state)
+            assert feed.requests[-1] == ('"1"', 'Mon, 01 Jan 2024 00:00:00 GMT')
+
+            # A new item on top, the oldest one dropped; only the new one is returned
+            feed.guids, feed.version = ['d', 'a', 'b'], 2
+            posts, state = await parser.get_new_posts(url, state)
+            assert [post.id for post in posts] == ['d']
+
+            # An item the feed dropped and sends again isn't new either
+            feed.guids, feed.version = ['e', 'c', 'd'], 3
+            posts, state = await parser.get_new_posts(url, state)
+            assert [post.id for post in posts] == ['e']
+        finally:
+            await parser.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import pytest
+
+from adapters import AdapterRegistry, SourceAdapter
+from config import POLL_CONCURRENCY
+from health import PlatformHealth
+from poller import Poller, SourceSchedule
+from storage import Source, Storage
+
+def test_due_batch_is_filled_with_sources_due_soon():
+    schedule = SourceSchedule({'vk': 3, 'rss': 1})
+    schedule.sync({
+        'vk': [Source('vk', source_id, None, None, None, None, None) for source_id in ('now', 'tick', 'share', 'later', 'far')],
+        'rss': [Source('rss', 'soon', None, None, None, None, None)]
+    })
+    now = time.monotonic()
+    # Due in under a tick, within a tenth of a 600s interval, and in neither
+    for key, delay in ((('vk', 'tick'), 1), (('vk', 'share'), 50), (('vk', 'later'), 55), (('vk', 'far'), 200),
+                       (('rss', 'soon'), 1)):
+        state = schedule._states[key]
+        state.due_at = now + delay
+        schedule._push(key, state)
+
+    assert schedule.pop_due() == [('vk', 'now'), ('vk', 'tick'), ('vk', 'share')]
+    assert schedule.pop_due() == []
+
+    # Sources polled early are rescheduled from their poll like any other
+    for source_id in ('now', 'tick', 'share'):
+        schedule.complete('vk', source_id, 0)
+    assert all(schedule._states[('vk', source_id)].due_at > now + 500 for source_id in ('now', 'tick', 'share'))
+    assert schedule.pop_due() == []
+
+class MastodonAdapter(SourceAdapter):
+    source_type = 'mastodon'
+    concurrency = 2
+
+    async def resolve(self, source_id):
+        return source_id, None
+
+    async def fetch_new(self, source):
+        return []
+
+    async def fetch_latest(self, source, count=10):
+        return []
+
+def test_new_source_type_needs_only_an_adapter(tmp_path):
+    class Incomplete(SourceAdapter):
+        source_type = 'incomplete'
+
+        async def resolve(self, source_id):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete(None)
+
+    registry = AdapterRegistry()
+    poller = Poller(registry)
+    registry.register(MastodonAdapter(poller.run))
+
+    async def limits():
+        return [semaphore._value for semaphore in poller._semaphores('mastodon')]
+
+    assert asyncio.run(limits()) == [POLL_CONCURRENCY, 2]
+    poller.executor.shutdown()
+
+    storage = Storage(str(tmp_path / 'bot.db'), registry.types())
+    assert storage.get_sources() == {'mastodon': []}
+    storage.add_source('mastodon', 'news@example.social', 'News')
+    assert [source.id for source in storage.get_sources('mastodon')] == ['news@example.social']
+
+def test_platform_is_polled_once_its_credentials_were_checked(monkeypatch):
+    health = PlatformHealth()
+    monkeypatch.setattr('poller.platform_health', health)
+    registry = AdapterRegistry()
+    poller = Poller(registry)
+    registry.register(MastodonAdapter(poller.run))
+    source = Source('mastodon', 'news@example.social', None, None, None, None, None)
+
+    # The check runs in the background; until it's over, the platform's workers are left to it
+    assert asyncio.run(poller.fetch('mastodon', source)).retry_at > time.time()
+    health.mark_healthy('mastodon')
+    result = asyncio.run(poller.fetch('mastodon', source))
+    assert result.retry_at is None and result.error is None
+    poller.executor.shutdown()
@@ -0,0 +1,120 @@
+import asyncio
+import glob
+import json
+import os
+import signal
+import time
+from collections import Counter
+from datetime import datetime
+
+import bench
+import fakeapi
+import main
+from adapters import Post
+from poller import PollResult
+from sharding import ShardLease
+from storage import Storage
+from test_crash import delivered
+
+FEEDS = 20
+CHATS = 3
+WORKERS = 3
+
+ENV = dict(bench.DEFAULT_ENV, POLL_INTERVAL='0.5', POLL_MIN_INTERVAL='0.5', POLL_MAX_INTERVAL='1',
+           POLL_JITTER='0', SCHEDULER_TICK='0.1', TELEGRAM_CHAT_INTERVAL='0', DEDUP_MIN_TOKENS='1000',
+           POLL_WORKERS=str(WORKERS), WORKER_HEARTBEAT_INTERVAL='0.5', WORKER_LEASE_TTL='2', RELAY_INTERVAL='0.2',
+           # The bot's own working directory rather than the one conftest.py set up for this process
+           DATABASE_FILE='bot.db', ARCHIVE_FILE='archive.db', DEDUP_FILE='dedup.bin')
+
+def posts(*ids):
+    return [Post(post_id, f"Пост {post_id}", f"https://vk.com/wall-1_{post_id}", datetime.now())
+            for post_id in sorted(ids, reverse=True)]
+
+def publish(monkeypatch, storage, source, *ids):
+    monkeypatch.setattr(main, 'storage', storage)
+    main.publish_results([PollResult('vk', source, posts(*ids))])
+
+def poll_workers(pid: int):
+    """PIDs of the poll worker processes the bot process spawned."""
+    pids = []
+    for children in glob.glob(f"/proc/{pid}/task/*/children"):
+        with open(children) as f:
+            for child in f.read().split():
+                with open(f"/proc/{child}/cmdline", 'rb') as cmdline:
+                    if b'spawn_main' in cmdline.read():
+                        pids.append(int(child))
+    return pids
+
+async def run_with_killed_worker():
+    fake = fakeapi.FakeAPI(rss=FEEDS, rate=2, backlog=5)
+    await fake.start(port=0)
+    run = bench.BotRun(fake, ENV)
+    try:
+        run.setup(CHATS, FEEDS)
+        await run.start()
+        deadline = time.monotonic() + 30
+        while len(poll_workers(run.process.pid)) < WORKERS and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        workers = poll_workers(run.process.pid)
+        assert len(workers) == WORKERS
+        await asyncio.sleep(2)
+        # Its shard goes to the other workers once the lease expires, then back when it's restarted
+        os.kill(workers[0], signal.SIGKILL)
+        await asyncio.sleep(4)
+
+        # No new posts from here on, so the run has a known set to deliver
+        for feed in fake.rss.values():
+            feed.backlog, feed.rate = feed.count(), 0
+        expected = {(chat_id, feed.title, number) for chat_id in range(1, CHATS + 1)
+                    for feed in fake.rss.values() for number in range(1, feed.count() + 1)}
+        deadline = time.monotonic() + 60
+        while not expected <= set(delivered(fake.sent)) and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        await asyncio.sleep(2)
+        restarted = workers[0] not in poll_workers(run.process.pid) and len(poll_workers(run.process.pid)) == WORKERS
+    finally:
+        run.stop()
+        await fake.stop()
+    return expected, delivered(Counter(fake.sent)), restarted
+
+def test_poll_workers_deliver_every_post_exactly_once_when_one_is_killed():
+    expected, posts, restarted = asyncio.run(run_with_killed_worker())
+    assert restarted
+    assert expected - set(posts) == set()
+    assert set(posts) == expected
+    assert max(posts.values()) == 1
+
+def test_late_poll_after_a_lease_expired_is_dropped_and_the_shard_moves_back(tmp_path, monkeypatch):
+    path = str(tmp_path / 'bot.db')
+    first, second = Storage(path), Storage(path)
+    leases = {1: ShardLease(first, 1, ttl=0.5), 2: ShardLease(second, 2, ttl=0.5)}
+    for number in (1, 2, 1):
+        leases[number].renew()
+    assert leases[1].workers == leases[2].workers == [1, 2]
+    source_id = next(f"group{n}" for n in range(1000) if leases[1].owns(main.source_key('vk', f"group{n}")))
+    key = main.source_key('vk', source_id)
+    first.add_source('vk', source_id, 'Группа')
+    first.update_last_post_id('vk', source_id, 10)
+    second.refresh()
+
+    # Worker 1 starts polling, then stalls past its lease; worker 2 takes the shard over and polls too
+    polling = first.get_source('vk', source_id)
+    time.sleep(0.6)
+    leases[2].renew()
+    assert leases[2].workers == [2] and leases[2].owns(key)
+    publish(monkeypatch, second, second.get_source('vk', source_id), 11, 12)
+
+    # Worker 1's poll finishes with the cursor it started from and loses the compare-and-set
+    publish(monkeypatch, first, polling, 11, 12)
+    published = [json.loads(row['payload'])['id'] for row in first.get_published(100)]
+    assert published == [11, 12]
+    assert polling.last_post_id == 12
+
+    # Once worker 1 heartbeats again the shard moves back, and it polls on from the other worker's cursor
+    for number in (1, 2):
+        leases[number].renew()
+    assert leases[1].workers == leases[2].workers == [1, 2]
+    assert leases[1].owns(key) and not leases[2].owns(key)
+    publish(monkeypatch, first, first.get_source('vk', source_id), 13)
+    published = [json.loads(row['payload'])['id'] for row in second.get_published(100)]
+    assert published == [11, 12, 13]
@@ -0,0 +1,128 @@
+import sqlite3
+import time
+
+from storage import Storage
+
+def test_refresh_reloads_only_the_tables_another_process_changed(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    primary, worker = Storage(path), Storage(path)
+    primary.add_source('vk', 'refresh', 'Refresh')
+    assert worker.refresh() == {'sources'}
+    assert worker.get_source('vk', 'refresh').name == 'Refresh'
+
+    # Heartbeats and cursor moves change the database but none of the shared tables
+    primary.heartbeat(1)
+    primary.update_last_post_id('vk', 'refresh', 5)
+    assert worker.refresh() == set()
+    assert worker.refresh() == set()
+
+    worker.add_chat(5)
+    worker.subscribe(5, 'vk', 'refresh')
+    worker.set_digest(5, 600, 10)
+    assert primary.refresh() == {'chats', 'subscriptions', 'digests'}
+    assert primary.subscribers[('vk', 'refresh')] == {5}
+    assert primary.get_digest(5) == (600, 10)
+    assert primary.get_source('vk', 'refresh').last_post_id == 5
+
+def test_subscriptions_are_kept_per_chat(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    storage = Storage(path)
+    for source_id in ('first', 'second'):
+        storage.add_source('vk', source_id, source_id.title())
+    for chat_id in (1, 2):
+        storage.add_chat(chat_id)
+    assert storage.subscribe(1, 'vk', 'second')
+    assert storage.subscribe(1, 'vk', 'first')
+    assert not storage.subscribe(1, 'vk', 'first')
+    assert storage.subscribe(2, 'vk', 'first')
+    assert sorted(storage.get_subscribers('vk', 'first')) == [1, 2]
+    assert [source.id for source in storage.get_subscriptions(1)] == ['second', 'first']
+
+    # Unsubscribing one chat leaves the others' subscriptions alone
+    assert storage.unsubscribe(2, 'vk', 'first')
+    assert not storage.unsubscribe(2, 'vk', 'first')
+    assert not storage.unsubscribe(2, 'vk', 'second')
+    assert storage.get_subscribers('vk', 'first') == [1]
+    assert storage.get_subscriptions(2) == []
+
+    # A chat that stopped receiving messages keeps its subscriptions for when it comes back
+    storage.remove_chat(1)
+    assert storage.get_subscribers('vk', 'second') == []
+    assert storage.has_subscribers('vk', 'second')
+    storage.close()
+
+    reopened = Storage(path)
+    assert [source.id for source in reopened.get_subscriptions(1)] == ['second', 'first']
+    assert reopened.get_subscriptions(2) == []
+    assert not reopened.has_subscribers('vk', 'missing')
+
+def test_version_1_database_is_migrated_to_the_current_schema(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute("""
+            CREATE TABLE sources (
+                source_type TEXT NOT NULL,
+                source_id TEXT NOT NULL,
+                name TEXT,
+                last_post_id INTEGER,
+                resolved_id INTEGER,
+                resolved_at REAL,
+                PRIMARY KEY (source_type, source_id)
+            )
+        """)
+        conn.execute('CREATE TABLE chats (chat_id INTEGER PRIMARY KEY)')
+        conn.executemany('INSERT INTO sources VALUES (?, ?, ?, ?, ?, ?)', [
+            ('vk', 'old', 'Old', 42, 1, 1000.0), ('twitter', 'user', 'User', None, None, None)
+        ])
+        conn.executemany('INSERT INTO chats VALUES (?)', [(1,), (2,)])
+        conn.execute('PRAGMA user_version = 1')
+    conn.close()
+
+    storage = Storage(path)
+    assert storage.conn.execute('PRAGMA user_version').fetchone()[0] == 10
+    # Chats from before subscriptions keep getting every source
+    for chat_id in (1, 2):
+        assert [(source.source_type, source.id) for source in storage.get_subscriptions(chat_id)] == [
+            ('vk', 'old'), ('twitter', 'user')
+        ]
+    source = storage.get_source('vk', 'old')
+    assert (source.last_post_id, source.resolved_id, source.resolved_at, source.state) == (42, 1, 1000.0, None)
+
+    # Every later table works on the migrated database
+    storage.add_filter(1, 'exclude', 'keyword', 'спорт')
+    storage.set_digest(2, 600, 10)
+    storage.save_breakers('source', [('vk:old', 'open', 3, 1000.0, 2000.0, 'HTTP 500')])
+    storage.heartbeat(1)
+    storage.publish_notice('Проверка')
+    storage.queue_deliveries([(1, 'vk:old:43:0', 'Пост', None), (2, 'vk:old:43:digest', 'Пост', 2000.0)])
+    assert [row['chat_id'] for row in storage.get_pending_deliveries()] == [1]
+    assert len(storage.get_digest_items(2)) == 1
+
+    reopened = Storage(path)
+    storage.set_digest(2, 900, 10)
+    assert reopened.refresh() == {'digests'}
+    assert reopened.get_digest(2) == (900, 10)
+    storage.close()
+    assert reopened.get_filters(1) == [('exclude', 'keyword', 'спорт')]
+    assert [row['key'] for row in reopened.get_breakers('source')] == ['vk:old']
+
+def test_resolved_ids_expire_after_the_ttl(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    storage = Storage(path)
+    storage.add_source('vk', 'resolved', 'Resolved', resolved_id=1)
+    storage.add_source('vk', 'unresolved', 'Unresolved')
+    assert [source.id for source in storage.get_stale_resolutions(3600)] == ['unresolved']
+    with storage.conn:
+        storage.conn.execute("UPDATE sources SET resolved_at = ? WHERE source_id = 'resolved'", (time.time() - 3601,))
+    storage.close()
+
+    # An hour later the resolved ID is due for a refresh, which keeps it for another hour
+    storage = Storage(path)
+    assert [source.id for source in storage.get_stale_resolutions(3600)] == ['resolved', 'unresolved']
+    storage.update_resolved_id('vk', 'resolved', 2)
+    assert [source.id for source in storage.get_stale_resolutions(3600)] == ['unresolved']
+    storage.close()
+
+    reopened = Storage(path)
+    assert reopened.get_source('vk', 'resolved').resolved_id == 2
+    assert [source.id for source in reopened.get_stale_resolutions(3600)] == ['unresolved']
@@ -0,0 +1,79 @@
+import asyncio
+import hmac
+from typing import Optional
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+from config import WEBHOOK_MAX_HANDLERS, logger
+from metrics import UPDATE_SECONDS
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+class WebhookServer:
+    """aiohttp server that takes Telegram updates over HTTP and hands them to the dispatcher.
+
+    Every update is acknowledged as soon as a handler slot is free and then processed
+    in the background. At most `max_handlers` updates are processed at once; beyond
+    that the request waits for a slot, which holds Telegram back instead of piling
+    up tasks. Several processes can serve the same port with `reuse_port`.
+    """
+
+    def __init__(self, dp: Dispatcher, path: str, secret: Optional[str] = None,
+                 max_handlers: int = WEBHOOK_MAX_HANDLERS, on_update=None):
+        self.dp = dp
+        self.path = path
+        self.secret = secret
+        self.max_handlers = max_handlers
+        self.on_update = on_update  # Called before each update, e.g. to refresh shared state
+        self._semaphore = None
+        self._runner = None
+        self.handled = 0
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            return web.Response(status=403)
+        try:
+            update = types.Update(**await request.json())
+        except Exception as e:
+            logger.warning(f"Rejecting malformed webhook update: {e}")
+            return web.Response(status=400)
+
+        await self._semaphore.acquire()
+        asyncio.create_task(self._process(update))
+        return web.Response()
+
+    async def _process(self, update: types.Update):
+        try:
+            with UPDATE_SECONDS.time():
+                if self.on_update is not None:
+                    self.on_update()
+                await self.dp.process_updates([update])
+            self.handled += 1
+        except Exception as e:
+            logger.error(f"Error handling update {update.update_id}: {e}")
+        finally:
+            self._semaphore.release()
+
+    async def start(self, host: str, port: int, reuse_port: bool = False):
+        """Start serving updates on the running event loop."""
+        # Handlers use the bot and dispatcher of the current context, as in long polling
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        self._semaphore = asyncio.Semaphore(self.max_handlers)
+
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port, reuse_port=reuse_port).start()
+        logger.info(f"Serving webhook on http://{host}:{port}{self.path}")
+
+    async def stop(self):
+        """Stop taking updates and wait for the running handlers."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._semaphore is not None:
+            for _ in range(self.max_handlers):
+                await self._semaphore.acquire()